@@ -0,0 +1,316 @@
+import sys
+import os
+import json
+import time
+import random
+import hashlib
+import pathlib
+import argparse
+import platform
+import sqlite3
+import subprocess
+import contextlib
+from typing import Callable, Iterator, List
+
+from bs4 import BeautifulSoup
+
+import scrape
+import parse
+from commentdb import SqliteCommentDB, FilterMode, REJECTED, MAYBE
+
+
+# Times each stage of the pipeline (scrape's link following, parsing, import, navigation) on synthetic
+# thread pages, entirely offline, and writes the numbers as JSON so runs can be compared across commits:
+#
+#   python bench.py --rows 10000 --output-file before.json
+#
+# The generated pages are kept in --fixtures-dir and reused by later runs with the same parameters.
+# --input-dir benchmarks a directory of real scraped pages instead. bench.json records the generator
+# version and seed the pages came from and a hash of their contents, so two runs can be checked to have
+# measured the same input.
+
+# bump whenever generate_thread() or anything it draws on changes what it writes, so fixtures generated
+# by an older version aren't reused and results from different versions aren't compared
+GENERATOR_VERSION = 1
+
+THREAD_ID = 28719320
+POSTED_UNIXTIME = 1633100400 # 2021-10-01T15:00:00Z
+
+COMPANIES = ("Acme", "Initech", "Globex", "Hooli", "Umbrella", "Stark Industries", "Wayne Enterprises", "Pied Piper", "Vandelay", "Soylent")
+ROLES = ("Backend Engineer", "Senior Frontend Developer", "Staff SRE", "Data Scientist", "Engineering Manager", "Full Stack Engineer")
+PLACES = ("Denver, CO", "San Francisco, CA", "New York, NY", "London, UK", "Berlin, Germany", "Austin, TX", "Toronto, Canada")
+WORKPLACES = ("REMOTE", "Remote (US)", "ONSITE", "Hybrid", "Remote or onsite")
+WORDS = ("we", "are", "hiring", "engineers", "to", "build", "the", "platform", "python", "rust", "go", "postgres", "kubernetes",
+         "team", "product", "customers", "data", "scale", "growing", "funded", "series", "benefits", "equity", "visa", "apply")
+SEARCH_TERM = "kubernetes" # in most posts, for FilterMode.SEARCH
+
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20)))
+
+
+# a post using every tag format_comment knows about: <p>, <a>, <i>, <b>, <u>, <pre><code> and entities
+def post_html(rng: random.Random, n: int) -> str:
+    company = f"{rng.choice(COMPANIES)} {n}"
+    salary = rng.randrange(80, 250, 10)
+    header = f"{company} | {rng.choice(ROLES)} | {rng.choice(PLACES)} | {rng.choice(WORKPLACES)} | ${salary}k - ${salary + 40}k | https://example.com/{n}"
+
+    parts = [header]
+    for _ in range(rng.randint(1, 5)):
+        kind = rng.random()
+        if kind < 0.15:
+            parts.append(f"<p><pre><code>  {sentence(rng)}\n  {sentence(rng)}</code></pre>")
+        elif kind < 0.35:
+            url = f"https://example.com/jobs/{n}"
+            parts.append(f"<p>{sentence(rng)} <a href=\"{url}\" rel=\"nofollow\">{url}</a> &amp; {sentence(rng)}")
+        else:
+            parts.append(f"<p>{sentence(rng)} <i>{sentence(rng)}</i>, <b>{rng.choice(WORDS)}</b> and <u>{rng.choice(WORDS)}</u>.")
+    return "".join(parts)
+
+
+def reply_html(rng: random.Random) -> str:
+    return f"{sentence(rng)}<p>{sentence(rng)}"
+
+
+# one comment row, as HN renders it
+def comtr_row(comment_id: int, indent: int, text: str, author: str, posted_unixtime: int) -> str:
+    age = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(posted_unixtime))
+    return f"""<tr class='athing comtr' id='{comment_id}'><td><table border='0'>  <tr>    <td class='ind' indent='{indent}'><img src="s.gif" height="1" width="{indent * 40}"></td><td valign="top" class="votelinks">
+      <center><a id='up_{comment_id}' href='vote?id={comment_id}&amp;how=up&amp;goto=item%3Fid%3D{THREAD_ID}'><div class='votearrow' title='upvote'></div></a></center>    </td><td class="default"><div style="margin-top:2px; margin-bottom:-10px;"><span class="comhead">
+          <a href="user?id={author}" class="hnuser">{author}</a> <span class="age" title="{age} {posted_unixtime}"><a href="item?id={comment_id}">on Oct 1, 2021</a></span> <span id="unv_{comment_id}"></span><span class="navs"> | <a href="#{comment_id + 1}" class="clicky" aria-hidden="true">next</a> <a class="togg clicky" id="{comment_id}" n="1" href="javascript:void(0)">[&ndash;]</a><span class="onstory"></span>          </span>
+                  </span></div><br><div class="comment">
+                  <span class="commtext c00">{text}<div class='reply'>        <p><font size="1">
+                      <u><a href="reply?id={comment_id}&amp;goto=item%3Fid%3D{THREAD_ID}%23{comment_id}" rel="nofollow">reply</a></u>
+                  </font>
+      </div></span></div></td></tr>
+        </table></td></tr>"""
+
+
+def thread_page(pagenum: int, rows: List[str], last: bool) -> str:
+    more = "" if last else f"""<tr class="morespace" style="height:10px"></tr><tr><td class="title"><a href="item?id={THREAD_ID}&amp;p={pagenum + 1}" class="morelink" rel="next">More</a></td></tr>"""
+    return f"""<html lang="en" op="item"><head><title>Ask HN: Who is hiring? (October 2021) | Hacker News</title></head><body><center><table id="hnmain" border="0" cellpadding="0" cellspacing="0" width="85%">
+<tr><td><table class="fatitem" border="0"><tr class='athing' id='{THREAD_ID}'><td class="title">Ask HN: Who is hiring? (October 2021)</td></tr></table><br><br>
+<table border='0' class='comment-tree'>{"".join(rows)}</table>{more}</td></tr></table></center></body></html>"""
+
+
+# `rows` comment rows in all, about `reply_fraction` of them replies nested up to 3 deep, `rows_per_page` per page
+def generate_thread(output_dir: pathlib.Path, rows: int, reply_fraction: float, rows_per_page: int, seed: int) -> None:
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    def iter_rows() -> Iterator[str]:
+        indent = 0
+        for n in range(rows):
+            comment_id = THREAD_ID + 1 + n
+            author = f"user{rng.randrange(rows // 2 + 1)}"
+            posted = POSTED_UNIXTIME + n * 30
+            if n > 0 and rng.random() < reply_fraction:
+                indent = rng.randint(1, min(indent + 1, 3))
+                yield comtr_row(comment_id, indent, reply_html(rng), author, posted)
+            else:
+                indent = 0
+                yield comtr_row(comment_id, 0, post_html(rng, n), author, posted)
+
+    all_rows = list(iter_rows())
+    pages = [all_rows[i:i + rows_per_page] for i in range(0, len(all_rows), rows_per_page)]
+    for pagenum, page_rows in enumerate(pages, start=1):
+        with (output_dir / f"page{pagenum:0>2}.html").open(mode="wt", encoding="utf-8") as f:
+            f.write(thread_page(pagenum, page_rows, pagenum == len(pages)))
+
+
+# best of `repeat` runs of fn(), recorded under `name`. fn returns how many items it handled
+def timed(results: dict, name: str, fn: Callable[[], int], repeat: int) -> None:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    results[name] = {"seconds": best, "items": items, "per_item_us": best / items * 1e6 if items else None}
+    print(f"{name:<32} {best:>9.3f}s {items:>8} items {results[name]['per_item_us'] or 0:>10.1f}us/item", file=sys.stderr)
+
+
+# parse.py and friends report every skipped reply on stderr, which would swamp the results
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+        yield
+
+
+def bench_get_next_page(results: dict, bodies: List[str], repeat: int) -> None:
+    def run() -> int:
+        for body in bodies:
+            scrape.get_next_page(body)
+        return len(bodies)
+
+    timed(results, "get_next_page", run, repeat)
+
+
+def bench_format_comment(results: dict, bodies: List[str], repeat: int) -> None:
+    # the HTML parse is done up front, only the formatting is timed
+    spans = [span for body in bodies for span in BeautifulSoup(body, "html5lib").find_all("span", class_="commtext")]
+
+    def run() -> int:
+        with quiet():
+            for span in spans:
+                parse.format_comment(span)
+        return len(spans)
+
+    timed(results, "format_comment", run, repeat)
+
+    if "lxml" in parse.available_parsers():
+        lxml_spans = [span for body in bodies for span in parse.lxml.html.fromstring(body).xpath(f"//span[{parse._has_class('commtext')}]")]
+
+        def run_lxml() -> int:
+            with quiet():
+                for span in lxml_spans:
+                    parse.format_comment_lxml(span)
+            return len(lxml_spans)
+
+        timed(results, "format_comment_lxml", run_lxml, repeat)
+
+
+def bench_parse(results: dict, input_dir: pathlib.Path, json_path: pathlib.Path, jobs: int, repeat: int) -> None:
+    for parser_name in parse.available_parsers():
+        parse_args = argparse.Namespace(input_dir=str(input_dir), output_file=str(json_path), changed_only=False,
+                                        parser=parser_name, compare_parsers=False, jobs=jobs, store=None, thread_id=None)
+
+        def run() -> int:
+            with quiet():
+                parse.main(parse_args)
+            with json_path.open(mode="rt", encoding="utf-8") as f:
+                return sum(1 for _ in f)
+
+        timed(results, f"parse_main[{parser_name}]", run, repeat)
+
+
+def remove_db(db_path: pathlib.Path) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        pathlib.Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+
+
+def bench_import(results: dict, json_path: pathlib.Path, db_path: pathlib.Path, repeat: int) -> None:
+    def run() -> int:
+        remove_db(db_path)
+        with quiet(), json_path.open(mode="rt", encoding="utf-8") as f:
+            cdb = SqliteCommentDB.import_json_file(f, str(db_path))
+        count = cdb.dbconn.execute("select count(*) as n from comment").fetchone()["n"]
+        cdb.close()
+        return count
+
+    timed(results, "import_json_file", run, repeat)
+
+
+def bench_navigation(results: dict, db_path: pathlib.Path, repeat: int) -> None:
+    # a third each rejected, maybe'd and untouched, so every filter has something to skip over
+    dbconn = sqlite3.connect(db_path)
+    dbconn.execute(f"update comment set status = case comment_id % 3 when 0 then '{REJECTED}' when 1 then '{MAYBE}' end")
+    dbconn.commit()
+    dbconn.close()
+
+    with quiet():
+        cdb = SqliteCommentDB.from_db_file(str(db_path))
+    cdb.search_query = SEARCH_TERM
+
+    for mode in FilterMode:
+        cdb.filter_mode = mode
+
+        def run_next() -> int:
+            cdb.invalidate()
+            steps = 0
+            if cdb.first():
+                while cdb.next():
+                    steps += 1
+            return steps
+
+        def run_prev() -> int:
+            cdb.invalidate()
+            steps = 0
+            if cdb.last():
+                while cdb.prev():
+                    steps += 1
+            return steps
+
+        timed(results, f"next[{mode.name}]", run_next, repeat)
+        timed(results, f"prev[{mode.name}]", run_prev, repeat)
+
+    cdb.close()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args) -> int:
+    if args.input_dir:
+        input_dir = pathlib.Path(args.input_dir)
+    else:
+        input_dir = pathlib.Path(args.fixtures_dir) / f"v{GENERATOR_VERSION}_rows{args.rows}_replies{args.reply_fraction}_page{args.rows_per_page}_seed{args.seed}"
+        if not input_dir.exists():
+            print(f"generating {args.rows} rows into {input_dir}", file=sys.stderr)
+            generate_thread(input_dir, args.rows, args.reply_fraction, args.rows_per_page, args.seed)
+
+    page_paths = sorted(input_dir.rglob("*.html"), key=parse.page_sort_key)
+    if not page_paths:
+        print(f"ERROR: no pages in {input_dir}", file=sys.stderr)
+        return 1
+    bodies = [p.read_text(encoding="utf-8") for p in page_paths]
+    pages_sha256 = hashlib.sha256("".join(bodies).encode("utf-8")).hexdigest()
+
+    work_dir = pathlib.Path(args.fixtures_dir) / "work"
+    os.makedirs(work_dir, exist_ok=True)
+    json_path = work_dir / "comments.json"
+    db_path = work_dir / "comments.db"
+
+    stages = {}
+    bench_get_next_page(stages, bodies, args.repeat)
+    bench_format_comment(stages, bodies, args.repeat)
+    bench_parse(stages, input_dir, json_path, args.jobs, args.repeat)
+    bench_import(stages, json_path, db_path, args.repeat)
+    bench_navigation(stages, db_path, args.repeat)
+
+    output = {
+        "commit": git_commit(),
+        "run_unixtime": int(time.time()),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "params": {
+            "input_dir": str(input_dir),
+            "pages": len(page_paths),
+            "pages_sha256": pages_sha256,
+            "generator_version": GENERATOR_VERSION if not args.input_dir else None,
+            "rows": args.rows if not args.input_dir else None,
+            "reply_fraction": args.reply_fraction if not args.input_dir else None,
+            "rows_per_page": args.rows_per_page if not args.input_dir else None,
+            "seed": args.seed if not args.input_dir else None,
+            "jobs": args.jobs,
+            "repeat": args.repeat,
+        },
+        "stages": stages,
+    }
+    with open(args.output_file, mode="wt", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"results written to {args.output_file}", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the scrape, parse, import and review stages")
+    parser.add_argument("--rows", required=False, type=int, default=1000, help="Comment rows (posts and replies) in the generated thread")
+    parser.add_argument("--reply-fraction", required=False, type=float, default=0.5, help="Fraction of generated rows that are replies")
+    parser.add_argument("--rows-per-page", required=False, type=int, default=250, help="Comment rows per generated page")
+    parser.add_argument("--seed", required=False, type=int, default=1, help="Random seed for the generated thread")
+    parser.add_argument("--input-dir", required=False, help="Benchmark this directory of saved pages instead of generating a thread")
+    parser.add_argument("--fixtures-dir", required=False, default="bench_fixtures", help="Where generated pages and scratch files are kept")
+    parser.add_argument("--jobs", required=False, type=int, default=1, help="Passed to parse.py")
+    parser.add_argument("--repeat", required=False, type=int, default=3, help="Runs per stage, the best is reported")
+    parser.add_argument("--output-file", required=False, default="bench.json", help="JSON results file")
+    args = parser.parse_args()
+
+    sys.exit(main(args))
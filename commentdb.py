@@ -1,38 +1,250 @@
 from __future__ import annotations
 
+import os
 import time
 import json
+import mmap
 import enum
 import sqlite3
-from typing import Optional, TextIO
+import re
+import itertools
+import contextlib
+import collections
+import bisect
+import math
+import array
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Set, TextIO
 import sys
 
+from fields import FIELD_NAMES, extract_fields
+import minhash
+
+
+# per-post metadata from the comment row, see parse.py
+THREAD_KEYS = ("thread_id", "author", "posted_unixtime")
 
 REJECTED="REJECTED"
 MAYBE="MAYBE"
 
+# bounds of a sqlite integer
+MIN_COMMENT_ID = -2**63
+MAX_COMMENT_ID = 2**63 - 1
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_json_records(fd: TextIO) -> Iterator[dict]:
+    for line in fd:
+        if len(line.strip()) == 0:
+            continue
+        yield json.loads(line)
+
+
+UPDATE_STATUS_QUERY = """
+    update comment
+       set status = :status
+         , notes = :notes
+         , modified_unixtime = :modified_unixtime
+     where comment_id = :comment_id
+""".strip()
+
+
+# status_count trigger bodies for one row coming into/going out of the counts, {row} is new or old
+COUNT_ADD_TRIGGER_BODY = """
+    insert into status_count(thread_id, comments, rejected, maybe)
+    values (coalesce({row}.thread_id, 0), 1, coalesce({row}.status = 'REJECTED', 0), coalesce({row}.status = 'MAYBE', 0))
+    on conflict(thread_id) do update
+       set comments = comments + 1
+         , rejected = rejected + excluded.rejected
+         , maybe = maybe + excluded.maybe;
+""".strip()
+
+COUNT_REMOVE_TRIGGER_BODY = """
+    update status_count
+       set comments = comments - 1
+         , rejected = rejected - coalesce({row}.status = 'REJECTED', 0)
+         , maybe = maybe - coalesce({row}.status = 'MAYBE', 0)
+     where thread_id = coalesce({row}.thread_id, 0);
+""".strip()
+
+
+# background thread that owns its own connection and applies status updates in grouped transactions:
+# a batch is written once it's `flush_interval_ms` old or `max_batch` changes long, whichever comes first.
+# a batch that can't be written (the db locked by ingest.py or triage.py, say) is retried a few times, then
+# kept and tried again along with the next one; until it lands the pending overlay still shows it
+class StatusWriter(threading.Thread):
+    RETRY_DELAYS = (0.1, 0.5, 2.0)
+
+    def __init__(self, db_file_name: str, on_flushed: Callable[[List[dict]], None], flush_interval_ms: int = 250, max_batch: int = 25):
+        super().__init__(name="StatusWriter", daemon=True)
+        self.db_file_name = db_file_name
+        self.on_flushed = on_flushed
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+
+    def submit(self, params: dict) -> None:
+        self.queue.put(params)
+
+    # blocks until everything submitted so far is committed, or has been tried and failed
+    def flush(self) -> None:
+        done = threading.Event()
+        self.queue.put(done)
+        while not done.wait(timeout=0.5):
+            if not self.is_alive():
+                return
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.join()
+
+    def run(self) -> None:
+        # a short busy timeout, _write() does its own retrying
+        dbconn = sqlite3.connect(self.db_file_name, timeout=1.0)
+        stopping = False
+        unwritten = []
+        while not stopping:
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            batch = unwritten
+            waiters = []
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+
+                if stopping or waiters or len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+
+            try:
+                if batch and self._write(dbconn, batch):
+                    self.on_flushed(batch)
+                    unwritten = []
+                else:
+                    unwritten = batch
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+
+        if unwritten:
+            print(f"ERROR: {len(unwritten)} status change(s) could not be saved", file=sys.stderr)
+        dbconn.close()
+
+    # one transaction per batch. False if it still failed after every retry
+    def _write(self, dbconn: sqlite3.Connection, batch: List[dict]) -> bool:
+        for delay in (0,) + StatusWriter.RETRY_DELAYS:
+            time.sleep(delay)
+            try:
+                with dbconn:
+                    dbconn.executemany(UPDATE_STATUS_QUERY, batch)
+                return True
+            except sqlite3.Error as e:
+                print(f"couldn't save {len(batch)} status change(s), {e}", file=sys.stderr)
+        return False
+
 
 class FilterMode(enum.Enum):
     ALL = "All"
     ALL_UNSTATUSED = "All un-statused"
     MAYBE_ONLY = "MAYBE only"
     REJECTED_ONLY = "REJECTED only"
+    SEARCH = "Search"
 
 
-class CommentDB:
-    def __init__(self, data):
-        # data is a list of dicts
-        self.data = data
+def search_terms(text: str) -> List[str]:
+    return re.findall(r"\w+", text.casefold())
+
+
+# turns whatever has been typed so far into an FTS5 query: every word must appear, and the last
+# (or any) word may be a prefix. words are quoted so punctuation can't produce a syntax error
+def fts_query(text: str) -> str:
+    return " ".join(f'"{term}"*' for term in search_terms(text))
+
+
+# puts a SqliteCommentDB or LazyCommentDB back the way its load_session() says it was left: same thread,
+# filter and search, on the same post (or the first one passing the filter, if that's gone). a plain
+# CommentDB keeps no session
+def restore_session(cdb, session: dict) -> None:
+    cdb.thread_id = session["thread_id"]
+    cdb.search_query = session["search_query"]
+    cdb.set_field_filter(remote_only=session["remote_only"], locations=session["locations"], min_salary=session["min_salary"])
+    cdb.filter_mode = FilterMode(session["filter_mode"])
+    if session["comment_id"] is None or not cdb.goto(session["comment_id"]):
+        cdb.first()
 
-        # cursor is the current index into `data`
+
+class CommentDB:
+    # statuses are kept as small ints, index = code
+    STATUSES = (None, REJECTED, MAYBE)
+    STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+    FILTER_STATUS_CODES = {
+        FilterMode.ALL_UNSTATUSED: STATUS_CODES[None],
+        FilterMode.MAYBE_ONLY: STATUS_CODES[MAYBE],
+        FilterMode.REJECTED_ONLY: STATUS_CODES[REJECTED],
+    }
+    KNOWN_KEYS = ("comment_id", "body", "status", "notes", "modified_unixtime")
+
+    def __init__(self, data: Iterable[dict]):
+        # data is an iterable of dicts, stored column-wise: ids and status codes in arrays, every body
+        # in one string (sliced out by offset), and the rarely-set columns in dicts keyed by position
+        self.comment_ids = array.array("q")
+        self.statuses = array.array("b")
+        self.notes_by_position = {}
+        self.modified_by_position = {}
+        self.extras_by_position = {}
+
+        bodies = []
+        self.body_offsets = array.array("q", [0])
+        for position, element in enumerate(data):
+            self.comment_ids.append(element["comment_id"])
+            self.statuses.append(CommentDB.STATUS_CODES[element.get("status", None)])
+            if element.get("notes"):
+                self.notes_by_position[position] = element["notes"]
+            if element.get("modified_unixtime") is not None:
+                self.modified_by_position[position] = element["modified_unixtime"]
+            extra = {k: v for k, v in element.items() if k not in CommentDB.KNOWN_KEYS}
+            if extra:
+                self.extras_by_position[position] = extra
+
+            bodies.append(element["body"])
+            self.body_offsets.append(self.body_offsets[-1] + len(element["body"]))
+        self.body_buffer = "".join(bodies)
+
+        # status code -> sorted positions having it, so filtered navigation is a bisect instead of a scan
+        self.positions_by_status = {code: array.array("q") for code in range(len(CommentDB.STATUSES))}
+        for position, code in enumerate(self.statuses):
+            self.positions_by_status[code].append(position)
+
+        # cursor is the current position
         self.cursor = 0
 
         # filter mode determines what data elements will be included/skipped when moving the cursor
         self.filter_mode = FilterMode.ALL
 
+        # FilterMode.SEARCH matches bodies containing every word of search_query (as a prefix, like the FTS
+        # version); positions are worked out once per query
+        self.search_query = ""
+        self._search_positions = (None, None)
+
     @property
     def comment_id(self) -> int:
-        return self.data[self.cursor]["comment_id"]
+        return self.comment_ids[self.cursor]
 
     @property
     def url(self) -> str:
@@ -40,124 +252,615 @@ class CommentDB:
 
     @property
     def comment_text(self) -> str:
-        return self.data[self.cursor]["body"]
+        return self.body_buffer[self.body_offsets[self.cursor]:self.body_offsets[self.cursor+1]]
 
     @property
     def status(self) -> Optional[str]:
-        return self.data[self.cursor].get("status", None)
+        return CommentDB.STATUSES[self.statuses[self.cursor]]
 
     @property
     def modified_unixtime(self) -> Optional[int]:
-        return self.data[self.cursor].get("modified_unixtime", None)
+        return self.modified_by_position.get(self.cursor, None)
 
     @property
     def notes(self) -> Optional[str]:
-        return self.data[self.cursor].get("notes", None)
+        return self.notes_by_position.get(self.cursor, None)
 
     @property
     def as_json_record(self) -> str:
-        return json.dumps(self.data[self.cursor])
+        record = {"comment_id": self.comment_id, "body": self.comment_text}
+        record.update(self.extras_by_position.get(self.cursor, {}))
+        if self.status is not None:
+            record["status"] = self.status
+        if self.notes is not None:
+            record["notes"] = self.notes
+        if self.modified_unixtime is not None:
+            record["modified_unixtime"] = self.modified_unixtime
+        return json.dumps(record)
 
 
     @staticmethod
     def from_json_file(fd: TextIO) -> CommentDB:
-        data = [json.loads(x) for x in fd.readlines() if len(x) > 0]
-        return CommentDB(data)
+        return CommentDB(iter_json_records(fd))
 
 
-    # this is pretty dumb
-    def _passes_filter(self, element: dict) -> bool:
+    # positions passing the current filter, in order; None means all of them
+    @property
+    def _filtered_positions(self) -> Optional[array.array]:
         if self.filter_mode == FilterMode.ALL:
-            return True
-        elif self.filter_mode == FilterMode.ALL_UNSTATUSED:
-            return "status" not in element
-        elif self.filter_mode == FilterMode.MAYBE_ONLY:
-            return element.get("status", "") == MAYBE
-        elif self.filter_mode == FilterMode.REJECTED_ONLY:
-            return element.get("status", "") == REJECTED
+            return None
+        elif self.filter_mode == FilterMode.SEARCH:
+            return self._search_matches()
+        return self.positions_by_status[CommentDB.FILTER_STATUS_CODES[self.filter_mode]]
 
 
-    #def next(self) -> bool:
-    #    if self.cursor+1 > len(self.data):
-    #        return False
-    #
-    #    self.cursor += 1
-    #    return True
-    def next(self) -> bool:
-        temp_cursor = self.cursor
+    def _search_matches(self) -> Optional[array.array]:
+        terms = search_terms(self.search_query)
+        if not terms:
+            return None
 
-        while True:
-            temp_cursor += 1
+        query, positions = self._search_positions
+        if query != self.search_query:
+            positions = array.array("q")
+            for position in range(len(self.comment_ids)):
+                words = search_terms(self.body_buffer[self.body_offsets[position]:self.body_offsets[position+1]])
+                if all(any(word.startswith(term) for word in words) for term in terms):
+                    positions.append(position)
+            self._search_positions = (self.search_query, positions)
+        return positions
 
-            if temp_cursor >= len(self.data):
-                # we scrolled past the end of the data without finding an element that passes the filter
+
+    def next(self) -> bool:
+        positions = self._filtered_positions
+        if positions is None:
+            if self.cursor+1 >= len(self.comment_ids):
                 return False
+            self.cursor += 1
+            return True
 
-            if self._passes_filter(self.data[temp_cursor]):
-                self.cursor = temp_cursor
-                return True
+        i = bisect.bisect_right(positions, self.cursor)
+        if i >= len(positions):
+            # nothing past the cursor passes the filter
+            return False
+        self.cursor = positions[i]
+        return True
 
 
-    #def prev(self) -> bool:
-    #    if self.cursor-1 < 0:
-    #        return False
-    #
-    #    self.cursor -= 1
-    #    return True
     def prev(self) -> bool:
-        temp_cursor = self.cursor
-
-        while True:
-            temp_cursor -= 1
-
-            if temp_cursor < 0:
-                # we scrolled past the start of the data without finding an element that passes the filter
+        positions = self._filtered_positions
+        if positions is None:
+            if self.cursor-1 < 0:
                 return False
+            self.cursor -= 1
+            return True
 
-            if self._passes_filter(self.data[temp_cursor]):
-                self.cursor = temp_cursor
-                return True
+        i = bisect.bisect_left(positions, self.cursor)
+        if i == 0:
+            # nothing before the cursor passes the filter
+            return False
+        self.cursor = positions[i-1]
+        return True
 
 
     def first(self) -> bool:
-        self.cursor = 0
+        positions = self._filtered_positions
+        if positions is None:
+            positions = range(len(self.comment_ids))
+        if len(positions) == 0:
+            return False
+        self.cursor = positions[0]
         return True
 
 
     def last(self) -> bool:
-        self.cursor = len(self.data)-1
+        positions = self._filtered_positions
+        if positions is None:
+            positions = range(len(self.comment_ids))
+        if len(positions) == 0:
+            return False
+        self.cursor = positions[-1]
         return True
 
 
-    def reject(self, notes: str) -> None:
-        self.data[self.cursor]["status"] = REJECTED
+    # how many posts have each status, {None: n, REJECTED: n, MAYBE: n}
+    def status_counts(self) -> dict:
+        return {status: len(self.positions_by_status[code]) for code, status in enumerate(CommentDB.STATUSES)}
+
+
+    def _set_status(self, status: str, notes: str) -> None:
+        old_code = self.statuses[self.cursor]
+        new_code = CommentDB.STATUS_CODES[status]
+        if old_code != new_code:
+            old_positions = self.positions_by_status[old_code]
+            del old_positions[bisect.bisect_left(old_positions, self.cursor)]
+            bisect.insort(self.positions_by_status[new_code], self.cursor)
+            self.statuses[self.cursor] = new_code
+
         if notes:
-            self.data[self.cursor]["notes"] = notes
-        self.data[self.cursor]["modified_unixtime"] = int(time.time())
+            self.notes_by_position[self.cursor] = notes
+        self.modified_by_position[self.cursor] = int(time.time())
+
+
+    def reject(self, notes: str) -> None:
+        self._set_status(REJECTED, notes)
 
 
     def maybe(self, notes: str) -> None:
-        self.data[self.cursor]["status"] = MAYBE
-        if notes:
-            self.data[self.cursor]["notes"] = notes
-        self.data[self.cursor]["modified_unixtime"] = int(time.time())
+        self._set_status(MAYBE, notes)
+
+
+###############################################################################
+
+
+# CommentDB over a JSONL file left where it is. The file is memory-mapped and all that's held in memory is
+# an index, one entry per line: where it starts and ends, its comment_id, thread_id and status, picked
+# out of the raw bytes without decoding the line. Building it is one scan of the file, after that it's
+# saved next to it (<file>.idx) and reopening reads just that. A record is decoded when the cursor lands on
+# it. Status changes are appended to <file>.status.jsonl and laid over the file whenever it's opened, the
+# file itself is never written to.
+class LazyCommentDB(CommentDB):
+    INDEX_SUFFIX = ".idx"
+    OVERLAY_SUFFIX = ".status.jsonl"
+    SESSION_SUFFIX = ".session.json"
+    INDEX_VERSION = 1
+
+    # a key can only match outside the JSON strings, inside them the quotes would be escaped
+    COMMENT_ID_PATTERN = re.compile(rb'"comment_id":\s*(-?\d+)')
+    THREAD_ID_PATTERN = re.compile(rb'"thread_id":\s*(-?\d+)')
+    STATUS_PATTERN = re.compile(rb'"status":\s*"(\w+)"')
+
+    def __init__(self, file_name: str, save_index: bool = True, cache_size: int = 64):
+        self.file_name = file_name
+        self._file = open(file_name, mode="rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(self._file.fileno()).st_size else b""
+
+        # per line: starts/ends are byte offsets, thread_ids 0 where there isn't one
+        index = self._load_index()
+        if index is None:
+            index = self._build_index()
+            if save_index:
+                self._save_index(index)
+        self.starts, self.ends, self.comment_ids, self.thread_ids, self.statuses = index
+
+        # what CommentDB keeps for changed records, here only ever filled from the overlay
+        self.notes_by_position = {}
+        self.modified_by_position = {}
+        self._overlay_file = None
+        self._load_overlay()
+
+        self.positions_by_status = {code: array.array("q") for code in range(len(CommentDB.STATUSES))}
+        for position, code in enumerate(self.statuses):
+            self.positions_by_status[code].append(position)
+
+        self.cursor = 0
+        self.filter_mode = FilterMode.ALL
+        self.search_query = ""
+        self._search_positions = (None, None)
+
+        # None for every thread, otherwise navigation stays within this one; the positions that leaves
+        # for the current filter are kept, (key, positions)
+        self.thread_id = None
+        self._scoped_positions = (None, None)
+
+        # (thread_id, status code) -> posts, made the first time a thread's counts are asked for
+        self._thread_status_counts = None
+
+        # always off, see set_field_filter()
+        self.remote_only = False
+        self.locations = []
+        self.min_salary = None
+
+        # decoded records, position -> dict
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+        # (comment_ids sorted, their positions), made the first time a comment_id has to be looked up
+        self._id_index = None
+
+    def _index_key(self) -> dict:
+        stat = os.stat(self.file_name)
+        return {"version": LazyCommentDB.INDEX_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _build_index(self) -> tuple:
+        starts, ends, comment_ids, thread_ids, statuses = array.array("q"), array.array("q"), array.array("q"), array.array("q"), array.array("b")
+
+        data = self._mmap
+        start = 0
+        while start < len(data):
+            stop = data.find(b"\n", start)
+            if stop == -1:
+                stop = len(data)
+
+            # patterns search the map in place, nothing is copied out
+            match = LazyCommentDB.COMMENT_ID_PATTERN.search(data, start, stop)
+            if match is not None: # blank lines don't have one
+                starts.append(start)
+                ends.append(stop)
+                comment_ids.append(int(match.group(1)))
+                thread_match = LazyCommentDB.THREAD_ID_PATTERN.search(data, start, stop)
+                thread_ids.append(int(thread_match.group(1)) if thread_match else 0)
+                status_match = LazyCommentDB.STATUS_PATTERN.search(data, start, stop)
+                statuses.append(CommentDB.STATUS_CODES.get(status_match.group(1).decode() if status_match else None, 0))
+            start = stop + 1
+
+        return starts, ends, comment_ids, thread_ids, statuses
+
+    # a JSON header line saying which version of the file it's for, then the arrays back to back
+    def _save_index(self, index: tuple) -> None:
+        try:
+            with open(self.file_name + LazyCommentDB.INDEX_SUFFIX, mode="wb") as f:
+                f.write(json.dumps(dict(self._index_key(), count=len(index[0]))).encode("utf-8") + b"\n")
+                for values in index:
+                    values.tofile(f)
+        except OSError as e:
+            print(f"couldn't save the index: {e}", file=sys.stderr)
+
+    def _load_index(self) -> Optional[tuple]:
+        try:
+            with open(self.file_name + LazyCommentDB.INDEX_SUFFIX, mode="rb") as f:
+                header = json.loads(f.readline())
+                if {k: header.get(k) for k in ("version", "size", "mtime_ns")} != self._index_key():
+                    return None # the file has changed since
+                index = (array.array("q"), array.array("q"), array.array("q"), array.array("q"), array.array("b"))
+                for values in index:
+                    values.fromfile(f, header["count"])
+                return index
+        except (OSError, EOFError, ValueError):
+            return None
+
+    def _load_overlay(self) -> None:
+        overlay_file_name = self.file_name + LazyCommentDB.OVERLAY_SUFFIX
+        if not os.path.exists(overlay_file_name):
+            return
+
+        # later lines win
+        changes = {}
+        with open(overlay_file_name, mode="rt", encoding="utf-8") as f:
+            for change in iter_json_records(f):
+                changes[change["comment_id"]] = change
+
+        for position, comment_id in enumerate(self.comment_ids):
+            change = changes.get(comment_id)
+            if change is not None:
+                self.statuses[position] = CommentDB.STATUS_CODES[change["status"]]
+                if change.get("notes"):
+                    self.notes_by_position[position] = change["notes"]
+                self.modified_by_position[position] = change["modified_unixtime"]
+
+    def close(self) -> None:
+        if self._overlay_file is not None:
+            self._overlay_file.close()
+            self._overlay_file = None
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    # status changes are single appends already, nothing to put behind
+    def enable_write_behind(self, flush_interval_ms: int = 250, max_batch: int = 25) -> None:
+        pass
+
+    def flush(self) -> None:
+        if self._overlay_file is not None:
+            self._overlay_file.flush()
+
+    def invalidate(self) -> None:
+        self._cache.clear()
+
+
+    def _record(self, position: int) -> dict:
+        record = self._cache.get(position)
+        if record is None:
+            record = json.loads(self._mmap[self.starts[position]:self.ends[position]])
+            self._cache[position] = record
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(position)
+        return record
+
+    @property
+    def comment_text(self) -> str:
+        return self._record(self.cursor)["body"]
+
+    @property
+    def notes(self) -> Optional[str]:
+        return self.notes_by_position.get(self.cursor, self._record(self.cursor).get("notes"))
+
+    @property
+    def modified_unixtime(self) -> Optional[int]:
+        return self.modified_by_position.get(self.cursor, self._record(self.cursor).get("modified_unixtime"))
+
+    @property
+    def author(self) -> Optional[str]:
+        return self._record(self.cursor).get("author")
+
+    @property
+    def posted_unixtime(self) -> Optional[int]:
+        return self._record(self.cursor).get("posted_unixtime")
+
+    @property
+    def as_json_record(self) -> str:
+        record = dict(self._record(self.cursor))
+        record.update(status=self.status, notes=self.notes, modified_unixtime=self.modified_unixtime)
+        return json.dumps({k: v for k, v in record.items() if v is not None})
+
+
+    # newest first, like SqliteCommentDB.threads(); when each was posted would mean decoding every record
+    def threads(self) -> List[dict]:
+        counts = collections.Counter(self.thread_ids)
+        counts.pop(0, None)
+        return [{"thread_id": thread_id, "comments": counts[thread_id], "posted_unixtime": None} for thread_id in sorted(counts, reverse=True)]
+
+    def _search_matches(self) -> Optional[array.array]:
+        terms = search_terms(self.search_query)
+        if not terms:
+            return None
+
+        query, positions = self._search_positions
+        if query != self.search_query:
+            positions = array.array("q")
+            for position in range(len(self.comment_ids)):
+                # straight from the map, a search shouldn't flush the cache
+                words = search_terms(json.loads(self._mmap[self.starts[position]:self.ends[position]])["body"])
+                if all(any(word.startswith(term) for word in words) for term in terms):
+                    positions.append(position)
+            self._search_positions = (self.search_query, positions)
+        return positions
+
+    def search_count(self, text: str) -> int:
+        if text != self.search_query or self.filter_mode != FilterMode.SEARCH:
+            return 0
+        return len(self._filtered_positions or ())
+
+    @property
+    def _filtered_positions(self) -> Optional[array.array]:
+        positions = super()._filtered_positions
+        if self.thread_id is None:
+            return positions
+
+        key = (self.filter_mode, self.search_query, self.thread_id)
+        cached_key, scoped = self._scoped_positions
+        if cached_key != key:
+            candidates = range(len(self.comment_ids)) if positions is None else positions
+            scoped = array.array("q", (x for x in candidates if self.thread_ids[x] == self.thread_id))
+            self._scoped_positions = (key, scoped)
+        return scoped
+
+    # the fields aren't in the index, filtering on them would mean decoding everything
+    def set_field_filter(self, remote_only: bool = False, locations: Optional[List[str]] = None, min_salary: Optional[int] = None) -> None:
+        if remote_only or any(x.strip() for x in locations or []) or min_salary:
+            print("field filters need a db file, ignored", file=sys.stderr)
+
+    def similar_to(self, comment_id: Optional[int] = None, threshold: float = 0.6) -> Optional[dict]:
+        return None
+
+    def status_counts(self) -> dict:
+        if self.thread_id is None:
+            return super().status_counts()
+
+        if self._thread_status_counts is None:
+            self._thread_status_counts = collections.Counter(zip(self.thread_ids, self.statuses))
+        return {status: self._thread_status_counts[(self.thread_id, code)] for code, status in enumerate(CommentDB.STATUSES)}
+
+
+    # same as SqliteCommentDB's, kept in <file>.session.json
+    def save_session(self, ui_state: Optional[dict] = None) -> None:
+        session = {
+            "comment_id": self.comment_id if self.comment_ids else None,
+            "filter_mode": self.filter_mode.value,
+            "search_query": self.search_query,
+            "thread_id": self.thread_id,
+            "remote_only": False,
+            "locations": [],
+            "min_salary": None,
+            "ui_state": ui_state,
+            "saved_unixtime": int(time.time()),
+        }
+        session_file_name = self.file_name + LazyCommentDB.SESSION_SUFFIX
+        with open(session_file_name + ".tmp", mode="wt", encoding="utf-8") as f:
+            json.dump(session, f)
+        os.replace(session_file_name + ".tmp", session_file_name)
+
+    def load_session(self) -> Optional[dict]:
+        try:
+            with open(self.file_name + LazyCommentDB.SESSION_SUFFIX, mode="rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+    def _position(self, comment_id: int) -> Optional[int]:
+        if self._id_index is None:
+            order = sorted(range(len(self.comment_ids)), key=self.comment_ids.__getitem__)
+            self._id_index = (array.array("q", (self.comment_ids[x] for x in order)), array.array("q", order))
+
+        sorted_ids, positions = self._id_index
+        i = bisect.bisect_left(sorted_ids, comment_id)
+        if i < len(sorted_ids) and sorted_ids[i] == comment_id:
+            return positions[i]
+        return None
+
+    def goto(self, comment_id: int) -> bool:
+        position = self._position(comment_id)
+        if position is None:
+            return False
+
+        self.cursor = position
+        return True
+
+    # in file order, which isn't necessarily comment_id order
+    def filtered_ids(self) -> array.array:
+        positions = self._filtered_positions
+        if positions is None:
+            return array.array("q", self.comment_ids)
+        return array.array("q", (self.comment_ids[x] for x in positions))
+
+    def list_rows(self, comment_ids: Iterable[int]) -> List[dict]:
+        rows = []
+        for comment_id in comment_ids:
+            position = self._position(comment_id)
+            if position is None:
+                continue
+            record = self._record(position)
+            rows.append({
+                "comment_id": comment_id,
+                "header": record["body"][:200].split("\n", 1)[0],
+                "status": CommentDB.STATUSES[self.statuses[position]],
+                "notes": self.notes_by_position.get(position, record.get("notes")),
+                "modified_unixtime": self.modified_by_position.get(position, record.get("modified_unixtime")),
+            })
+        return rows
+
+
+    def _set_status(self, status: str, notes: str) -> None:
+        old_code = self.statuses[self.cursor]
+        super()._set_status(status, notes)
+
+        if self._thread_status_counts is not None:
+            self._thread_status_counts[(self.thread_ids[self.cursor], old_code)] -= 1
+            self._thread_status_counts[(self.thread_ids[self.cursor], self.statuses[self.cursor])] += 1
+
+        change = {
+            "comment_id": self.comment_id,
+            "status": status,
+            "notes": self.notes_by_position.get(self.cursor),
+            "modified_unixtime": self.modified_by_position[self.cursor],
+        }
+        if self._overlay_file is None:
+            self._overlay_file = open(self.file_name + LazyCommentDB.OVERLAY_SUFFIX, mode="at", encoding="utf-8")
+        self._overlay_file.write(json.dumps(change) + "\n")
+        self._overlay_file.flush()
+
+        # the thread-scoped positions only need fixing up for this one record, if they're for the scope it's
+        # in now. any other cached list may be missing it, or holding it, wrongly; it's worked out again
+        key, scoped = self._scoped_positions
+        if key != (self.filter_mode, self.search_query, self.thread_id) or self.thread_ids[self.cursor] != self.thread_id:
+            self._scoped_positions = (None, None)
+        elif self.filter_mode in CommentDB.FILTER_STATUS_CODES:
+            i = bisect.bisect_left(scoped, self.cursor)
+            present = i < len(scoped) and scoped[i] == self.cursor
+            passes = self.statuses[self.cursor] == CommentDB.FILTER_STATUS_CODES[self.filter_mode]
+            if present and not passes:
+                del scoped[i]
+            elif passes and not present:
+                scoped.insert(i, self.cursor)
 
 
 ###############################################################################
 
 
 class SqliteCommentDB:
-    def __init__(self, dbconn):
+    ADDED_COLUMNS = (
+        ("company", "text"), ("remote", "integer"), ("salary_min", "integer"), ("salary_max", "integer"),
+        ("thread_id", "integer"), ("author", "text"), ("posted_unixtime", "integer"),
+    )
+
+    def __init__(self, dbconn, prefetch_size: int = 25, cache_size: int = 200):
         dbconn.row_factory = SqliteCommentDB._dict_row
         self.dbconn = dbconn
 
-        self.filter_mode = FilterMode.ALL
+        self._filter_mode = FilterMode.ALL
+        self._search_query = ""
+
+        # None for every thread in the db, otherwise navigation, filters and search stay within this one
+        self._thread_id = None
+
+        # compound filters on the structured fields, ANDed with filter_mode; see set_field_filter()
+        self.remote_only = False
+        self.locations = []
+        self.min_salary = None
+
+        # navigation works on ids, full rows come from a bounded LRU cache (comment_id -> record)
+        self.current_id = None
+        self.cache_size = max(cache_size, prefetch_size)
+        self._cache = collections.OrderedDict()
+
+        # prefetch window: the ids passing the filter in [_window_lo, _window_hi], sorted, fetched (with their
+        # rows) in one query. next/prev within the window are a bisect, no SQL at all
+        self.prefetch_size = max(prefetch_size, 2)
+        self._invalidate_window()
+
+        # status changes not yet committed by the write-behind writer (comment_id -> update params),
+        # laid over anything read back from the table until they land
+        self._writer = None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+        # thread_id -> {status: posts}, read from status_count once and then kept up to date by _set_status(),
+        # since the table only catches up when the writer commits
+        self._status_counts = None
 
         self.first()
 
+    @property
+    def filter_mode(self) -> FilterMode:
+        return self._filter_mode
+
+    @filter_mode.setter
+    def filter_mode(self, value: FilterMode) -> None:
+        # pending changes may move records into the new filter, the table has to know about them first
+        self.flush()
+        self._filter_mode = value
+        self._invalidate_window()
+
+    @property
+    def thread_id(self) -> Optional[int]:
+        return self._thread_id
+
+    @thread_id.setter
+    def thread_id(self, value: Optional[int]) -> None:
+        self.flush()
+        self._thread_id = value
+        self._invalidate_window()
+
+    # the threads in the db, newest first, with how many posts each has and when the first was posted
+    def threads(self) -> List[dict]:
+        query = """
+            select thread_id
+                 , count(*) as comments
+                 , min(posted_unixtime) as posted_unixtime
+              from comment
+             where thread_id is not null
+             group by thread_id
+             order by thread_id desc
+        """.strip()
+        return self.dbconn.execute(query).fetchall()
+
+    # what FilterMode.SEARCH matches against, see fts_query()
+    @property
+    def search_query(self) -> str:
+        return self._search_query
+
+    @search_query.setter
+    def search_query(self, value: str) -> None:
+        self._search_query = value
+        self._invalidate_window()
+
+    # remote_only: only posts whose header says remote. locations: only posts naming one of these places
+    # (prefix match, any case). min_salary: only posts whose salary range reaches at least this much
+    def set_field_filter(self, remote_only: bool = False, locations: Optional[List[str]] = None, min_salary: Optional[int] = None) -> None:
+        self.flush()
+        self.remote_only = remote_only
+        self.locations = [x.strip() for x in (locations or []) if x.strip()]
+        self.min_salary = min_salary or None
+        self._invalidate_window()
+
+    @property
+    def current_record(self) -> dict:
+        record = self._cache.get(self.current_id)
+        if record is None:
+            query = "select * from comment where comment_id = :comment_id"
+            params = dict(comment_id=self.current_id)
+            pending = self._pending_snapshot()
+            record = self._apply_pending(self.dbconn.execute(query, params).fetchone(), pending)
+            self._cache_record(record)
+        else:
+            self._cache.move_to_end(self.current_id)
+        return record
+
     @property
     def comment_id(self) -> int:
-        return self.current_record["comment_id"]
+        return self.current_id
 
     @property
     def url(self) -> str:
@@ -179,6 +882,14 @@ class SqliteCommentDB:
     def notes(self) -> Optional[str]:
         return self.current_record.get("notes", None)
 
+    @property
+    def author(self) -> Optional[str]:
+        return self.current_record.get("author", None)
+
+    @property
+    def posted_unixtime(self) -> Optional[int]:
+        return self.current_record.get("posted_unixtime", None)
+
     @property
     def as_json_record(self) -> str:
         return json.dumps(self.current_record)
@@ -197,45 +908,427 @@ class SqliteCommentDB:
         dbconn = sqlite3.connect(db_file_name, check_same_thread=False)
 
         dbconn.execute("""
-            create table comment
+            create table if not exists comment
             (
               comment_id         integer primary key  not null
             , body               text                 not null
             , status             text
             , notes              text
             , modified_unixtime  integer
+            , company            text
+            , remote             integer
+            , salary_min         integer
+            , salary_max         integer
+            , thread_id          integer
+            , author             text
+            , posted_unixtime    integer
             )
         """.strip())
 
+        SqliteCommentDB._create_field_columns(dbconn)
+        SqliteCommentDB._create_search_index(dbconn)
+        SqliteCommentDB._create_similarity_index(dbconn)
+        SqliteCommentDB._create_session_tables(dbconn)
+
         dbconn.commit()
 
         return dbconn
 
 
+    # columns that came after the first version of the schema, ALTERed into older db files.
+    # returns the names of the ones that had to be added
     @staticmethod
-    def import_json_file(fd: TextIO, db_file_name: str) -> SqliteCommentDB:
-        dbconn = SqliteCommentDB._initialize_db(db_file_name)
+    def _add_missing_columns(dbconn: sqlite3.Connection) -> Set[str]:
+        existing = {row[1] for row in dbconn.execute("pragma table_info(comment)").fetchall()}
+        added = set()
+        for column, column_type in SqliteCommentDB.ADDED_COLUMNS:
+            if column not in existing:
+                dbconn.execute(f"alter table comment add column {column} {column_type}")
+                added.add(column)
+        return added
+
+
+    # structured fields pulled from each post's header line by fields.extract_fields(). a post can name
+    # several locations, so those get their own table
+    @staticmethod
+    def _create_field_columns(dbconn: sqlite3.Connection) -> None:
+        added = SqliteCommentDB._add_missing_columns(dbconn)
 
-        for line in fd.readlines():
-            if len(line) == 0:
-                continue
+        dbconn.execute("""
+            create table if not exists comment_location
+            (
+              location    text     not null  collate nocase
+            , comment_id  integer  not null
+            , primary key (location, comment_id)
+            )
+            without rowid
+        """.strip())
+
+        # a db from before the columns existed needs them filled in (thread_id & co. can't be, they
+        # aren't in the body, but importing the same thread again fills them)
+        if "company" in added:
+            rows = dbconn.execute("select comment_id, body from comment").fetchall()
+            records = SqliteCommentDB._with_fields({"comment_id": row[0], "body": row[1]} for row in rows)
+            for batch in batched(records, 500):
+                dbconn.executemany("""
+                    update comment
+                       set company = :company
+                         , remote = :remote
+                         , salary_min = :salary_min
+                         , salary_max = :salary_max
+                     where comment_id = :comment_id
+                """.strip(), batch)
+                SqliteCommentDB._insert_locations(dbconn, batch)
+            dbconn.commit()
+
+
+    # fills in whatever records from older parse.py output lack: the structured fields are computed,
+    # thread, author and post time are left unknown
+    @staticmethod
+    def _with_fields(records: Iterable[dict]) -> Iterator[dict]:
+        for record in records:
+            if not all(name in record for name in FIELD_NAMES):
+                record = dict(record, **extract_fields(record["body"]))
+            if not all(name in record for name in THREAD_KEYS):
+                record = dict({name: None for name in THREAD_KEYS}, **record)
+            yield record
+
+
+    @staticmethod
+    def _insert_locations(dbconn: sqlite3.Connection, records: List[dict]) -> None:
+        rows = [(location, record["comment_id"]) for record in records for location in record["locations"]]
+        dbconn.executemany("insert or ignore into comment_location(location, comment_id) values(?, ?)", rows)
+
+
+    # full-text index over comment bodies. it's an external-content table (it indexes comment.body rather
+    # than storing a copy) kept in step with the comment table by triggers
+    @staticmethod
+    def _create_search_index(dbconn: sqlite3.Connection) -> None:
+        exists_query = "select count(*) from sqlite_master where type = 'table' and name = 'comment_fts'"
+        already_existed = dbconn.execute(exists_query).fetchone()[0] > 0
 
-            temp_record = json.loads(line)
-            dbconn.execute("insert into comment(comment_id, body) values(:comment_id, :body)", temp_record)
+        dbconn.execute("""
+            create virtual table if not exists comment_fts
+            using fts5(body, content='comment', content_rowid='comment_id')
+        """.strip())
+        dbconn.execute("""
+            create trigger if not exists comment_fts_insert after insert on comment
+            begin
+                insert into comment_fts(rowid, body) values (new.comment_id, new.body);
+            end
+        """.strip())
+        dbconn.execute("""
+            create trigger if not exists comment_fts_delete after delete on comment
+            begin
+                insert into comment_fts(comment_fts, rowid, body) values ('delete', old.comment_id, old.body);
+            end
+        """.strip())
+        dbconn.execute("""
+            create trigger if not exists comment_fts_update after update of body on comment
+            begin
+                insert into comment_fts(comment_fts, rowid, body) values ('delete', old.comment_id, old.body);
+                insert into comment_fts(rowid, body) values (new.comment_id, new.body);
+            end
+        """.strip())
+
+        # a db from before the index existed has rows the triggers never saw
+        if not already_existed:
+            dbconn.execute("insert into comment_fts(comment_fts) values ('rebuild')")
+
+
+    # near-duplicate index, see minhash.py: a signature per post, and the LSH bucket each of its bands
+    # falls in. (band, bucket) leads the key so finding a bucket's posts is one seek
+    @staticmethod
+    def _create_similarity_index(dbconn: sqlite3.Connection) -> None:
+        dbconn.execute("""
+            create table if not exists comment_minhash
+            (
+              comment_id  integer primary key  not null
+            , signature   blob                 not null
+            )
+        """.strip())
+        dbconn.execute("""
+            create table if not exists comment_lsh
+            (
+              band        integer  not null
+            , bucket      integer  not null
+            , comment_id  integer  not null
+            , primary key (band, bucket, comment_id)
+            )
+            without rowid
+        """.strip())
+
+        SqliteCommentDB._index_similarity(dbconn)
+
+
+    # per-thread post counts by status, kept in step with the comment table by triggers (whoever does the
+    # writing: the write-behind writer, triage.py, imports), so a progress count is a lookup rather than a
+    # count(*). thread_id 0 stands for posts without one. and the one-row session table, see save_session()
+    @staticmethod
+    def _create_session_tables(dbconn: sqlite3.Connection) -> None:
+        exists_query = "select count(*) from sqlite_master where type = 'table' and name = 'status_count'"
+        already_existed = dbconn.execute(exists_query).fetchone()[0] > 0
 
+        dbconn.execute("""
+            create table if not exists status_count
+            (
+              thread_id  integer  primary key  not null
+            , comments   integer               not null
+            , rejected   integer               not null
+            , maybe      integer               not null
+            )
+        """.strip())
+        dbconn.execute(f"""
+            create trigger if not exists comment_count_insert after insert on comment
+            begin
+                {COUNT_ADD_TRIGGER_BODY.format(row="new")}
+            end
+        """.strip())
+        dbconn.execute(f"""
+            create trigger if not exists comment_count_delete after delete on comment
+            begin
+                {COUNT_REMOVE_TRIGGER_BODY.format(row="old")}
+            end
+        """.strip())
+        dbconn.execute(f"""
+            create trigger if not exists comment_count_update after update of status, thread_id on comment
+            begin
+                {COUNT_REMOVE_TRIGGER_BODY.format(row="old")}
+                {COUNT_ADD_TRIGGER_BODY.format(row="new")}
+            end
+        """.strip())
+
+        # a db from before the counts existed has rows the triggers never saw
+        if not already_existed:
+            dbconn.execute("""
+                insert into status_count(thread_id, comments, rejected, maybe)
+                select coalesce(thread_id, 0)
+                     , count(*)
+                     , sum(coalesce(status = 'REJECTED', 0))
+                     , sum(coalesce(status = 'MAYBE', 0))
+                  from comment
+                 group by coalesce(thread_id, 0)
+            """.strip())
+
+        dbconn.execute("""
+            create table if not exists session
+            (
+              session_id      integer  primary key  not null  check (session_id = 1)
+            , comment_id      integer
+            , filter_mode     text                  not null
+            , search_query    text                  not null
+            , thread_id       integer
+            , remote_only     integer               not null
+            , locations       text                  not null
+            , min_salary      integer
+            , ui_state        text
+            , saved_unixtime  integer               not null
+            )
+        """.strip())
         dbconn.commit()
 
+    # signs every post that isn't in the index yet, in bulk. expects tuple rows
+    @staticmethod
+    def _index_similarity(dbconn: sqlite3.Connection) -> int:
+        query = """
+            select comment_id, body
+              from comment
+             where comment_id not in (select comment_id from comment_minhash)
+        """.strip()
+        rows = dbconn.execute(query).fetchall()
+
+        indexed = 0
+        for batch in batched(minhash.index_rows(rows), 1000):
+            dbconn.executemany("insert or ignore into comment_minhash(comment_id, signature) values(?, ?)", [(c, sig) for c, sig, _ in batch])
+            dbconn.executemany("insert or ignore into comment_lsh(band, bucket, comment_id) values(?, ?, ?)",
+                               [(band, bucket, c) for c, _, buckets in batch for band, bucket in buckets])
+            indexed += len(batch)
+        dbconn.commit()
+
+        return indexed
+
+
+    # built after loading, cheaper than maintaining them row by row.
+    # every index implicitly ends with the rowid (comment_id), so comment_status_idx is really
+    # (status, comment_id): filtered next/prev is a seek on it that never touches the table
+    @staticmethod
+    def _create_indexes(dbconn: sqlite3.Connection) -> None:
+        dbconn.execute("create index if not exists comment_status_idx on comment(status)")
+        dbconn.execute("create index if not exists comment_company_idx on comment(company collate nocase)")
+        dbconn.execute("create index if not exists comment_remote_idx on comment(remote)")
+        dbconn.execute("create index if not exists comment_salary_idx on comment(salary_max)")
+        dbconn.execute("create index if not exists comment_thread_idx on comment(thread_id)")
+        dbconn.execute("create index if not exists comment_author_idx on comment(author)")
+        dbconn.execute("create index if not exists comment_posted_idx on comment(posted_unixtime)")
+        dbconn.commit()
+
+
+    # for the duration of a bulk load: WAL, no fsyncs, a bigger page cache, and everything in one transaction.
+    # expects a fresh connection (tuple rows), i.e. before it's been handed to SqliteCommentDB
+    @staticmethod
+    @contextlib.contextmanager
+    def _bulk_load(dbconn: sqlite3.Connection) -> Iterator[None]:
+        synchronous = dbconn.execute("pragma synchronous").fetchone()[0]
+        cache_size = dbconn.execute("pragma cache_size").fetchone()[0]
+        journal_mode = dbconn.execute("pragma journal_mode").fetchone()[0]
+
+        dbconn.execute("pragma journal_mode = WAL")
+        dbconn.execute("pragma synchronous = OFF")
+        dbconn.execute("pragma cache_size = -65536") # negative means KiB, so 64MB
+
+        try:
+            yield
+            dbconn.commit()
+        except:
+            dbconn.rollback()
+            raise
+        finally:
+            dbconn.execute(f"pragma synchronous = {synchronous}")
+            dbconn.execute(f"pragma cache_size = {cache_size}")
+            # the db is left in the mode it was found in, not WAL with its -wal/-shm files for good
+            dbconn.execute(f"pragma journal_mode = {journal_mode}")
+
+
+    # comments already in the table are left alone, so re-importing a thread is harmless.
+    # with commit_each_batch, whatever has been inserted so far is visible to other connections as it goes
+    @staticmethod
+    def insert_records(dbconn: sqlite3.Connection, records: Iterable[dict], batch_size: int = 500, commit_each_batch: bool = True) -> int:
+        query = """
+            insert into comment(comment_id, body, company, remote, salary_min, salary_max, thread_id, author, posted_unixtime)
+            values(:comment_id, :body, :company, :remote, :salary_min, :salary_max, :thread_id, :author, :posted_unixtime)
+            on conflict(comment_id) do nothing
+        """.strip()
+
+        # rows imported before parse.py recorded these get them the next time the thread comes through
+        backfill_query = """
+            update comment
+               set thread_id = :thread_id
+                 , author = :author
+                 , posted_unixtime = :posted_unixtime
+             where comment_id = :comment_id
+               and thread_id is null
+        """.strip()
+
+        # rowcount rather than total_changes, which would also count what the triggers and
+        # comment_location inserts write
+        inserted = 0
+        for batch in batched(SqliteCommentDB._with_fields(records), batch_size):
+            inserted += dbconn.executemany(query, batch).rowcount
+            dbconn.executemany(backfill_query, [record for record in batch if record["thread_id"] is not None])
+            SqliteCommentDB._insert_locations(dbconn, batch)
+            if commit_each_batch:
+                dbconn.commit()
+
+        return inserted
+
+
+    @staticmethod
+    def import_records(records: Iterable[dict], db_file_name: str, batch_size: int = 500, bulk: bool = True) -> SqliteCommentDB:
+        dbconn = SqliteCommentDB._initialize_db(db_file_name)
+
+        if bulk:
+            with SqliteCommentDB._bulk_load(dbconn):
+                count = SqliteCommentDB.insert_records(dbconn, records, batch_size, commit_each_batch=False)
+        else:
+            count = SqliteCommentDB.insert_records(dbconn, records, batch_size)
+        print(f"imported {count} new comment(s)", file=sys.stderr)
+
+        SqliteCommentDB._create_indexes(dbconn)
+        SqliteCommentDB._index_similarity(dbconn)
+
         return SqliteCommentDB(dbconn)
 
 
+    @staticmethod
+    def import_json_file(fd: TextIO, db_file_name: str) -> SqliteCommentDB:
+        return SqliteCommentDB.import_records(iter_json_records(fd), db_file_name, batch_size=5000)
+
+
     @staticmethod
     def from_db_file(db_file_name: str) -> SqliteCommentDB:
         dbconn = sqlite3.connect(db_file_name, check_same_thread=False)
+
+        # in case the file predates them
+        SqliteCommentDB._create_field_columns(dbconn)
+        SqliteCommentDB._create_search_index(dbconn)
+        SqliteCommentDB._create_similarity_index(dbconn)
+        SqliteCommentDB._create_session_tables(dbconn)
+        SqliteCommentDB._create_indexes(dbconn)
+
         return SqliteCommentDB(dbconn)
 
 
+    # from here on reject()/maybe() return immediately and a background thread commits them in groups.
+    # needs a file-backed db; WAL lets the writer's connection commit while this one keeps reading
+    def enable_write_behind(self, flush_interval_ms: int = 250, max_batch: int = 25) -> None:
+        db_file_name = self.dbconn.execute("pragma database_list").fetchone()["file"]
+        if not db_file_name:
+            print("write-behind needs a database file, staying synchronous", file=sys.stderr)
+            return
+
+        # close() puts it back, like _bulk_load does
+        self._journal_mode = self.dbconn.execute("pragma journal_mode").fetchone()["journal_mode"]
+        self.dbconn.execute("pragma journal_mode = WAL")
+        self._writer = StatusWriter(db_file_name, self._on_flushed, flush_interval_ms, max_batch)
+        self._writer.start()
+
+
+    def flush(self) -> None:
+        if self._writer is not None:
+            self._writer.flush()
+
+
+    # commits anything outstanding and stops the writer; call before exiting
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            # with the writer's connection gone this is the only one, so the db can leave WAL
+            self.dbconn.execute(f"pragma journal_mode = {self._journal_mode}")
+
+
+    # called on the writer thread
+    def _on_flushed(self, batch: List[dict]) -> None:
+        with self._pending_lock:
+            for params in batch:
+                if self._pending.get(params["comment_id"]) is params:
+                    del self._pending[params["comment_id"]]
+
+
+    # taken *before* reading rows: a change committed between the snapshot and the read is then applied
+    # twice (harmless), where a snapshot taken after could miss it entirely
+    def _pending_snapshot(self) -> dict:
+        with self._pending_lock:
+            return dict(self._pending)
+
+
+    def _apply_pending(self, record: dict, pending: dict) -> dict:
+        params = pending.get(record["comment_id"])
+        if params is not None:
+            record.update(status=params["status"], notes=params["notes"], modified_unixtime=params["modified_unixtime"])
+        return record
+
+
     @property
     def _filter_clause(self) -> str:
+        clauses = [self._filter_mode_clause]
+
+        if self.thread_id is not None:
+            clauses.append("(thread_id = :thread_id)")
+        if self.remote_only:
+            clauses.append("(remote = 1)")
+        if self.locations:
+            # LIKE 'prefix%' on a nocase column is an index range scan
+            matches = " or ".join(f"location like :location{i}" for i in range(len(self.locations)))
+            clauses.append(f"(comment_id in (select comment_id from comment_location where {matches}))")
+        if self.min_salary is not None:
+            clauses.append("(salary_max >= :min_salary)")
+
+        return " and ".join(clauses)
+
+
+    @property
+    def _filter_mode_clause(self) -> str:
         if self.filter_mode == FilterMode.ALL:
             return "(1=1)"
         elif self.filter_mode == FilterMode.ALL_UNSTATUSED:
@@ -244,96 +1337,450 @@ class SqliteCommentDB:
             return f"(status = '{MAYBE}')"
         elif self.filter_mode == FilterMode.REJECTED_ONLY:
             return f"(status = '{REJECTED}')"
+        elif self.filter_mode == FilterMode.SEARCH:
+            if not self._filter_params["search"]:
+                return "(1=1)"
+            return "(comment_id in (select rowid from comment_fts where comment_fts match :search))"
 
 
-    def next(self) -> bool:
+    # named parameters referenced by _filter_clause
+    @property
+    def _filter_params(self) -> dict:
+        params = {"search": fts_query(self.search_query), "thread_id": self.thread_id, "min_salary": self.min_salary}
+        for i, location in enumerate(self.locations):
+            params[f"location{i}"] = re.sub(r"[%_]", "", location) + "%"
+        return params
+
+
+    # python-side twin of _filter_clause, for keeping the prefetch window honest when a status changes
+    def _status_passes_filter(self, status: Optional[str]) -> bool:
+        if self.filter_mode == FilterMode.ALL:
+            return True
+        elif self.filter_mode == FilterMode.ALL_UNSTATUSED:
+            return status is None
+        elif self.filter_mode == FilterMode.MAYBE_ONLY:
+            return status == MAYBE
+        elif self.filter_mode == FilterMode.REJECTED_ONLY:
+            return status == REJECTED
+        elif self.filter_mode == FilterMode.SEARCH:
+            return True
+
+
+    def _cache_record(self, record: dict) -> None:
+        self._cache[record["comment_id"]] = record
+        self._cache.move_to_end(record["comment_id"])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+    # drops everything cached, for when the table has been changed behind our back
+    def invalidate(self) -> None:
+        self._cache.clear()
+        self._invalidate_window()
+        self._status_counts = None
+
+
+    def _invalidate_window(self) -> None:
+        self._window = []
+        self._window_lo = None
+        self._window_hi = None
+
+
+    def _window_covers(self, comment_id: int) -> bool:
+        return self._window_lo is not None and self._window_lo <= comment_id <= self._window_hi
+
+
+    # loads the next `prefetch_size` rows passing the filter, starting at (and including) start_id, which
+    # defaults to the current one
+    def _prefetch(self, forward: bool, start_id: Optional[int] = None) -> None:
         query = f"""
             select *
               from comment
-             where comment_id > :current_id
+             where comment_id {">=" if forward else "<="} :start_id
                and {self._filter_clause}
-             order by comment_id
-             limit 1
+             order by comment_id {"" if forward else "desc"}
+             limit :limit
         """.strip()
-        params = dict(current_id=self.comment_id)
-        for rec in self.dbconn.execute(query, params):
-            self.current_record = rec
-            return True
+
+        # when stepping from the current record, finding only that one again doesn't count as progress
+        skip_id = self.current_id if start_id is None else None
+        anchor_id = self.current_id if start_id is None else start_id
+        start_id = anchor_id
+        while True:
+            params = dict(start_id=start_id, limit=self.prefetch_size, **self._filter_params)
+            pending = self._pending_snapshot()
+            records = self.dbconn.execute(query, params).fetchall()
+            exhausted = len(records) < self.prefetch_size
+            bounding_id = records[-1]["comment_id"] if records else None
+
+            ids = []
+            for record in records:
+                self._cache_record(self._apply_pending(record, pending))
+                # the table may still have the old status for a record with a change pending
+                if self._status_passes_filter(record["status"]):
+                    ids.append(record["comment_id"])
+
+            if forward:
+                self._merge_window(ids, start_id, math.inf if exhausted else bounding_id, anchor_id)
+            else:
+                self._merge_window(ids[::-1], -math.inf if exhausted else bounding_id, start_id, anchor_id)
+
+            # a page can come back entirely hidden by pending changes, keep going until there's
+            # somewhere to move to
+            if exhausted or any(x != skip_id for x in ids):
+                return
+            start_id = bounding_id
+
+
+    def _merge_window(self, ids: List[int], lo: float, hi: float, anchor_id: int) -> None:
+        # joined onto the existing window when they touch, so going back and forth doesn't re-query
+        if self._window_lo is not None and lo <= self._window_hi and hi >= self._window_lo:
+            ids = sorted(set(self._window).union(ids))
+            lo = min(lo, self._window_lo)
+            hi = max(hi, self._window_hi)
+        self._window, self._window_lo, self._window_hi = ids, lo, hi
+
+        # but kept bounded, trimming whichever side is further from where the prefetch started
+        limit = 4 * self.prefetch_size
+        if len(self._window) > limit:
+            center = bisect.bisect_left(self._window, anchor_id)
+            start = max(0, min(center - limit // 2, len(self._window) - limit))
+            kept = self._window[start:start+limit]
+            if start > 0:
+                self._window_lo = kept[0]
+            if start + limit < len(self._window):
+                self._window_hi = kept[-1]
+            self._window = kept
+
+
+    def next(self) -> bool:
+        for attempt in range(2):
+            if self._window_covers(self.current_id):
+                i = bisect.bisect_right(self._window, self.current_id)
+                if i < len(self._window):
+                    self.current_id = self._window[i]
+                    return True
+                if attempt > 0:
+                    return False
+            # running off the end of the window always re-queries, that's how comments still being
+            # imported by ingest.py show up
+            self._prefetch(forward=True)
 
         return False
 
 
     def prev(self) -> bool:
-        query = f"""
-            select *
-              from comment
-             where comment_id < :current_id
-               and {self._filter_clause}
-             order by comment_id desc
-             limit 1
-        """.strip()
-        params = dict(current_id=self.comment_id)
-        for rec in self.dbconn.execute(query, params):
-            self.current_record = rec
-            return True
+        for attempt in range(2):
+            if self._window_covers(self.current_id):
+                i = bisect.bisect_left(self._window, self.current_id)
+                if i > 0:
+                    self.current_id = self._window[i-1]
+                    return True
+                if attempt > 0:
+                    return False
+            self._prefetch(forward=False)
 
         return False
 
 
+    # first() & last() go through the prefetch window too, so pending status changes are respected
     def first(self) -> bool:
-        query = """
-            select *
+        self._prefetch(forward=True, start_id=MIN_COMMENT_ID)
+        if not self._window:
+            return False
+
+        self.current_id = self._window[0]
+        return True
+
+
+    def last(self) -> bool:
+        self._prefetch(forward=False, start_id=MAX_COMMENT_ID)
+        if not self._window:
+            return False
+
+        self.current_id = self._window[-1]
+        return True
+
+
+    # jumps straight to a post, e.g. one picked from a list; next/prev carry on from there
+    def goto(self, comment_id: int) -> bool:
+        if self.dbconn.execute("select 1 as found from comment where comment_id = ?", (comment_id,)).fetchone() is None:
+            return False
+
+        self.current_id = comment_id
+        return True
+
+
+    # every id passing the filter, in order, for list views to page through with list_rows(). 8 bytes a
+    # post, a whole archive is a few hundred KB
+    def filtered_ids(self) -> array.array:
+        query = f"select comment_id from comment where {self._filter_clause} order by comment_id"
+        pending = self._pending_snapshot()
+        hidden = {comment_id for comment_id, params in pending.items() if not self._status_passes_filter(params["status"])}
+
+        cursor = self.dbconn.cursor()
+        cursor.row_factory = None # plain tuples, no dict per row
+        ids = (comment_id for (comment_id,) in cursor.execute(query, self._filter_params))
+        return array.array("q", (x for x in ids if x not in hidden) if hidden else ids)
+
+
+    # one line per post for a list view: comment_id, header (first line of the body), status, notes,
+    # modified_unixtime. just the ids asked for, in the order asked for
+    def list_rows(self, comment_ids: Iterable[int]) -> List[dict]:
+        comment_ids = list(comment_ids)
+        if not comment_ids:
+            return []
+
+        query = f"""
+            select comment_id
+                 , substr(body, 1, 200) as header
+                 , status
+                 , notes
+                 , modified_unixtime
               from comment
-             order by comment_id
-             limit 1
+             where comment_id in ({", ".join("?" * len(comment_ids))})
         """.strip()
-        for rec in self.dbconn.execute(query):
-            self.current_record = rec
-            return True
+        pending = self._pending_snapshot()
+        rows = {row["comment_id"]: row for row in self.dbconn.execute(query, comment_ids)}
+        for row in rows.values():
+            row["header"] = row["header"].split("\n", 1)[0]
+            self._apply_pending(row, pending)
+        return [rows[x] for x in comment_ids if x in rows]
 
 
-    def last(self) -> bool:
+    # best matches first: (comment_id, rank, snippet) with matched words wrapped in [brackets].
+    # the list tab in review.py shows a search this way. limit=None for every match
+    def search(self, text: str, limit: Optional[int] = 50) -> List[dict]:
+        if not search_terms(text):
+            return []
+
+        query = f"""
+            select rowid as comment_id
+                 , bm25(comment_fts) as rank
+                 , snippet(comment_fts, 0, '[', ']', '...', 12) as snippet
+              from comment_fts
+             where comment_fts match :search
+               {self._search_thread_clause}
+             order by rank
+             limit :limit
+        """.strip()
+        params = dict(search=fts_query(text), thread_id=self.thread_id, limit=-1 if limit is None else limit)
+        return self.dbconn.execute(query, params).fetchall()
+
+
+    def search_count(self, text: str) -> int:
+        if not search_terms(text):
+            return 0
+
+        query = f"select count(*) as n from comment_fts where comment_fts match :search {self._search_thread_clause}"
+        return self.dbconn.execute(query, dict(search=fts_query(text), thread_id=self.thread_id)).fetchone()["n"]
+
+
+    @property
+    def _search_thread_clause(self) -> str:
+        if self.thread_id is None:
+            return ""
+        return "and rowid in (select comment_id from comment where thread_id = :thread_id)"
+
+
+    # the latest earlier post, outside this one's thread, whose text is at least `threshold` similar
+    # (estimated Jaccard over 3-word shingles), or None. a handful of primary key seeks
+    def similar_to(self, comment_id: Optional[int] = None, threshold: float = 0.6) -> Optional[dict]:
+        comment_id = self.current_id if comment_id is None else comment_id
+        row = self.dbconn.execute("select signature from comment_minhash where comment_id = ?", (comment_id,)).fetchone()
+        if row is None:
+            return None
+        sig = minhash.from_blob(row["signature"])
+
+        candidate_ids = set()
+        for band, bucket in minhash.band_buckets(sig):
+            query = "select comment_id from comment_lsh where band = ? and bucket = ? and comment_id < ?"
+            candidate_ids.update(x["comment_id"] for x in self.dbconn.execute(query, (band, bucket, comment_id)))
+        if not candidate_ids:
+            return None
+
+        query = f"""
+            select c.comment_id, c.status, c.notes, c.thread_id, c.posted_unixtime, m.signature
+              from comment c
+              join comment_minhash m on m.comment_id = c.comment_id
+             where c.comment_id in ({", ".join("?" * len(candidate_ids))})
+               and coalesce(c.thread_id != (select thread_id from comment where comment_id = ?), 1)
+             order by c.comment_id desc
+        """.strip()
+        pending = self._pending_snapshot()
+        for candidate in self.dbconn.execute(query, (*candidate_ids, comment_id)).fetchall():
+            score = minhash.similarity(sig, minhash.from_blob(candidate.pop("signature")))
+            if score >= threshold:
+                return dict(self._apply_pending(candidate, pending), similarity=score)
+        return None
+
+
+    # for every post without a status: the latest earlier post with one, outside its thread, at least
+    # `threshold` similar. [(comment_id, prior comment_id, similarity)], found by joining comment_lsh to
+    # itself rather than post by post. expects dict rows
+    @staticmethod
+    def similar_reviewed_pairs(dbconn: sqlite3.Connection, threshold: float = 0.8) -> List[tuple]:
         query = """
-            select *
-              from comment
-             order by comment_id desc
-             limit 1
+            select distinct post_lsh.comment_id as comment_id
+                 , prior_lsh.comment_id as prior_id
+              from comment_lsh post_lsh
+              join comment post on post.comment_id = post_lsh.comment_id
+              join comment_lsh prior_lsh on prior_lsh.band = post_lsh.band
+                                        and prior_lsh.bucket = post_lsh.bucket
+                                        and prior_lsh.comment_id < post_lsh.comment_id
+              join comment prior on prior.comment_id = prior_lsh.comment_id
+             where post.status is null
+               and prior.status is not null
+               and coalesce(prior.thread_id != post.thread_id, 1)
+             order by post_lsh.comment_id, prior_lsh.comment_id desc
+        """.strip()
+        candidates = dbconn.execute(query).fetchall()
+
+        ids = {x["comment_id"] for x in candidates} | {x["prior_id"] for x in candidates}
+        signatures = {}
+        for batch in batched(sorted(ids), 500):
+            query = f"select comment_id, signature from comment_minhash where comment_id in ({', '.join('?' * len(batch))})"
+            signatures.update((row["comment_id"], minhash.from_blob(row["signature"])) for row in dbconn.execute(query, batch))
+
+        pairs = []
+        for comment_id, group in itertools.groupby(candidates, key=lambda x: x["comment_id"]):
+            for candidate in group: # latest first
+                score = minhash.similarity(signatures[comment_id], signatures[candidate["prior_id"]])
+                if score >= threshold:
+                    pairs.append((comment_id, candidate["prior_id"], score))
+                    break
+        return pairs
+
+
+    # a company posts every month and the answer rarely changes: (comment_id, prior_id, kind) for every post
+    # without a status whose latest earlier post, in another thread, by the same author or from the same
+    # company (`match`, any of "author"/"company") has one. kind says which of those prior_id was found by.
+    # each lookup is a backwards seek on comment_author_idx/comment_company_idx. see triage.py's carry_forward
+    @staticmethod
+    def carried_forward_pairs(dbconn: sqlite3.Connection, match: Iterable[str] = ("author", "company")) -> List[tuple]:
+        conditions = {
+            "author": "prior.author = post.author",
+            "company": "prior.company = post.company collate nocase",
+        }
+        match = list(match)
+        lookups = ", ".join(f"""
+                 coalesce((select prior.comment_id
+                             from comment prior
+                            where {conditions[kind]}
+                              and prior.comment_id < post.comment_id
+                              and prior.thread_id != post.thread_id
+                              and prior.status is not null
+                            order by prior.comment_id desc
+                            limit 1), 0) as {kind}_prior_id""" for kind in match)
+        query = f"""
+            select comment_id, {lookups}
+              from comment post
+             where post.status is null
+               and post.thread_id is not null
         """.strip()
-        for rec in self.dbconn.execute(query):
-            self.current_record = rec
-            return True
 
+        pairs = []
+        for row in dbconn.execute(query):
+            kind = max(match, key=lambda x: row[f"{x}_prior_id"]) # the latest of them
+            if row[f"{kind}_prior_id"]:
+                pairs.append((row["comment_id"], row[f"{kind}_prior_id"], kind))
+        return pairs
 
-    def reject(self, notes: str) -> None:
+
+    # how many posts in the thread (or all of them) have each status, {None: n, REJECTED: n, MAYBE: n}
+    def status_counts(self) -> dict:
+        if self._status_counts is None:
+            # the table lags anything still queued for the writer
+            self.flush()
+            self._status_counts = {
+                row["thread_id"]: {None: row["comments"] - row["rejected"] - row["maybe"], REJECTED: row["rejected"], MAYBE: row["maybe"]}
+                for row in self.dbconn.execute("select thread_id, comments, rejected, maybe from status_count")
+            }
+
+        if self.thread_id is not None:
+            return dict(self._status_counts.get(self.thread_id, {None: 0, REJECTED: 0, MAYBE: 0}))
+        return {status: sum(x[status] for x in self._status_counts.values()) for status in CommentDB.STATUSES}
+
+
+    # where review.py was left: the current post, filter, search and thread, plus whatever the UI wants
+    # back (ui_state, any JSON). one row, overwritten each time
+    def save_session(self, ui_state: Optional[dict] = None) -> None:
         query = """
-            update comment
-               set status = :status
-                 , notes = :notes
-                 , modified_unixtime = :modified_unixtime
-             where comment_id = :comment_id
+            insert or replace into session(session_id, comment_id, filter_mode, search_query, thread_id, remote_only, locations, min_salary, ui_state, saved_unixtime)
+            values(1, :comment_id, :filter_mode, :search_query, :thread_id, :remote_only, :locations, :min_salary, :ui_state, :saved_unixtime)
         """.strip()
         params = {
-            "status": REJECTED,
-            "notes": notes,
-            "modified_unixtime": int(time.time()),
             "comment_id": self.comment_id,
+            "filter_mode": self.filter_mode.value,
+            "search_query": self.search_query,
+            "thread_id": self.thread_id,
+            "remote_only": int(self.remote_only),
+            "locations": json.dumps(self.locations),
+            "min_salary": self.min_salary,
+            "ui_state": json.dumps(ui_state) if ui_state is not None else None,
+            "saved_unixtime": int(time.time()),
         }
         self.dbconn.execute(query, params)
         self.dbconn.commit()
 
 
-    def maybe(self, notes: str) -> None:
-        query = """
-            update comment
-               set status = :status
-                 , notes = :notes
-                 , modified_unixtime = :modified_unixtime
-             where comment_id = :comment_id        """.strip()
+    # the last save_session(), or None if there wasn't one; see restore_session()
+    def load_session(self) -> Optional[dict]:
+        session = self.dbconn.execute("select * from session where session_id = 1").fetchone()
+        if session is None:
+            return None
+
+        session["remote_only"] = bool(session["remote_only"])
+        session["locations"] = json.loads(session["locations"])
+        session["ui_state"] = json.loads(session["ui_state"]) if session["ui_state"] is not None else None
+        return session
+
+
+    def _set_status(self, status: str, notes: str) -> None:
+        old_status = self.status
+        if self._status_counts is not None and old_status != status:
+            counts = self._status_counts.setdefault(self.current_record.get("thread_id") or 0, {None: 0, REJECTED: 0, MAYBE: 0})
+            counts[old_status] -= 1
+            counts[status] += 1
+
         params = {
-            "status": MAYBE,
+            "status": status,
             "notes": notes,
             "modified_unixtime": int(time.time()),
             "comment_id": self.comment_id,
         }
-        self.dbconn.execute(query, params)
-        self.dbconn.commit()
+        if self._writer is not None:
+            with self._pending_lock:
+                self._pending[self.comment_id] = params
+            self._writer.submit(params)
+
+            # the overlay can hide a record from the filter but can't add one the table doesn't return,
+            # so a record newly passing the filter is written through (only happens off the beaten path,
+            # e.g. after jumping with first()/last())
+            if self._status_passes_filter(status) and not self._status_passes_filter(old_status):
+                self._writer.flush()
+        else:
+            self.dbconn.execute(UPDATE_STATUS_QUERY, params)
+            self.dbconn.commit()
+
+        # the in-memory view changes right away, whenever the write actually happens
+        record = dict(self.current_record)
+        record.update(status=status, notes=notes, modified_unixtime=params["modified_unixtime"])
+        self._cache_record(record)
+
+        # the window only ever needs fixing up for the record that just changed
+        if self._window_covers(self.comment_id):
+            i = bisect.bisect_left(self._window, self.comment_id)
+            in_window = i < len(self._window) and self._window[i] == self.comment_id
+            if in_window and not self._status_passes_filter(status):
+                del self._window[i]
+            elif not in_window and self._status_passes_filter(status):
+                self._invalidate_window()
+
+
+    def reject(self, notes: str) -> None:
+        self._set_status(REJECTED, notes)
+
+
+    def maybe(self, notes: str) -> None:
+        self._set_status(MAYBE, notes)
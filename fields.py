@@ -0,0 +1,144 @@
+import re
+from typing import List, Optional, Tuple
+
+
+# Most posts open with a pipe-delimited header line, e.g.
+#   Grafana Labs | Backend Engineers | Remote Global | Full-Time | https://grafana.com/
+# extract_fields() picks the useful bits out of it. It's heuristic and errs towards leaving things blank:
+# a post with no header gets no fields at all.
+
+FIELD_NAMES = ("company", "remote", "salary_min", "salary_max", "locations")
+
+URL_PATTERN = re.compile(r"https?://|www\.|\.(com|io|ai|co|org|net|dev)\b", re.IGNORECASE)
+EMPLOYMENT_PATTERN = re.compile(r"\b(full[- ]?time|part[- ]?time|contract(or)?|intern(ship)?s?|freelance|permanent|ft|pt)\b", re.IGNORECASE)
+REMOTE_PATTERN = re.compile(r"\bremote\b", re.IGNORECASE)
+NOT_REMOTE_PATTERN = re.compile(r"\b(no|not)\s+remote\b|\bremote\s*:\s*no\b|\b(onsite|on-site|in[- ]office)\s+only\b", re.IGNORECASE)
+ROLE_PATTERN = re.compile(r"\b(engineers?|developers?|managers?|designers?|scientists?|analysts?|architects?|sre|devops|lead|staff|senior|principal|head|director|vp|cto|roles?|positions?)\b", re.IGNORECASE)
+ONSITE_PATTERN = re.compile(r"\b(onsite|on-site|on site|in[- ]office|hybrid)\b", re.IGNORECASE)
+
+# "Denver, CO", "London, UK", "San Francisco Bay Area"... a capitalized place, optionally ", Region"
+PLACE_PATTERN = re.compile(r"^[A-Z][\w.'\- ]*(,\s*[A-Z][\w.'\- ]*)+$")
+# "London", "NYC", "New York City": up to four capitalized words, no comma. a lot of other header segments
+# look just like that, so those are only places when nothing in NOT_PLACE_PATTERN says otherwise
+BARE_PLACE_PATTERN = re.compile(r"^[A-Z][\w.'\-]*(\s[A-Z][\w.'\-]*){0,3}$")
+NOT_PLACE_PATTERN = re.compile(r"\b(visa|sponsor\w*|equity|series|funded|seed|benefits|startup|yc|[sw]\d{2}|saas|b2b|fintech|"
+                               r"healthcare|crypto|web3|blockchain|ai|ml|python|java|javascript|typescript|go|golang|rust|ruby|"
+                               r"rails|react|node|django|elixir|scala|kotlin|swift|php|aws|gcp|kubernetes|ios|android)\b", re.IGNORECASE)
+LOCATION_SEPARATOR_PATTERN = re.compile(r"\s*(?:/|;|\bor\b|&|\band\b|\+)\s*")
+
+# commas separate places ("SF, Seattle, NYC") except before a region, which belongs to the place before it
+# ("Denver, CO", "Toronto, ON, Canada", "Dublin, Ireland")
+REGIONS = {x.casefold() for x in (
+    "AL AK AZ AR CA CO CT DC DE FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN MS MO MT NE NV NH NJ NM NY NC ND "
+    "OH OK OR PA RI SC SD TN TX UT VT VA WA WV WI WY AB BC MB NS ON QC UK US USA EU UAE".split()
+)} | {x.casefold() for x in (
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut", "Delaware", "Florida", "Georgia",
+    "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa", "Kansas", "Kentucky", "Louisiana", "Maine", "Maryland",
+    "Massachusetts", "Michigan", "Minnesota", "Mississippi", "Missouri", "Montana", "Nebraska", "Nevada", "New Hampshire",
+    "New Jersey", "New Mexico", "New York", "North Carolina", "North Dakota", "Ohio", "Oklahoma", "Oregon", "Pennsylvania",
+    "Rhode Island", "South Carolina", "South Dakota", "Tennessee", "Texas", "Utah", "Vermont", "Virginia", "Washington",
+    "West Virginia", "Wisconsin", "Wyoming", "Ontario", "Quebec", "British Columbia", "Alberta",
+    "United States", "Canada", "Mexico", "Brazil", "Argentina", "United Kingdom", "England", "Scotland", "Ireland",
+    "Germany", "France", "Spain", "Portugal", "Italy", "Netherlands", "Belgium", "Switzerland", "Austria", "Sweden",
+    "Norway", "Denmark", "Finland", "Poland", "Czechia", "Estonia", "Israel", "India", "Singapore", "Japan", "China",
+    "Australia", "New Zealand", "Europe",
+)}
+
+# "$120k", "$120,000", "€90k - €110k", "$120-150k", "$150K to $180K"
+AMOUNT = r"(\d+(?:[.,]\d{3})*(?:\.\d+)?)\s?([kK])?"
+SALARY_RANGE_PATTERN = re.compile(r"[$€£]\s?" + AMOUNT + r"(?:\s?(?:-|–|to)\s?[$€£]?\s?" + AMOUNT + r")?")
+
+# anything smaller is an hourly rate or a funding round's worth of noise
+MIN_PLAUSIBLE_SALARY = 10000
+MAX_PLAUSIBLE_SALARY = 2000000
+
+
+def header_line(body: str) -> str:
+    return body.split("\n", 1)[0].strip()
+
+
+def _amount(number: str, thousands: Optional[str]) -> int:
+    value = float(re.sub(r"[.,](?=\d{3}\b)", "", number)) # "120,000" and "120.000" both mean 120000
+    if thousands:
+        value *= 1000
+    return int(value)
+
+
+def extract_salary(text: str) -> Tuple[Optional[int], Optional[int]]:
+    amounts = []
+    for match in SALARY_RANGE_PATTERN.finditer(text):
+        low_number, low_k, high_number, high_k = match.groups()
+        if high_number is not None:
+            # "$120-150k": the k on the second number applies to the first too
+            amounts.append(_amount(low_number, low_k or high_k))
+            amounts.append(_amount(high_number, high_k))
+        else:
+            amounts.append(_amount(low_number, low_k))
+
+    amounts = [x for x in amounts if MIN_PLAUSIBLE_SALARY <= x <= MAX_PLAUSIBLE_SALARY]
+    if not amounts:
+        return None, None
+    return min(amounts), max(amounts)
+
+
+def _split_commas(part: str) -> List[str]:
+    places = [] # each a list of comma pieces: a place and then any regions after it
+    for piece in (x.strip() for x in part.split(",")):
+        if not piece:
+            continue
+        if piece.casefold() in REGIONS and places and places[-1][0].casefold() not in REGIONS:
+            places[-1].append(piece)
+        else:
+            places.append([piece])
+    return [", ".join(x) for x in places]
+
+
+def extract_locations(segment: str) -> List[str]:
+    cleaned = REMOTE_PATTERN.sub("", ONSITE_PATTERN.sub("", segment))
+    cleaned = re.sub(r"[()\[\]]", " ", cleaned)
+    locations = []
+    for part in LOCATION_SEPARATOR_PATTERN.split(cleaned):
+        for place in _split_commas(re.sub(r"\s+", " ", part)):
+            place = place.strip(" -:")
+            if place and place.casefold() not in ("only", "ok", "optional", "friendly") and len(place) <= 60:
+                locations.append(place)
+    return locations
+
+
+def extract_fields(body: str) -> dict:
+    fields = dict(company=None, remote=None, salary_min=None, salary_max=None, locations=[])
+
+    segments = [x.strip() for x in header_line(body).split("|")]
+    segments = [x for x in segments if x]
+    if len(segments) < 2:
+        return fields
+
+    fields["company"] = segments[0][:100]
+    fields["salary_min"], fields["salary_max"] = extract_salary(header_line(body))
+
+    for segment in segments[1:]:
+        if URL_PATTERN.search(segment) or SALARY_RANGE_PATTERN.search(segment):
+            continue
+
+        if NOT_REMOTE_PATTERN.search(segment):
+            fields["remote"] = False
+        elif REMOTE_PATTERN.search(segment):
+            fields["remote"] = True
+        elif ONSITE_PATTERN.search(segment) and fields["remote"] is None:
+            fields["remote"] = False
+
+        # a location is either place-shaped ("Denver, CO", but not "Go, Rust") or explicitly onsite/hybrid
+        # ("NYC (onsite)"), or else a segment of nothing but bare places ("London", "NYC or Remote")
+        if EMPLOYMENT_PATTERN.fullmatch(segment) or ROLE_PATTERN.search(segment):
+            continue
+        without_parens = re.sub(r"\s*\(.*?\)", "", segment).strip()
+        locations = extract_locations(segment)
+        place_shaped = PLACE_PATTERN.match(without_parens) and not any(NOT_PLACE_PATTERN.search(x) for x in locations)
+        if not (place_shaped or ONSITE_PATTERN.search(segment) or (REMOTE_PATTERN.search(segment) and "(" in segment)):
+            if not all(BARE_PLACE_PATTERN.match(x) and not NOT_PLACE_PATTERN.search(x) for x in locations):
+                continue
+        for location in locations:
+            if location.casefold() not in (x.casefold() for x in fields["locations"]):
+                fields["locations"].append(location)
+
+    return fields
@@ -0,0 +1,220 @@
+import sys
+import time
+import asyncio
+import sqlite3
+import argparse
+import pathlib
+import functools
+import html.parser
+from typing import Callable, List, Optional, Set
+
+import aiohttp
+
+import scrape
+from commentdb import SqliteCommentDB
+from fields import extract_fields
+
+
+# Another way in: HN's item API (https://github.com/HackerNews/API) instead of the HTML pages. The thread
+# item lists its top-level comments in `kids`, so only those are fetched, never the replies the pages are
+# full of and parse.py throws away, and there's no page parsing at all. Items are fetched concurrently
+# (bounded by --concurrency) and the records, the same ones parse.py makes, go straight into the db, each
+# thread's as soon as that thread is fetched.
+# Comments already in the db aren't fetched again, so re-running on a live thread only picks up new ones.
+
+API_URL = "https://hacker-news.firebaseio.com/v0/"
+
+
+# an item's `text` is HTML: paragraphs opened (never closed) by <p>, links, <i>, <pre><code>. turned into
+# what parse.format_comment makes of the same comment on the page: a link outside a paragraph becomes its
+# href, inside one its text, and every paragraph after the first starts with a blank line. a paragraph
+# ends where the page's HTML parser would close it, at the next block-level tag (a <pre>, usually)
+class _TextFormatter(html.parser.HTMLParser):
+    # start tags that implicitly close an open <p>, per the HTML spec
+    CLOSES_PARAGRAPH = {
+        "address", "article", "aside", "blockquote", "center", "details", "dialog", "dir", "div", "dl", "dd", "dt",
+        "fieldset", "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hgroup",
+        "hr", "li", "listing", "main", "menu", "nav", "ol", "plaintext", "pre", "section", "summary", "table", "ul",
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out_parts = []
+        self.in_paragraph = False
+        self.in_link = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "p":
+            self.out_parts.append("\n\n")
+            self.in_paragraph = True
+        elif tag in _TextFormatter.CLOSES_PARAGRAPH:
+            self.in_paragraph = False
+        elif tag == "a":
+            self.in_link = True
+            if not self.in_paragraph:
+                self.out_parts.append(dict(attrs).get("href") or "")
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self.in_link = False
+
+    def handle_data(self, data):
+        if self.in_link and not self.in_paragraph:
+            return
+        self.out_parts.append(data)
+
+
+def format_item_text(text: str) -> str:
+    formatter = _TextFormatter()
+    formatter.feed(text)
+    formatter.close()
+    return "".join(formatter.out_parts)
+
+
+class ItemFetcher:
+    def __init__(self, session: aiohttp.ClientSession, api_url: str, concurrency: int, retry: scrape.RetryPolicy):
+        self.session = session
+        self.api_url = api_url.rstrip("/") + "/"
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retry = retry
+        self.requests = 0
+
+    # the item as a dict, or None if there's no such item. same retry rules as scrape.py
+    async def item(self, item_id: int) -> Optional[dict]:
+        url = f"{self.api_url}item/{item_id}.json"
+        async with self.semaphore:
+            for attempt in range(self.retry.retries + 1):
+                self.requests += 1
+                try:
+                    async with self.session.get(url) as response:
+                        if response.status == 200:
+                            return await response.json(content_type=None)
+                        if response.status not in scrape.RETRY_STATUS_CODES or attempt == self.retry.retries:
+                            raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                              message=f"status code {response.status} for {url}")
+                        wait = self.retry.delay(attempt, response)
+                        reason = f"status code {response.status}"
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt == self.retry.retries:
+                        raise
+                    wait = self.retry.delay(attempt)
+                    reason = type(e).__name__
+
+                print(f"{reason} for {url}, retry {attempt + 1} of {self.retry.retries} in {wait:.1f}s", file=sys.stderr)
+                await asyncio.sleep(wait)
+
+
+# same record as parse.iter_comments; None for comments the page wouldn't show either (deleted, dead)
+def item_record(item: Optional[dict], thread_id: int) -> Optional[dict]:
+    if not item or item.get("deleted") or item.get("dead") or not item.get("text"):
+        return None
+
+    record = {
+        "comment_id": item["id"],
+        "thread_id": thread_id,
+        "author": item.get("by"),
+        "posted_unixtime": item.get("time"),
+        "body": format_item_text(item["text"]),
+    }
+    record.update(extract_fields(record["body"]))
+    return record
+
+
+async def fetch_thread(fetcher: ItemFetcher, thread_id: int, skip_ids: Set[int]) -> List[dict]:
+    thread = await fetcher.item(thread_id)
+    if thread is None:
+        raise ValueError(f"no such item {thread_id}")
+
+    kids = [x for x in thread.get("kids", []) if x not in skip_ids]
+    print(f"thread {thread_id}: {len(thread.get('kids', []))} top-level comment(s), {len(kids)} to fetch", file=sys.stderr)
+
+    items = await asyncio.gather(*(fetcher.item(x) for x in kids))
+    return [record for record in (item_record(x, thread_id) for x in items) if record is not None]
+
+
+# on_thread(thread_id, records) gets each thread's records as soon as that thread is fetched, on a worker
+# thread so the other threads' fetches carry on meanwhile. a thread that fails doesn't stop the others,
+# returns the ids of the ones that did
+async def fetch_threads(thread_ids: List[int], skip_ids: Set[int], args, on_thread: Callable[[int, List[dict]], None]) -> List[int]:
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector, headers={"User-Agent": scrape.USER_AGENT}) as session:
+        fetcher = ItemFetcher(session, args.api_url, args.concurrency, scrape.RetryPolicy(args.retries, args.backoff))
+
+        async def fetch_one(thread_id: int):
+            try:
+                return thread_id, await fetch_thread(fetcher, thread_id, skip_ids), None
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                return thread_id, None, str(e) or type(e).__name__
+
+        started = time.perf_counter()
+        failed = []
+        for finished in asyncio.as_completed([fetch_one(x) for x in thread_ids]):
+            thread_id, records, error = await finished
+            if error is not None:
+                print(f"ERROR: thread {thread_id}: {error}", file=sys.stderr)
+                failed.append(thread_id)
+                continue
+            await asyncio.to_thread(on_thread, thread_id, records)
+        print(f"{fetcher.requests} request(s) in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    return failed
+
+
+def import_thread(db_file_name: str, thread_id: int, records: List[dict]) -> None:
+    records = sorted(records, key=lambda x: x["comment_id"])
+    print(f"thread {thread_id}: importing {len(records)} comment(s)", file=sys.stderr)
+    SqliteCommentDB.import_records(records, db_file_name, bulk=False).dbconn.close()
+
+
+# nothing for a db file that doesn't exist yet, or predates thread_id
+def existing_comment_ids(db_file_name: str, thread_ids: List[int]) -> Set[int]:
+    if not pathlib.Path(db_file_name).exists():
+        return set()
+
+    dbconn = sqlite3.connect(db_file_name)
+    query = f"select comment_id from comment where thread_id in ({', '.join('?' * len(thread_ids))})"
+    try:
+        return {comment_id for (comment_id,) in dbconn.execute(query, thread_ids)}
+    except sqlite3.OperationalError:
+        return set()
+    finally:
+        dbconn.close()
+
+
+def main(args) -> int:
+    thread_ids = list(args.thread_id or [])
+    for url in args.url or []:
+        thread_id = scrape.thread_id_from_url(url)
+        if thread_id is None:
+            print(f"ERROR: no thread id in {url}", file=sys.stderr)
+            return 1
+        thread_ids.append(int(thread_id))
+    if not thread_ids:
+        print("ERROR: give at least one --url or --thread-id", file=sys.stderr)
+        return 1
+
+    skip_ids = existing_comment_ids(args.db_file, thread_ids) if not args.refetch else set()
+
+    failed = asyncio.run(fetch_threads(thread_ids, skip_ids, args, functools.partial(import_thread, args.db_file)))
+    if failed:
+        print(f"{len(failed)} thread(s) failed, run again to fetch what's missing", file=sys.stderr)
+
+    print("done.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hacker News \"Who's Hiring\" import through the item API instead of scraping")
+    parser.add_argument("--url", required=False, action="append", help="HN thread URL, may be given more than once")
+    parser.add_argument("--thread-id", required=False, type=int, action="append", help="HN thread item id, may be given more than once")
+    parser.add_argument("--db-file", required=True, help="SQLite database file to import into, will be created if it does not exist")
+    parser.add_argument("--refetch", required=False, action="store_true", help="Fetch every comment, not just the ones missing from the db")
+    parser.add_argument("--concurrency", required=False, type=int, default=20, help="Requests in flight at once")
+    parser.add_argument("--retries", required=False, type=int, default=5, help="Times to retry an item on a 429/5xx or connection error")
+    parser.add_argument("--backoff", required=False, type=float, default=1.0, help="Seconds to back off before the first retry, doubling (with jitter) on each one after")
+    parser.add_argument("--timeout", required=False, type=float, default=60.0, help="Seconds allowed for each request")
+    parser.add_argument("--api-url", required=False, default=API_URL, help="Base URL of the item API")
+    args = parser.parse_args()
+
+    sys.exit(main(args))
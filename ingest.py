@@ -0,0 +1,76 @@
+import sys
+import argparse
+import pathlib
+import concurrent.futures
+from typing import Iterable, Iterator
+
+import requests
+
+import scrape
+import parse
+from commentdb import SqliteCommentDB
+
+
+# scrape -> parse -> import as one pipeline of generators: each page is parsed as soon as it arrives and
+# comments are committed in small batches, so nothing is ever held in full and review.py can open the
+# db file while the later pages are still downloading
+
+
+def iter_pages_from_url(args) -> Iterator[str]:
+    limiter = scrape.RateLimiter(rate=args.rate, burst=args.burst)
+    session = scrape.make_session(pool_size=args.workers)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for pagenum, page_url, response, body in scrape.iter_thread_pages(args.url, session, limiter, pool, args.max_pages, args.speculate):
+            print(f"fetched page {pagenum}", file=sys.stderr)
+            yield body
+
+
+def iter_pages_from_dir(input_dir: str) -> Iterator[str]:
+    for infile in sorted(pathlib.Path(input_dir).glob("*.html"), key=parse.page_sort_key):
+        print(f"reading {infile.name}", file=sys.stderr)
+        with infile.open(mode="rt", encoding="utf-8") as f:
+            yield f.read()
+
+
+def iter_records(pages: Iterable[str], parser: str) -> Iterator[dict]:
+    for body in pages:
+        yield from parse.iter_comments(body, parser=parser)
+
+
+def main(args) -> int:
+    if args.url:
+        pages = iter_pages_from_url(args)
+    else:
+        pages = iter_pages_from_dir(args.input_dir)
+
+    try:
+        SqliteCommentDB.import_records(iter_records(pages, args.parser), args.db_file, batch_size=args.batch_size, bulk=False)
+    except scrape.ScrapeError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        print(e.response.text, file=sys.stderr)
+        return 1
+    except requests.RequestException as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    print("done.")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hacker News scrape, parse & import in one streaming pass")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--url", help="Base HN URL to begin scrape from")
+    source.add_argument("--input-dir", help="Directory of already-scraped HTML files to read instead")
+    parser.add_argument("--db-file", required=True, help="SQLite database file to import into, will be created if it does not exist")
+    parser.add_argument("--parser", required=False, choices=list(parse.PARSERS), default="html5lib", help="HTML parser backend, lxml is much faster (default html5lib)")
+    parser.add_argument("--batch-size", required=False, type=int, default=50, help="Comments per committed batch")
+    parser.add_argument("--max-pages", required=False, type=int, default=999, help="Stop after retrieving this many pages")
+    parser.add_argument("--workers", required=False, type=int, default=4, help="Number of concurrent fetch workers (and pooled connections)")
+    parser.add_argument("--rate", required=False, type=float, default=0.2, help="Requests per second allowed across all workers")
+    parser.add_argument("--burst", required=False, type=int, default=1, help="Requests allowed back-to-back before the rate limit kicks in")
+    parser.add_argument("--speculate", required=False, type=int, default=0, help="Pages to request ahead of the \"More\" link by guessing &p=N, stops after a short page (default 0, off)")
+    args = parser.parse_args()
+
+    sys.exit(main(args))
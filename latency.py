@@ -0,0 +1,115 @@
+import sys
+import json
+import math
+import time
+import array
+import contextlib
+import collections
+from typing import Any, Callable, Dict, Iterator, List
+
+
+# Opt-in latency instrumentation for review.py. A Profiler times named sections (one per UI callback) and
+# splits each into DB time, spent inside SqliteCommentDB, and UI time, everything else. DB time is
+# measured by TimedCommentDB, a stand-in for the real db that times every attribute and method it passes
+# through. Sections can nest (a callback calling refresh_ui_from_data), DB time counts towards all of them.
+
+
+class Histogram:
+    def __init__(self):
+        self.samples = array.array("d") # seconds; a review session is thousands of events, not millions
+        self.buckets = collections.Counter() # upper edge in microseconds (powers of 2) -> count
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.buckets[2 ** max(0, math.ceil(math.log2(max(seconds * 1e6, 1))))] += 1
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def to_dict(self) -> dict:
+        count = len(self.samples)
+        return {
+            "count": count,
+            "mean_ms": sum(self.samples) / count * 1000 if count else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p90_ms": self.percentile(90) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": max(self.samples, default=0.0) * 1000,
+            "buckets_us": {f"<={edge}": self.buckets[edge] for edge in sorted(self.buckets)},
+        }
+
+
+class Profiler:
+    def __init__(self):
+        # "<section>" is wall time, "<section>.db" and "<section>.ui" its two parts
+        self.histograms: Dict[str, Histogram] = collections.defaultdict(Histogram)
+        self._stack: List[List[float]] = [] # [db seconds so far] for each open section
+
+    @contextlib.contextmanager
+    def section(self, name: str) -> Iterator[None]:
+        entry = [0.0]
+        self._stack.append(entry)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stack.pop()
+            self.histograms[name].add(elapsed)
+            self.histograms[f"{name}.db"].add(entry[0])
+            self.histograms[f"{name}.ui"].add(max(0.0, elapsed - entry[0]))
+
+    def add_db_time(self, seconds: float) -> None:
+        for entry in self._stack:
+            entry[0] += seconds
+
+    def to_dict(self) -> dict:
+        return {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())}
+
+    def export(self, file_name: str) -> None:
+        with open(file_name, mode="wt", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def print_summary(self, file=sys.stderr) -> None:
+        print(f"{'section':<36} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}", file=file)
+        for name, stats in self.to_dict().items():
+            print(f"{name:<36} {stats['count']:>6} {stats['p50_ms']:>9.3f} {stats['p90_ms']:>9.3f} {stats['p99_ms']:>9.3f} {stats['max_ms']:>9.3f}", file=file)
+
+    # names of the sections (wall time, not the .db/.ui parts) whose p99 is over the limit
+    def over_limit(self, p99_ms: float) -> List[str]:
+        return [name for name, histogram in self.histograms.items()
+                if "." not in name and histogram.percentile(99) * 1000 > p99_ms]
+
+
+# wraps a CommentDB/SqliteCommentDB: reads, writes and method calls all go through to the real one, and
+# the time they take is DB time for whatever sections are open
+class TimedCommentDB:
+    def __init__(self, cdb, profiler: Profiler):
+        object.__setattr__(self, "_cdb", cdb)
+        object.__setattr__(self, "_profiler", profiler)
+
+    def __getattr__(self, name: str) -> Any:
+        started = time.perf_counter()
+        value = getattr(self._cdb, name) # properties do their querying here
+        self._profiler.add_db_time(time.perf_counter() - started)
+
+        if callable(value):
+            return self._timed(value)
+        return value
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        started = time.perf_counter()
+        setattr(self._cdb, name, value)
+        self._profiler.add_db_time(time.perf_counter() - started)
+
+    def _timed(self, method: Callable) -> Callable:
+        def timed_method(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._profiler.add_db_time(time.perf_counter() - started)
+        return timed_method
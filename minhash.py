@@ -0,0 +1,97 @@
+import re
+import array
+import hashlib
+from typing import Iterator, List, Optional, Set, Tuple
+
+
+# Near-duplicate detection for the posts companies re-submit every month with small edits.
+#
+# A post becomes the set of its 3-word shingles, and a MinHash signature is a fixed-size summary of that
+# set: the fraction of slots two signatures agree on estimates the Jaccard similarity of the two sets.
+# Classic MinHash needs one hash function per slot, far too slow in pure Python, so this is one-permutation
+# hashing: every shingle is hashed once, the low bits pick a slot and the rest is the value kept if it's
+# the smallest seen there. Empty slots (short posts) borrow from the next filled one, "densification".
+#
+# For lookups the signature is cut into BANDS bands of ROWS slots each and every band hashed to a bucket.
+# Two posts sharing any bucket are candidates: with 16 bands of 4 rows a pair at 0.8 similarity is
+# almost certain to collide somewhere, a pair at 0.3 almost certain not to.
+
+SHINGLE_SIZE = 3
+NUM_SLOTS = 64
+BANDS = 16
+ROWS = NUM_SLOTS // BANDS
+
+SLOT_BITS = NUM_SLOTS.bit_length() - 1
+VALUE_MASK = 0xFFFFFFFF
+EMPTY = VALUE_MASK + 1
+DENSIFY_STEP = 0x9E3779B1 # borrowed values get shifted by this per slot moved, so they don't all agree
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text: str) -> Set[str]:
+    words = WORD_PATTERN.findall(text.casefold())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+# NUM_SLOTS unsigned 32-bit values, or None for a post with no words at all
+def signature(text: str) -> Optional[array.array]:
+    mins = [EMPTY] * NUM_SLOTS
+    for shingle in shingles(text):
+        h = _hash64(shingle.encode("utf-8"))
+        slot = h & (NUM_SLOTS - 1)
+        value = (h >> SLOT_BITS) & VALUE_MASK
+        if value < mins[slot]:
+            mins[slot] = value
+
+    if all(x == EMPTY for x in mins):
+        return None
+
+    # densify: an empty slot takes the value of the next filled slot to its right (wrapping around)
+    dense = list(mins)
+    for i in range(NUM_SLOTS):
+        if mins[i] == EMPTY:
+            distance = 1
+            while mins[(i + distance) % NUM_SLOTS] == EMPTY:
+                distance += 1
+            dense[i] = (mins[(i + distance) % NUM_SLOTS] + distance * DENSIFY_STEP) & VALUE_MASK
+    return array.array("I", dense)
+
+
+def to_blob(signature: array.array) -> bytes:
+    return signature.tobytes()
+
+
+def from_blob(blob: bytes) -> array.array:
+    signature = array.array("I")
+    signature.frombytes(blob)
+    return signature
+
+
+# estimated Jaccard similarity of the two posts' shingle sets
+def similarity(a: array.array, b: array.array) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_SLOTS
+
+
+# (band, bucket) for each band, buckets are signed 64-bit so SQLite can store them as integers
+def band_buckets(signature: array.array) -> List[Tuple[int, int]]:
+    buckets = []
+    for band in range(BANDS):
+        data = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        bucket = int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little", signed=True)
+        buckets.append((band, bucket))
+    return buckets
+
+
+# (comment_id, signature blob, [(band, bucket)]) for each (comment_id, body) that has any words
+def index_rows(rows: Iterator[Tuple[int, str]]) -> Iterator[Tuple[int, bytes, List[Tuple[int, int]]]]:
+    for comment_id, body in rows:
+        sig = signature(body)
+        if sig is not None:
+            yield comment_id, to_blob(sig), band_buckets(sig)
@@ -0,0 +1,228 @@
+import sys
+import io
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import pathlib
+import tempfile
+import threading
+from typing import List, Optional, TextIO
+
+try:
+    import zstandard
+except ImportError: # optional, gzip is always there
+    zstandard = None
+
+
+# Raw scraped pages, kept compressed and content-addressed so years of monthly re-scrapes cost little:
+#
+#   <store>/index.db                       which page of which thread was fetched when, and its hash
+#   <store>/objects/ab/ab12...ef.html.zst  page bodies, one file per distinct body (sha256 of the text)
+#
+# A page that hasn't changed since the last scrape is just another row in the index. Bodies are zstd if
+# the zstandard package is installed (poetry install -E zstd), gzip otherwise; reading handles both.
+# Every scrape of a thread is a snapshot (all its pages share snapshot_unixtime), parse.py reads the latest
+# snapshot of each thread.
+
+INDEX_FILE_NAME = "index.db"
+OBJECTS_DIR_NAME = "objects"
+
+SUFFIXES = {"zstd": ".html.zst", "gzip": ".html.gz"}
+
+# same as scrape.py's and parse.py's, for importing their directories
+ITEM_ID_PATTERN = re.compile(r"[?&]id=(\d+)")
+PAGE_NUMBER_PATTERN = re.compile(r"(\d+)")
+
+
+def default_compression() -> str:
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=12).compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+# a stored page (or a plain .html file) as text, decompressed as it's read
+def open_text(path: pathlib.Path) -> TextIO:
+    if path.name.endswith(SUFFIXES["zstd"]):
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed, reading it needs the zstandard package")
+        reader = zstandard.ZstdDecompressor().stream_reader(path.open(mode="rb"), closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    elif path.name.endswith(SUFFIXES["gzip"]):
+        return gzip.open(path, mode="rt", encoding="utf-8")
+    else:
+        return path.open(mode="rt", encoding="utf-8")
+
+
+class PageStore:
+    def __init__(self, root_dir: str, compression: Optional[str] = None):
+        self.root = pathlib.Path(root_dir)
+        self.objects = self.root / OBJECTS_DIR_NAME
+        os.makedirs(self.objects, exist_ok=True)
+
+        self.compression = compression or default_compression()
+        if self.compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package")
+
+        # scrape.py stores from one thread per HN thread being scraped
+        self.lock = threading.Lock()
+        self.dbconn = sqlite3.connect(self.root / INDEX_FILE_NAME, check_same_thread=False)
+        self.dbconn.row_factory = sqlite3.Row
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        self.dbconn.execute("""
+            create table if not exists object (
+                sha256 text primary key,
+                file text not null,
+                size integer not null,
+                stored_size integer not null
+            )
+        """.strip())
+        self.dbconn.execute("""
+            create table if not exists page (
+                thread_id integer not null,
+                snapshot_unixtime integer not null,
+                pagenum integer not null,
+                fetched_unixtime integer not null,
+                url text,
+                sha256 text not null references object(sha256),
+                primary key (thread_id, snapshot_unixtime, pagenum)
+            )
+        """.strip())
+        self.dbconn.commit()
+
+    def close(self) -> None:
+        self.dbconn.close()
+
+    # stores the body unless an identical one is already there, and records the fetch. returns the hash
+    def put(self, thread_id: int, snapshot_unixtime: int, pagenum: int, body: str, url: Optional[str] = None,
+            fetched_unixtime: Optional[int] = None) -> str:
+        data = body.encode("utf-8")
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        with self.lock:
+            if self.dbconn.execute("select 1 from object where sha256 = ?", (sha256,)).fetchone() is None:
+                file_name = self._write_object(sha256, data)
+                self.dbconn.execute("insert into object (sha256, file, size, stored_size) values (?, ?, ?, ?)",
+                                    (sha256, file_name, len(data), (self.root / file_name).stat().st_size))
+
+            self.dbconn.execute("""
+                insert or replace into page (thread_id, snapshot_unixtime, pagenum, fetched_unixtime, url, sha256)
+                values (?, ?, ?, ?, ?, ?)
+            """.strip(), (thread_id, snapshot_unixtime, pagenum, fetched_unixtime or int(time.time()), url, sha256))
+            self.dbconn.commit()
+
+        return sha256
+
+    # written under a temporary name and renamed, so a crash never leaves half an object behind
+    def _write_object(self, sha256: str, data: bytes) -> str:
+        file_name = f"{OBJECTS_DIR_NAME}/{sha256[:2]}/{sha256}{SUFFIXES[self.compression]}"
+        path = self.root / file_name
+        os.makedirs(path.parent, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(compress(data, self.compression))
+        os.replace(f.name, path)
+        return file_name
+
+    def path(self, sha256: str) -> pathlib.Path:
+        row = self.dbconn.execute("select file from object where sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            raise KeyError(sha256)
+        return self.root / row["file"]
+
+    def read(self, sha256: str) -> str:
+        with open_text(self.path(sha256)) as f:
+            return f.read()
+
+    # the pages of the latest snapshot of each thread (or just the ones asked for), in thread and page order:
+    # [{thread_id, snapshot_unixtime, pagenum, fetched_unixtime, url, sha256, path}]
+    def latest_pages(self, thread_ids: Optional[List[int]] = None) -> List[dict]:
+        query = """
+            select p.thread_id, p.snapshot_unixtime, p.pagenum, p.fetched_unixtime, p.url, p.sha256, o.file
+              from page p
+              join object o on o.sha256 = p.sha256
+             where p.snapshot_unixtime = (select max(snapshot_unixtime) from page latest where latest.thread_id = p.thread_id)
+             order by p.thread_id, p.pagenum
+        """.strip()
+        pages = []
+        for row in self.dbconn.execute(query):
+            if thread_ids and row["thread_id"] not in thread_ids:
+                continue
+            page = dict(row)
+            page["path"] = self.root / page.pop("file")
+            pages.append(page)
+        return pages
+
+    def stats(self) -> dict:
+        row = self.dbconn.execute("""
+            select (select count(*) from page) as pages
+                 , (select count(distinct thread_id || ':' || snapshot_unixtime) from page) as snapshots
+                 , (select count(*) from object) as objects
+                 , (select coalesce(sum(o.size), 0) from page p join object o on o.sha256 = p.sha256) as fetched_bytes
+                 , (select coalesce(sum(stored_size), 0) from object) as stored_bytes
+        """.strip()).fetchone()
+        return dict(row)
+
+
+# a directory of pageNN.html files from scrape.py --output-dir: the thread comes from its manifest, or the
+# directory name (scrape.py names subdirectories by thread id), the fetch time from the file
+def import_dir(store: PageStore, page_dir: pathlib.Path) -> int:
+    manifest_path = page_dir / "manifest.json"
+    thread_id = None
+    if manifest_path.exists():
+        with manifest_path.open(mode="rt", encoding="utf-8") as f:
+            match = ITEM_ID_PATTERN.search(json.load(f).get("url") or "")
+        thread_id = match.group(1) if match else None
+    if thread_id is None and page_dir.name.isdigit():
+        thread_id = page_dir.name
+    if thread_id is None:
+        print(f"skipping {page_dir}, can't tell which thread it is", file=sys.stderr)
+        return 0
+
+    files = [x for x in page_dir.glob("*.html") if PAGE_NUMBER_PATTERN.search(x.stem)]
+    if not files:
+        return 0
+    snapshot_unixtime = int(min(x.stat().st_mtime for x in files))
+    for infile in files:
+        pagenum = int(PAGE_NUMBER_PATTERN.search(infile.stem).group(1))
+        with infile.open(mode="rt", encoding="utf-8") as f:
+            store.put(int(thread_id), snapshot_unixtime, pagenum, f.read(), fetched_unixtime=int(infile.stat().st_mtime))
+    print(f"{page_dir}: {len(files)} page(s) of thread {thread_id}", file=sys.stderr)
+    return len(files)
+
+
+def main(args) -> int:
+    store = PageStore(args.store, compression=args.compression)
+
+    for import_dir_name in args.import_dir or []:
+        page_dirs = sorted({x.parent for x in pathlib.Path(import_dir_name).rglob("*.html")})
+        for page_dir in page_dirs:
+            import_dir(store, page_dir)
+
+    stats = store.stats()
+    ratio = stats["stored_bytes"] / stats["fetched_bytes"] if stats["fetched_bytes"] else 0.0
+    print(f"{stats['pages']} page(s) in {stats['snapshots']} snapshot(s), {stats['objects']} distinct; "
+          f"{stats['fetched_bytes']:,} bytes as fetched, {stats['stored_bytes']:,} stored ({ratio:.1%})")
+
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compressed, content-addressed store of scraped pages")
+    parser.add_argument("--store", required=True, help="Store directory, will be created if it does not exist")
+    parser.add_argument("--import-dir", required=False, action="append", help="Add the pages scraped into this directory (and its subdirectories) to the store, may be given more than once")
+    parser.add_argument("--compression", required=False, choices=list(SUFFIXES), help="For new pages, default zstd if the zstandard package is installed, otherwise gzip")
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -1,16 +1,30 @@
 import sys
 import argparse
 import pathlib
+import re
 import json
-import functools
+import time
+import datetime
+import concurrent.futures
+from typing import Iterator, List, Optional, Set, Tuple
 
 from bs4 import BeautifulSoup
-from bs4.element import NavigableString, Tag
+from bs4.element import Comment, NavigableString, Tag
+
+from fields import extract_fields
+import pagestore
+
+try:
+    import lxml.html
+except ImportError: # optional, only needed for --parser lxml
+    lxml = None
 
 
 def format_comment(commtext) -> str:
     out_parts = []
     for element in commtext.contents:
+        if isinstance(element, Comment): # a NavigableString too, but <!-- --> isn't part of the text
+            continue
         if isinstance(element, NavigableString):
             out_parts.append(element.string)
         elif isinstance(element, Tag):
@@ -29,50 +43,283 @@ def format_comment(commtext) -> str:
     return "".join(out_parts)
 
 
-def main(args) -> int:
-    if args.output_file:
-        outfile_fd = pathlib.Path(args.output_file).open(mode="wt", encoding="utf-8")
-        to_output = functools.partial(print, file=outfile_fd)
-    else:
-        to_output = functools.partial(print, file=sys.stdout)
+def format_comment_lxml(commtext) -> str:
+    # same output as format_comment, for an lxml element: text directly inside an element is .text,
+    # text following a child element (up to the next one) is that child's .tail
+    out_parts = []
+    if commtext.text:
+        out_parts.append(commtext.text)
+
+    for element in commtext:
+        if isinstance(element.tag, str): # comments & processing instructions have non-string tags
+            if element.tag == "a":
+                out_parts.append(element.get("href"))
+            elif element.tag == "p":
+                out_parts.append("\n\n")
+                out_parts.append(element.text_content())
+            elif element.tag in ("pre", "i", "b", "u"):
+                out_parts.append(element.text_content())
+            elif element.tag == "div" and "reply" in element.get("class", "").split():
+                pass
+            else:
+                print(f"unexpected child tag '{element.tag}': {lxml.html.tostring(element, encoding='unicode')}", file=sys.stderr)
 
+        if element.tail:
+            out_parts.append(element.tail)
+
+    return "".join(out_parts)
+
+
+# span.age's title is the post time in UTC, "2021-10-01T15:00:12", and newer pages append the unix time
+# as well, "2021-10-01T15:00:12 1633100412"
+def posted_unixtime(age_title: Optional[str]) -> Optional[int]:
+    if not age_title:
+        return None
+
+    parts = age_title.split()
+    if len(parts) > 1 and parts[1].isdigit():
+        return int(parts[1])
     try:
+        return int(datetime.datetime.fromisoformat(parts[0]).replace(tzinfo=datetime.timezone.utc).timestamp())
+    except ValueError:
+        return None
+
+
+def iter_comments_html5lib(contents: str, min_comment_id: int = 0) -> Iterator[dict]:
+    soup = BeautifulSoup(contents, "html5lib")
+
+    # the thread itself is the one row in the fatitem table at the top of every page
+    fatitem = soup.find("table", class_="fatitem")
+    thread_tr = fatitem.find("tr", class_="athing") if fatitem is not None else None
+    thread_id = int(thread_tr["id"]) if thread_tr is not None else None
+
+    for comtr in soup.find_all("tr", class_="comtr"):
+        comment_id = int(comtr["id"])
+
+        td_ind = comtr.find("td", class_="ind")
+        if td_ind["indent"] != "0": # replies have an indent > 0
+            print(f"comment id {comment_id} is a reply, skipping", file=sys.stderr)
+            continue
+
+        commtext_span = comtr.find("span", class_="commtext")
+        if commtext_span is None:
+            print(f"comment id {comment_id} has no text, skipping", file=sys.stderr)
+            continue
+
+        if comment_id <= min_comment_id:
+            continue
+
+        body = format_comment(commtext_span)
+
+        # dead and deleted comments have no author
+        hnuser = comtr.find("a", class_="hnuser")
+        age = comtr.find("span", class_="age")
+
+        yield {
+            "comment_id":comment_id,
+            "thread_id":thread_id,
+            "author":hnuser.text if hnuser is not None else None,
+            "posted_unixtime":posted_unixtime(age.get("title") if age is not None else None),
+            "body":body,
+        }
+
+
+def _has_class(class_name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+def iter_comments_lxml(contents: str, min_comment_id: int = 0) -> Iterator[dict]:
+    tree = lxml.html.fromstring(contents)
+
+    thread_ids = tree.xpath(f"//table[{_has_class('fatitem')}]//tr[{_has_class('athing')}]/@id")
+    thread_id = int(thread_ids[0]) if thread_ids else None
+
+    for comtr in tree.xpath(f"//tr[{_has_class('comtr')}]"):
+        comment_id = int(comtr.get("id"))
+
+        td_ind = comtr.xpath(f".//td[{_has_class('ind')}]")[0]
+        if td_ind.get("indent") != "0": # replies have an indent > 0
+            print(f"comment id {comment_id} is a reply, skipping", file=sys.stderr)
+            continue
+
+        commtext_spans = comtr.xpath(f".//span[{_has_class('commtext')}]")
+        if not commtext_spans:
+            print(f"comment id {comment_id} has no text, skipping", file=sys.stderr)
+            continue
+
+        if comment_id <= min_comment_id:
+            continue
+
+        body = format_comment_lxml(commtext_spans[0])
+
+        hnusers = comtr.xpath(f".//a[{_has_class('hnuser')}]")
+        age_titles = comtr.xpath(f".//span[{_has_class('age')}]/@title")
+
+        yield {
+            "comment_id":comment_id,
+            "thread_id":thread_id,
+            "author":hnusers[0].text_content() if hnusers else None,
+            "posted_unixtime":posted_unixtime(age_titles[0] if age_titles else None),
+            "body":body,
+        }
+
+
+# name -> function(contents, min_comment_id) yielding {"comment_id", "thread_id", "author", "posted_unixtime", "body"}
+# for each top-level comment
+PARSERS = {
+    "html5lib": iter_comments_html5lib,
+    "lxml": iter_comments_lxml,
+}
+
+
+def available_parsers() -> List[str]:
+    return [name for name in PARSERS if name != "lxml" or lxml is not None]
+
+
+# the parsed records plus the structured fields from each post's header line (see fields.py)
+def iter_comments(contents: str, min_comment_id: int = 0, parser: str = "html5lib") -> Iterator[dict]:
+    if parser not in available_parsers():
+        raise ValueError(f"parser '{parser}' is not available (have: {', '.join(available_parsers())})")
+
+    for record in PARSERS[parser](contents, min_comment_id):
+        record.update(extract_fields(record["body"]))
+        yield record
+
+
+def compare_parsers(input_path: pathlib.Path) -> int:
+    # every available parser must produce exactly what html5lib (the reference) does, page by page
+    mismatches = 0
+    for infile in sorted(input_path.glob("*.html")):
+        contents = infile.open(mode="rt", encoding="utf-8").read()
+
+        results = {}
+        for name in available_parsers():
+            started = time.perf_counter()
+            results[name] = list(PARSERS[name](contents))
+            print(f"{infile.name}: {name} {len(results[name])} comments in {(time.perf_counter() - started)*1000:.1f}ms", file=sys.stderr)
+
+        reference = results.pop("html5lib")
+        for name, result in results.items():
+            if result == reference:
+                continue
+
+            mismatches += 1
+            print(f"MISMATCH {infile.name}: {name} differs from html5lib", file=sys.stderr)
+            for expected, actual in zip(reference, result):
+                if expected != actual:
+                    print(f"  expected {json.dumps(expected)}", file=sys.stderr)
+                    print(f"  actual   {json.dumps(actual)}", file=sys.stderr)
+                    break
+            else:
+                print(f"  {len(reference)} comments vs {len(result)}", file=sys.stderr)
+
+    print(f"{mismatches} mismatch(es)", file=sys.stderr)
+    return 1 if mismatches else 0
+
+
+PAGE_NUMBER_PATTERN = re.compile(r"(\d+)")
+
+
+def page_sort_key(infile: pathlib.Path) -> Tuple[str, int, str]:
+    # page2.html before page10.html, and threads (subdirectories) kept together
+    match = PAGE_NUMBER_PATTERN.search(infile.stem)
+    return (str(infile.parent), int(match.group(1)) if match else 0, infile.name)
+
+
+def load_changed_pages(page_dir: pathlib.Path) -> Tuple[Set[str], int]:
+    manifest_path = page_dir / "manifest.json"
+    with manifest_path.open(mode="rt", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return set(manifest["changed_pages"]), manifest["baseline_comment_id"]
+
+
+# runs in a worker process when --jobs > 1, so it takes and returns plain picklable values
+def parse_file(infile: pathlib.Path, min_comment_id: int, parser: str) -> str:
+    print(f"parsing {infile}", file=sys.stderr)
+    with pagestore.open_text(infile) as f: # scraped .html, or compressed from a page store
+        contents = f.read()
+
+    return "".join(f"{json.dumps(out)}\n" for out in iter_comments(contents, min_comment_id, parser))
+
+
+def main(args) -> int:
+    if args.store and (args.compare_parsers or args.changed_only):
+        print("ERROR: --compare-parsers and --changed-only work on --input-dir", file=sys.stderr)
+        return 1
+
+    if args.compare_parsers:
+        return compare_parsers(pathlib.Path(args.input_dir))
+
+    # with --changed-only, only pages the last incremental scrape saw change are read, and only
+    # comments newer than anything it had seen before are emitted
+    manifests = {}
+    jobs = [] # (path, min_comment_id), in page order
+    if args.store:
+        store = pagestore.PageStore(args.store)
+        jobs = [(page["path"], 0) for page in store.latest_pages(args.thread_id)]
+        store.close()
+        print(f"{len(jobs)} page(s) from the latest snapshot of each thread in {args.store}", file=sys.stderr)
+    else:
         input_path = pathlib.Path(args.input_dir)
-        for infile in input_path.iterdir():
+        for infile in sorted(input_path.rglob("*"), key=page_sort_key):
+            if infile.is_dir():
+                continue
+
             if not infile.name.endswith(".html"):
                 print(f"skipping {infile.name}", file=sys.stderr)
                 continue
 
-            print(f"parsing {infile.name}", file=sys.stderr)
-            contents = infile.open(mode="rt", encoding="utf-8").read()
-            soup = BeautifulSoup(contents, "html5lib")
-
-            for comtr in soup.find_all("tr", class_="comtr"):
-                td_ind = comtr.find("td", class_="ind")
-                if td_ind["indent"] != "0": # replies have an indent > 0
-                    print(f"comment id {comment_id} is a reply, skipping", file=sys.stderr)
+            min_comment_id = 0
+            if args.changed_only:
+                if infile.parent not in manifests:
+                    if not (infile.parent / "manifest.json").exists():
+                        print(f"ERROR: no manifest.json in {infile.parent}, --changed-only needs pages from scrape.py --incremental", file=sys.stderr)
+                        return 1
+                    manifests[infile.parent] = load_changed_pages(infile.parent)
+                changed_pages, min_comment_id = manifests[infile.parent]
+                if infile.name not in changed_pages:
+                    print(f"skipping {infile.name}, unchanged", file=sys.stderr)
                     continue
 
-                commtext_span = comtr.find("span", class_="commtext")
-                if commtext_span is None:
-                    print(f"comment id {comment_id} has no text, skipping", file=sys.stderr)
-                    continue
+            jobs.append((infile, min_comment_id))
 
-                comment_id = int(comtr["id"])
-                body = format_comment(commtext_span)
+    if args.output_file:
+        outfile_fd = pathlib.Path(args.output_file).open(mode="wt", encoding="utf-8", buffering=1024*1024)
+    else:
+        outfile_fd = sys.stdout
+
+    try:
+        paths = [infile for infile, _ in jobs]
+        min_ids = [min_comment_id for _, min_comment_id in jobs]
+        parsers = [args.parser] * len(jobs)
 
-                out = {"comment_id":comment_id, "body":body}
-                to_output(f"{json.dumps(out)}")
+        # map() hands results back in submission order, i.e. page order, whatever order they finish in
+        if args.jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                for chunk in pool.map(parse_file, paths, min_ids, parsers):
+                    outfile_fd.write(chunk)
+        else:
+            for chunk in map(parse_file, paths, min_ids, parsers):
+                outfile_fd.write(chunk)
 
     finally:
         if args.output_file:
             outfile_fd.close()
 
+    return 0
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Hacker News scraper")
-    parser.add_argument("--input-dir", required=True, help="Directory to read scraped HTML files from")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help="Directory to read scraped HTML files from, including subdirectories (one per thread)")
+    source.add_argument("--store", help="Page store directory (see pagestore.py) to read the latest scrape of each thread from")
+    parser.add_argument("--thread-id", required=False, type=int, action="append", help="With --store, only this thread, may be given more than once")
     parser.add_argument("--output-file", required=False, help="Output file name (STDOUT if not set)")
+    parser.add_argument("--changed-only", required=False, action="store_true", help="Use the scrape manifest to emit only comments new since the last incremental scrape")
+    parser.add_argument("--parser", required=False, choices=list(PARSERS), default="html5lib", help="HTML parser backend, lxml is much faster (default html5lib)")
+    parser.add_argument("--compare-parsers", required=False, action="store_true", help="Check every available parser produces the same output as html5lib over the input dir, then exit")
+    parser.add_argument("--jobs", required=False, type=int, default=1, help="Parse pages in this many worker processes")
     args = parser.parse_args()
 
     sys.exit(main(args))
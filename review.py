@@ -1,14 +1,22 @@
 import sys
+import time
 import argparse
 import pathlib
 import json
+import array
+import bisect
+import sqlite3
+import tempfile
+import functools
 import webbrowser
-from typing import Optional, Union
+from typing import Callable, Optional, TextIO, Union
 
 import dearpygui.dearpygui as dpg
 import pendulum
 
-from commentdb import CommentDB, SqliteCommentDB, FilterMode
+from commentdb import CommentDB, LazyCommentDB, SqliteCommentDB, FilterMode, REJECTED, MAYBE, iter_json_records, restore_session
+import triage
+import latency
 
 
 def iso_from_unix(unixtime: Optional[int]) -> str:
@@ -18,6 +26,60 @@ def iso_from_unix(unixtime: Optional[int]) -> str:
         return pendulum.from_timestamp(unixtime).in_tz("America/Denver").isoformat()
 
 
+ALL_THREADS = "All threads"
+
+# set up by main() when asked for: per-callback latency (--profile-file, --replay-file), and a log of every
+# callback fired that --replay-file can play back later (--record-file)
+profiler: Optional[latency.Profiler] = None
+recorder: Optional[TextIO] = None
+
+# callback name -> callback, for replays
+CALLBACKS = {}
+
+
+def profiled(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if profiler is None:
+            return fn(*args, **kwargs)
+        with profiler.section(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# a dearpygui callback: profiled, recorded, and replayable by name
+def callback(fn: Callable) -> Callable:
+    profiled_fn = profiled(fn)
+
+    @functools.wraps(fn)
+    def wrapper(sender, app_data, user_data):
+        if recorder is not None:
+            recorder.write(json.dumps({"callback": fn.__name__, "app_data": app_data}) + "\n")
+        return profiled_fn(sender, app_data, user_data)
+
+    CALLBACKS[fn.__name__] = wrapper
+    return wrapper
+
+
+def thread_label(thread: dict) -> str:
+    if thread["posted_unixtime"] is None:
+        return str(thread["thread_id"])
+    return f"{thread['thread_id']} ({pendulum.from_timestamp(thread['posted_unixtime']).format('MMMM YYYY')})"
+
+
+# "similar to #N from <month> (92%)" plus what was decided about it, for reposts of an earlier post
+def similar_text(cdb) -> str:
+    similar = cdb.similar_to()
+    if similar is None:
+        return ""
+
+    when = f" from {pendulum.from_timestamp(similar['posted_unixtime']).format('MMMM YYYY')}" if similar["posted_unixtime"] else ""
+    text = f"similar to #{similar['comment_id']}{when} ({similar['similarity']:.0%})"
+    if similar["status"]:
+        text += f"\n{similar['status']}" + (f": {similar['notes']}" if similar["notes"] else "")
+    return text
+
+
 def define_themes() -> None:
     with dpg.theme(tag="theme__rejected_button"):
         with dpg.theme_component(dpg.mvButton):
@@ -53,150 +115,467 @@ def register_fonts() -> None:
     dpg.bind_font("font__Verdana16") # sets the default
 
 
+@profiled
 def refresh_ui_from_data(cdb) -> None:
     dpg.set_value("text__comment_id", cdb.comment_id)
+    dpg.set_value("text__author", f"{cdb.author or ''}  {iso_from_unix(cdb.posted_unixtime)}")
     #dpg.set_value("text__url", cdb.url)
     dpg.set_value("text__comment_text", cdb.comment_text)
     dpg.set_value("input__notes", (cdb.notes or ""))
     dpg.set_value("text__status", (cdb.status or ""))
     dpg.set_value("text__modified", iso_from_unix(cdb.modified_unixtime))
+    dpg.set_value("text__similar", similar_text(cdb))
+
+    # the link button stays put, only what it says and where it goes change
+    dpg.configure_item("button__url", label=cdb.url, user_data=cdb.url)
+
+    refresh_progress(cdb)
 
-    # buttons don't support updating their text so it has to be replaced
-    url_button_parent = dpg.get_item_parent("button__url")
-    dpg.delete_item("button__url")
-    draw_url_button(url_button_parent, cdb.url)
 
+# "212 / 640 triaged" for the thread being reviewed, from counts the db keeps as it goes
+def refresh_progress(cdb) -> None:
+    counts = cdb.status_counts()
+    total = sum(counts.values())
+    triaged = counts[REJECTED] + counts[MAYBE]
+    dpg.set_value("progress__triaged", triaged / total if total else 0.0)
+    dpg.configure_item("progress__triaged", overlay=f"{triaged} / {total} triaged")
 
+
+# app_data is the notes, see notes_button_callback
+@callback
 def rejected_callback(sender, app_data, user_data) -> None:
     cdb = user_data
-    notes = dpg.get_value("input__notes")
+    notes = app_data
     cdb.reject(notes)
     #print(cdb.as_json_record, file=sys.stderr)
     cdb.next()
     refresh_ui_from_data(cdb)
 
 
+# app_data is the notes
+@callback
 def maybe_callback(sender, app_data, user_data) -> None:
     cdb = user_data
-    notes = dpg.get_value("input__notes")
+    notes = app_data
     cdb.maybe(notes)
     #print(cdb.as_json_record, file=sys.stderr)
     cdb.next()
     refresh_ui_from_data(cdb)
 
 
+# not a @callback: reads the notes box and passes it on in app_data, so a recording holds the notes
+# themselves and a replay doesn't depend on widget state. user_data is (cdb, name of the callback)
+def notes_button_callback(sender, app_data, user_data) -> None:
+    cdb, name = user_data
+    CALLBACKS[name](sender, dpg.get_value("input__notes"), cdb)
+
+
+@callback
 def up_arrow_callback(sender, app_data, user_data) -> None:
     cdb = user_data
     if cdb.prev():
         refresh_ui_from_data(cdb)
 
 
+@callback
 def down_arrow_callback(sender, app_data, user_data) -> None:
     cdb = user_data
     if cdb.next():
         refresh_ui_from_data(cdb)
 
 
+@callback
 def first_arrow_callback(sender, app_data, user_data) -> None:
     cdb = user_data
     if cdb.first():
         refresh_ui_from_data(cdb)
 
 
+@callback
 def last_arrow_callback(sender, app_data, user_data) -> None:
     cdb = user_data
     if cdb.last():
         refresh_ui_from_data(cdb)
 
 
+@callback
 def filter_mode_callback(sender, app_data, user_data) -> None:
     cdb = user_data
     cdb.filter_mode = FilterMode(app_data)
 
 
+# labels are "<thread id> (<month>)"
+@callback
+def thread_callback(sender, app_data, user_data) -> None:
+    cdb = user_data
+    cdb.thread_id = None if app_data == ALL_THREADS else int(app_data.split()[0])
+
+    if cdb.first():
+        refresh_ui_from_data(cdb)
+
+
+# runs on every keystroke: filter down to posts matching what's typed so far and jump to the first one
+@callback
+def search_callback(sender, app_data, user_data) -> None:
+    cdb = user_data
+    cdb.search_query = app_data
+    if app_data.strip():
+        cdb.filter_mode = FilterMode.SEARCH
+        dpg.set_value("combo__filter", FilterMode.SEARCH.value)
+        dpg.set_value("text__search_count", f"{cdb.search_count(app_data)} match(es)")
+    else:
+        cdb.filter_mode = FilterMode.ALL
+        dpg.set_value("combo__filter", FilterMode.ALL.value)
+        dpg.set_value("text__search_count", "")
+
+    if cdb.first():
+        refresh_ui_from_data(cdb)
+
+
+# the structured-field filters (see fields.py) stack on top of whatever the filter combo says.
+# app_data is {remote_only, locations, min_salary}, see field_filter_input_callback
+@callback
+def field_filter_callback(sender, app_data, user_data) -> None:
+    cdb = user_data
+    cdb.set_field_filter(remote_only=app_data["remote_only"], locations=app_data["locations"], min_salary=app_data["min_salary"])
+
+    if cdb.first():
+        refresh_ui_from_data(cdb)
+
+
+# not a @callback, any of the three inputs changing reads all of them and passes them on, like notes_button_callback
+def field_filter_input_callback(sender, app_data, user_data) -> None:
+    values = {
+        "remote_only": dpg.get_value("checkbox__remote"),
+        "locations": dpg.get_value("input__location").split(","),
+        "min_salary": dpg.get_value("input__min_salary"),
+    }
+    CALLBACKS["field_filter_callback"](sender, values, user_data)
+
+
+# not a @callback, replaying a session shouldn't open browser tabs
+def url_button_callback(sender, app_data, user_data) -> None:
+    webbrowser.open(user_data)
+
+
 def draw_url_button(parent_item: Union[int, str], url: str) -> None:
-    dpg.add_button(tag="button__url", parent=parent_item, label=url, width=600, callback=lambda:webbrowser.open(url))
+    dpg.add_button(tag="button__url", parent=parent_item, label=url, width=600, callback=url_button_callback, user_data=url)
     dpg.bind_item_theme(dpg.last_item(), "theme__hyperlink")
 
 
+# POST LIST: every post passing the filter, one line each. only LIST_ROWS rows of widgets ever exist,
+# scrolling refills them from the ids in view, so 50 posts or 50,000 is the same amount of work
+LIST_ROWS = 24
+
+
+class PostList:
+    def __init__(self):
+        self.ids = array.array("q") # see SqliteCommentDB.filtered_ids()
+        self.offset = 0 # index into ids of the top row
+        self.snippets = {} # comment_id -> the part of the post a search matched, shown instead of the header
+
+    @property
+    def max_offset(self) -> int:
+        return max(0, len(self.ids) - LIST_ROWS)
+
+    def visible_ids(self) -> array.array:
+        return self.ids[self.offset:self.offset + LIST_ROWS]
+
+
+post_list = PostList()
+
+
+@profiled
+def refresh_post_list(cdb) -> None:
+    rows = cdb.list_rows(post_list.visible_ids())
+    for i in range(LIST_ROWS):
+        row = rows[i] if i < len(rows) else None
+        dpg.configure_item(f"row__list{i}", show=row is not None)
+        if row is None:
+            continue
+
+        dpg.configure_item(f"selectable__list{i}", label=str(row["comment_id"]))
+        dpg.set_value(f"selectable__list{i}", row["comment_id"] == cdb.comment_id)
+        dpg.set_value(f"text__list_header{i}", post_list.snippets.get(row["comment_id"], row["header"]).replace("\n", " ")[:90])
+        dpg.set_value(f"text__list_status{i}", row["status"] or "")
+        dpg.set_value(f"text__list_notes{i}", (row["notes"] or "").split("\n", 1)[0][:40])
+        dpg.set_value(f"text__list_modified{i}", iso_from_unix(row["modified_unixtime"])[:16])
+
+    # a vertical slider's minimum is at the bottom, so it runs from the last offset up to 0
+    dpg.configure_item("slider__list", min_value=post_list.max_offset, max_value=0)
+    dpg.set_value("slider__list", post_list.offset)
+    count = len(post_list.ids)
+    dpg.set_value("text__list_count", f"{min(post_list.offset + 1, count)}-{min(post_list.offset + LIST_ROWS, count)} of {count}")
+
+
+# reloads the ids for the current filter, scrolled so the current post is in view. a search on a db file
+# lists the best matches first (bm25), each showing where it matched
+@callback
+def list_refresh_callback(sender, app_data, user_data) -> None:
+    cdb = user_data
+    post_list.ids = cdb.filtered_ids()
+    post_list.snippets = {}
+    if cdb.filter_mode == FilterMode.SEARCH and isinstance(cdb, SqliteCommentDB):
+        passing = set(post_list.ids) # the field filters still apply
+        ranked = [x for x in cdb.search(cdb.search_query, limit=None) if x["comment_id"] in passing]
+        post_list.ids = array.array("q", (x["comment_id"] for x in ranked))
+        post_list.snippets = {x["comment_id"]: x["snippet"] for x in ranked}
+
+    # ids from a db come sorted, from a --lazy file or a search they're not
+    current = bisect.bisect_left(post_list.ids, cdb.comment_id)
+    if current >= len(post_list.ids) or post_list.ids[current] != cdb.comment_id:
+        current = post_list.ids.index(cdb.comment_id) if cdb.comment_id in post_list.ids else 0
+    post_list.offset = min(max(0, current - LIST_ROWS // 2), post_list.max_offset)
+    refresh_post_list(cdb)
+
+
+# app_data is the new offset
+@callback
+def list_scroll_callback(sender, app_data, user_data) -> None:
+    cdb = user_data
+    post_list.offset = min(max(0, app_data), post_list.max_offset)
+    refresh_post_list(cdb)
+
+
+# app_data is the comment_id picked, the post view opens on it
+@callback
+def list_select_callback(sender, app_data, user_data) -> None:
+    cdb = user_data
+    if cdb.goto(app_data):
+        refresh_ui_from_data(cdb)
+    dpg.set_value("tab_bar__main", "tab__post")
+
+
+# these three only work out what happened and pass it on by name, so recordings hold comment ids and
+# offsets rather than widget ids
+def tab_bar_callback(sender, app_data, user_data) -> None:
+    if app_data == dpg.get_alias_id("tab__list"):
+        CALLBACKS["list_refresh_callback"](sender, None, user_data)
+
+
+def list_row_clicked(sender, app_data, user_data) -> None:
+    cdb, row = user_data
+    CALLBACKS["list_select_callback"](sender, post_list.ids[post_list.offset + row], cdb)
+
+
+def mouse_wheel_callback(sender, app_data, user_data) -> None:
+    if dpg.is_item_hovered("table__list"):
+        CALLBACKS["list_scroll_callback"](sender, post_list.offset - 3 * int(app_data), user_data)
+
+
+def draw_post_list(cdb) -> None:
+    with dpg.group(horizontal=True):
+        with dpg.table(tag="table__list", header_row=True, row_background=True, borders_innerV=True, width=940):
+            dpg.add_table_column(label="id", width_fixed=True, init_width_or_weight=80)
+            dpg.add_table_column(label="post", width_stretch=True)
+            dpg.add_table_column(label="status", width_fixed=True, init_width_or_weight=80)
+            dpg.add_table_column(label="notes", width_fixed=True, init_width_or_weight=160)
+            dpg.add_table_column(label="modified", width_fixed=True, init_width_or_weight=130)
+
+            for i in range(LIST_ROWS):
+                with dpg.table_row(tag=f"row__list{i}", show=False):
+                    dpg.add_selectable(tag=f"selectable__list{i}", span_columns=True, callback=list_row_clicked, user_data=(cdb, i))
+                    dpg.add_text(tag=f"text__list_header{i}")
+                    dpg.add_text(tag=f"text__list_status{i}")
+                    dpg.add_text(tag=f"text__list_notes{i}")
+                    dpg.add_text(tag=f"text__list_modified{i}")
+
+        dpg.add_slider_int(tag="slider__list", vertical=True, height=560, min_value=0, max_value=0, format="", callback=list_scroll_callback, user_data=cdb)
+
+    dpg.add_text(tag="text__list_count", default_value="")
+
+
+# (key, shift held) -> name of the callback it fires, see key_press_callback
+KEY_BINDINGS = {
+    (dpg.mvKey_J, False): "down_arrow_callback",
+    (dpg.mvKey_K, False): "up_arrow_callback",
+    (dpg.mvKey_R, False): "rejected_callback",
+    (dpg.mvKey_M, False): "maybe_callback",
+    (dpg.mvKey_G, False): "first_arrow_callback",
+    (dpg.mvKey_G, True): "last_arrow_callback",
+}
+
+# while one of these is being typed in, keys are just keys
+TEXT_INPUTS = ("input__notes", "input__search", "input__location", "input__min_salary")
+
+
+# one handler for every key: j/k next/prev, r/m reject/maybe, g/G first/last, / jumps to the search box.
+# it goes through the same callbacks as the buttons, so recordings and replays see the same thing either way
+def key_press_callback(sender, app_data, user_data) -> None:
+    if any(dpg.is_item_active(x) for x in TEXT_INPUTS):
+        return
+
+    if app_data == dpg.mvKey_Slash:
+        dpg.focus_item("input__search")
+        return
+
+    name = KEY_BINDINGS.get((app_data, dpg.is_key_down(dpg.mvKey_Shift)))
+    if name in ("rejected_callback", "maybe_callback"):
+        notes_button_callback(sender, None, (user_data, name))
+    elif name is not None:
+        CALLBACKS[name](sender, None, user_data)
+
+
+def register_input_handlers(cdb) -> None:
+    with dpg.handler_registry(tag="handlers__input"):
+        dpg.add_key_press_handler(callback=key_press_callback, user_data=cdb)
+        dpg.add_mouse_wheel_handler(callback=mouse_wheel_callback, user_data=cdb)
+
+
 def draw_ui(cdb) -> None:
     with dpg.window(tag="window__main", no_title_bar=True):
-        # ID & LINK
-        with dpg.child_window(label="window__header", autosize_x=True, height=40):
-            with dpg.group(horizontal=True) as g:
-                dpg.add_input_text(tag="text__comment_id", default_value=cdb.comment_id, readonly=True, width=95)
-                #dpg.add_button(tag="button__url", label=cdb.url, width=600, callback=lambda:webbrowser.open(cdb.url))
-                #dpg.bind_item_theme(dpg.last_item(), "theme__hyperlink")
-                draw_url_button(g, cdb.url)
-
-
-        # COMMENT TEXT & ARROWS
-        with dpg.group(horizontal=True):
-            # arrows
-            with dpg.child_window(label="window__arrows", width=40, height=460):
-                dpg.add_button(label="F", callback=first_arrow_callback, user_data=cdb, width=22, height=22)
-                dpg.add_spacer(height=20)
-                dpg.add_button(label="up", arrow=True, direction=dpg.mvDir_Up, callback=up_arrow_callback, user_data=cdb)
-                dpg.add_spacer(height=20)
-                dpg.add_button(label="down", arrow=True, direction=dpg.mvDir_Down, callback=down_arrow_callback, user_data=cdb)
-                dpg.add_spacer(height=20)
-                dpg.add_button(label="L", callback=last_arrow_callback, user_data=cdb, width=22, height=22)
-
-            # comment text
-            with dpg.child_window(label="window__comment", autosize_x=True, height=460):
-                dpg.add_text(tag="text__comment_text", wrap=750, default_value=cdb.comment_text)
-                dpg.bind_item_font(dpg.last_item(), "font__Verdana18")
-
-
-        # BUTTONS & NOTES
-        with dpg.child_window(label="window__actions", autosize_x=True, autosize_y=True):
-            # buttons
-            with dpg.group(horizontal=True, horizontal_spacing=64):
-                dpg.add_spacer()
-
-                dpg.add_button(tag="button__rejected", label="REJECTED", callback=rejected_callback, user_data=cdb, width=100, height=50)
-                dpg.bind_item_theme(dpg.last_item(), "theme__rejected_button")
-                dpg.bind_item_font(dpg.last_item(), "font__Verdana20")
-
-                dpg.add_button(tag="button__maybe", label="...maybe", callback=maybe_callback, user_data=cdb, width=100, height=50)
-                dpg.bind_item_theme(dpg.last_item(), "theme__maybe_button")
-                dpg.bind_item_font(dpg.last_item(), "font__Verdana20")
-
-            dpg.add_spacer(height=20)
-
-            # notes
-            with dpg.group(horizontal=True):
-                dpg.add_input_text(tag="input__notes", multiline=True, label="notes", width=400, height=100)
-
-                dpg.add_spacer(width=30)
-
-                with dpg.child_window(width=200, height=100):
-                    dpg.add_text(tag="text__status", default_value=(cdb.status or ""))
-                    dpg.add_text(tag="text__modified", default_value=iso_from_unix(cdb.modified_unixtime))
-
-                filter_items=(FilterMode.ALL.value, FilterMode.ALL_UNSTATUSED.value, FilterMode.MAYBE_ONLY.value, FilterMode.REJECTED_ONLY.value)
-                dpg.add_combo(items=filter_items, label="filter", default_value="All", callback=filter_mode_callback, user_data=cdb, width=150)
+        with dpg.tab_bar(tag="tab_bar__main", callback=tab_bar_callback, user_data=cdb):
+            with dpg.tab(tag="tab__post", label="post"):
+                # ID & LINK
+                with dpg.child_window(label="window__header", autosize_x=True, height=40):
+                    with dpg.group(horizontal=True) as g:
+                        dpg.add_input_text(tag="text__comment_id", default_value=cdb.comment_id, readonly=True, width=95)
+                        dpg.add_text(tag="text__author", default_value=f"{cdb.author or ''}  {iso_from_unix(cdb.posted_unixtime)}")
+                        draw_url_button(g, cdb.url)
+
+
+                # COMMENT TEXT & ARROWS
+                with dpg.group(horizontal=True):
+                    # arrows
+                    with dpg.child_window(label="window__arrows", width=40, height=460):
+                        dpg.add_button(label="F", callback=first_arrow_callback, user_data=cdb, width=22, height=22)
+                        dpg.add_spacer(height=20)
+                        dpg.add_button(label="up", arrow=True, direction=dpg.mvDir_Up, callback=up_arrow_callback, user_data=cdb)
+                        dpg.add_spacer(height=20)
+                        dpg.add_button(label="down", arrow=True, direction=dpg.mvDir_Down, callback=down_arrow_callback, user_data=cdb)
+                        dpg.add_spacer(height=20)
+                        dpg.add_button(label="L", callback=last_arrow_callback, user_data=cdb, width=22, height=22)
+
+                    # comment text
+                    with dpg.child_window(label="window__comment", autosize_x=True, height=460):
+                        dpg.add_text(tag="text__comment_text", wrap=750, default_value=cdb.comment_text)
+                        dpg.bind_item_font(dpg.last_item(), "font__Verdana18")
+
+
+                # BUTTONS & NOTES
+                with dpg.child_window(label="window__actions", autosize_x=True, autosize_y=True):
+                    # buttons
+                    with dpg.group(horizontal=True, horizontal_spacing=64):
+                        dpg.add_spacer()
+
+                        dpg.add_button(tag="button__rejected", label="REJECTED", callback=notes_button_callback, user_data=(cdb, "rejected_callback"), width=100, height=50)
+                        dpg.bind_item_theme(dpg.last_item(), "theme__rejected_button")
+                        dpg.bind_item_font(dpg.last_item(), "font__Verdana20")
+
+                        dpg.add_button(tag="button__maybe", label="...maybe", callback=notes_button_callback, user_data=(cdb, "maybe_callback"), width=100, height=50)
+                        dpg.bind_item_theme(dpg.last_item(), "theme__maybe_button")
+                        dpg.bind_item_font(dpg.last_item(), "font__Verdana20")
+
+                    dpg.add_spacer(height=20)
+
+                    # notes
+                    with dpg.group(horizontal=True):
+                        dpg.add_input_text(tag="input__notes", multiline=True, label="notes", width=400, height=100)
+
+                        dpg.add_spacer(width=30)
+
+                        with dpg.child_window(width=200, height=140):
+                            dpg.add_progress_bar(tag="progress__triaged", width=185)
+                            refresh_progress(cdb)
+                            dpg.add_text(tag="text__status", default_value=(cdb.status or ""))
+                            dpg.add_text(tag="text__modified", default_value=iso_from_unix(cdb.modified_unixtime))
+                            dpg.add_text(tag="text__similar", default_value=similar_text(cdb), wrap=190)
+
+                        with dpg.group():
+                            thread_items = [ALL_THREADS] + [thread_label(x) for x in cdb.threads()]
+                            current_thread = next((x for x in thread_items[1:] if x.split()[0] == str(cdb.thread_id)), ALL_THREADS)
+                            dpg.add_combo(tag="combo__thread", items=thread_items, label="thread", default_value=current_thread, callback=thread_callback, user_data=cdb, width=200)
+                            filter_items=(FilterMode.ALL.value, FilterMode.ALL_UNSTATUSED.value, FilterMode.MAYBE_ONLY.value, FilterMode.REJECTED_ONLY.value, FilterMode.SEARCH.value)
+                            dpg.add_combo(tag="combo__filter", items=filter_items, label="filter", default_value=cdb.filter_mode.value, callback=filter_mode_callback, user_data=cdb, width=150)
+                            dpg.add_input_text(tag="input__search", hint="search", default_value=cdb.search_query, callback=search_callback, user_data=cdb, width=150)
+                            dpg.add_text(tag="text__search_count", default_value=f"{cdb.search_count(cdb.search_query)} match(es)" if cdb.filter_mode == FilterMode.SEARCH else "")
+
+                        with dpg.group():
+                            dpg.add_checkbox(tag="checkbox__remote", label="remote only", default_value=cdb.remote_only, callback=field_filter_input_callback, user_data=cdb)
+                            dpg.add_input_text(tag="input__location", hint="location(s), comma-separated", default_value=", ".join(cdb.locations), on_enter=True, callback=field_filter_input_callback, user_data=cdb, width=150)
+                            dpg.add_input_int(tag="input__min_salary", label="min salary", default_value=cdb.min_salary or 0, step=10000, min_value=0, min_clamped=True, on_enter=True, callback=field_filter_input_callback, user_data=cdb, width=150)
+
+            with dpg.tab(tag="tab__list", label="list"):
+                draw_post_list(cdb)
 
     dpg.set_primary_window("window__main", True)
 
 
 def main(args) -> int:
+    global profiler, recorder
+    if args.lazy and (not args.json_file or args.db_file or args.rules_file or args.replay_file):
+        print("ERROR: --lazy takes a --json-file, and no --db-file, --rules-file or --replay-file", file=sys.stderr)
+        return 1
+    if not args.lazy and not args.db_file:
+        print("ERROR: --db-file is required (or --json-file with --lazy)", file=sys.stderr)
+        return 1
+
+    if args.profile_file or args.replay_file:
+        profiler = latency.Profiler()
+    if args.record_file:
+        recorder = open(args.record_file, mode="at", encoding="utf-8", buffering=1)
+    if args.replay_file:
+        args.db_file = scratch_copy(args.db_file)
+        print(f"replaying {args.replay_file} against a copy of the db, {args.db_file}", file=sys.stderr)
+
     ### load data
     #infile_path = pathlib.Path(args.json_file)
     #with infile_path.open(mode="rt", encoding="utf-8") as f:
     #    cdb = CommentDB.from_json_file(f)
-    if args.json_file:
+    if args.lazy:
+        # reviewed where it is, nothing imported: statuses go to a file next to it
+        started = time.perf_counter()
+        cdb = LazyCommentDB(args.json_file)
+        print(f"opened {len(cdb.comment_ids)} post(s) in {(time.perf_counter() - started) * 1000:.0f}ms", file=sys.stderr)
+    elif args.json_file:
         infile_path = pathlib.Path(args.json_file)
         with infile_path.open(mode="rt", encoding="utf-8") as f:
             cdb = SqliteCommentDB.import_json_file(f, args.db_file)
     else:
         cdb = SqliteCommentDB.from_db_file(args.db_file)
 
+    # pick up where the last session left off, unless a different thread was asked for. otherwise (one db
+    # holds every month) start on the one asked for or else the newest
+    session = cdb.load_session()
+    if session is not None and args.thread_id in (None, session["thread_id"]):
+        restore_session(cdb, session)
+        print(f"resuming at {cdb.comment_id}", file=sys.stderr)
+    else:
+        session = None
+        threads = cdb.threads()
+        if args.thread_id is not None:
+            cdb.thread_id = args.thread_id
+        elif threads:
+            cdb.thread_id = threads[0]["thread_id"]
+        cdb.first()
+
+    # pre-reject whatever the rules catch and start on what's left
+    if args.rules_file:
+        results = triage.apply_rules(cdb.dbconn, triage.load_rules(args.rules_file))
+        print(f"{sum(count for _, count, _ in results)} post(s) triaged by {args.rules_file}")
+        cdb.invalidate()
+        cdb.filter_mode = FilterMode.ALL_UNSTATUSED
+        cdb.first()
+
+    # status changes are committed in the background, close() below makes sure the last of them land
+    cdb.enable_write_behind(flush_interval_ms=args.flush_interval_ms)
+
+    # from here on every db access is timed, and callbacks get the timed stand-in through user_data
+    if profiler is not None:
+        cdb = latency.TimedCommentDB(cdb, profiler)
+
+
+    if args.replay_file:
+        return replay(cdb, args)
+
 
     ### dearpygui initialization
     dpg.create_context()
     dpg.create_viewport(title="Who's Hiring?", width=1024, height=768, resizable=False)
     dpg.setup_dearpygui()
+    ui_state = (session or {}).get("ui_state") or {}
+    if ui_state.get("viewport_pos"):
+        dpg.set_viewport_pos(ui_state["viewport_pos"])
 
 
     ### our initialization
@@ -206,20 +585,89 @@ def main(args) -> int:
 
     ### actually draw stuff
     draw_ui(cdb)
+    register_input_handlers(cdb)
+    if ui_state.get("tab") == "tab__list":
+        dpg.set_value("tab_bar__main", "tab__list")
+        list_refresh_callback(None, None, cdb)
 
 
     ### dearpygui startup & shutdown
-    dpg.show_viewport()
-    dpg.start_dearpygui()
-    dpg.destroy_context()
+    try:
+        dpg.show_viewport()
+        dpg.start_dearpygui()
+        cdb.save_session(ui_state_from_ui())
+        dpg.destroy_context()
+    finally:
+        cdb.close()
+        finish_instrumentation(args)
+
+    return 0
+
+
+# what save_session() keeps of the window besides the db's own state, read back at startup
+def ui_state_from_ui() -> dict:
+    on_list = dpg.get_value("tab_bar__main") == dpg.get_alias_id("tab__list")
+    return {"viewport_pos": dpg.get_viewport_pos(), "tab": "tab__list" if on_list else "tab__post"}
+
 
+# plays a --record-file back through the same callbacks, with the UI built but never shown
+def replay(cdb, args) -> int:
+    dpg.create_context()
+    define_themes()
+    register_fonts()
+    draw_ui(cdb)
+
+    try:
+        with open(args.replay_file, mode="rt", encoding="utf-8") as f:
+            for event in iter_json_records(f):
+                CALLBACKS[event["callback"]](None, event["app_data"], cdb)
+    finally:
+        dpg.destroy_context()
+        cdb.close()
+        finish_instrumentation(args)
+        for suffix in ("", "-wal", "-shm"):
+            pathlib.Path(f"{args.db_file}{suffix}").unlink(missing_ok=True)
+
+    slow = profiler.over_limit(args.fail_over_ms) if args.fail_over_ms is not None else []
+    if slow:
+        print(f"p99 over {args.fail_over_ms}ms: {', '.join(sorted(slow))}", file=sys.stderr)
+        return 1
     return 0
 
 
+def finish_instrumentation(args) -> None:
+    if recorder is not None:
+        recorder.close()
+    if profiler is not None:
+        profiler.print_summary()
+        if args.profile_file:
+            profiler.export(args.profile_file)
+            print(f"latency histograms written to {args.profile_file}", file=sys.stderr)
+
+
+# a replay shouldn't touch the real db, it gets a copy
+def scratch_copy(db_file_name: str) -> str:
+    scratch_file_name = tempfile.NamedTemporaryFile(prefix="review-replay-", suffix=".db", delete=False).name
+    source = sqlite3.connect(db_file_name)
+    target = sqlite3.connect(scratch_file_name)
+    source.backup(target)
+    target.close()
+    source.close()
+    return scratch_file_name
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Hacker News \"Who's Hiring\" review tool")
-    parser.add_argument("--db-file", required=True, help="SQLite database file to work with")
-    parser.add_argument("--json-file", required=False, help="line-delimited JSON file of input data")
+    parser.add_argument("--db-file", required=False, help="SQLite database file to work with")
+    parser.add_argument("--json-file", required=False, help="line-delimited JSON file of input data, added to the db file if it already exists")
+    parser.add_argument("--lazy", required=False, action="store_true", help="Review --json-file in place instead of importing it, statuses are kept in <json-file>.status.jsonl")
+    parser.add_argument("--thread-id", required=False, type=int, help="HN item id of the thread to review, defaults to the newest in the db")
+    parser.add_argument("--rules-file", required=False, help="JSON file of triage rules to apply before starting, see triage.py")
+    parser.add_argument("--flush-interval-ms", required=False, type=int, default=250, help="Longest a status change waits before being committed")
+    parser.add_argument("--profile-file", required=False, help="Time every callback (DB vs UI) and write latency histograms here as JSON on exit")
+    parser.add_argument("--record-file", required=False, help="Append every callback fired to this file, for --replay-file")
+    parser.add_argument("--replay-file", required=False, help="Run the callbacks recorded in this file against a copy of the db, without opening a window, and report their latency")
+    parser.add_argument("--fail-over-ms", required=False, type=float, help="With --replay-file, exit 1 if any callback's p99 is over this")
     args = parser.parse_args()
 
     sys.exit(main(args))
@@ -1,27 +1,52 @@
 import sys
+import time
+import array
+import argparse
+import collections
 import webbrowser
 from contextlib import contextmanager
+from typing import List, Optional
 
 import glfw
 import OpenGL.GL as gl
 
 import imgui
 from imgui.integrations.glfw import GlfwRenderer
+import pendulum
 
+from commentdb import SqliteCommentDB, FilterMode
 
-SAMPLE_COMMENT = """
-Grafana Labs | Backend Engineers, Frontend Engineers, Engineering Managers, Senior Backend Engineers | Remote Global | Full-Time | Remote | https://grafana.com/
 
-You know us, we make the Grafana dashboard you use to observe your systems and business. We also work on Prometheus, Cortex, Loki, Tempo, a SaaS offering, an Enterprise offering. We're well-funded and have a long list of customers whose brands your family recognise. We are OSS, AGPL and CNCF.
+# The same review loop as review.py, on imgui. imgui redraws everything every frame, so this only draws
+# frames when something happened: it sleeps in glfw.wait_events() until there's input, then renders a few
+# frames for imgui to settle (hover highlights, the click after the press) and goes back to sleep.
+# Keys: j/k next/previous, r/m reject/maybe, g/G first/last (when not typing).
 
-We are hiring globally in full-time remote roles. Note: The entire company has been remote first forever and our founders are on multiple continents, this is not something we are learning - this is who we are.
+WINDOW_WIDTH, WINDOW_HEIGHT = 1024, 768
+COMMENT_WIDTH = 960 - 40 - 2 * 8 # comment pane, less the arrows pane and padding
 
-We are looking for engineers at all levels, wherever you are. But specifically right now we are hiring in the Americas and APAC. It doesn't matter where you are in those time zones.
+# frames drawn after the last input before going idle
+SETTLE_FRAMES = 3
 
-https://grafana.com/about/careers/
+# (color, (r, g, b, a)) pushed around a widget; worked out once rather than every frame
+HYPERLINK_COLORS = (
+    (imgui.COLOR_BUTTON, (0, 0, 0, 0)),
+    (imgui.COLOR_BUTTON_HOVERED, (29/255, 151/255, 236/255, 25/255)),
+    (imgui.COLOR_BUTTON_ACTIVE, (29/255, 151/255, 236/255, 75/255)),
+    (imgui.COLOR_TEXT, (29/255, 151/255, 236/255, 1)),
+)
+REJECTED_COLORS = (
+    (imgui.COLOR_BUTTON, (167/255, 34/255, 0, 1)),
+    (imgui.COLOR_BUTTON_HOVERED, (210/255, 34/255, 0, 1)),
+    (imgui.COLOR_BUTTON_ACTIVE, (255/255, 34/255, 0, 1)),
+)
+MAYBE_COLORS = (
+    (imgui.COLOR_BUTTON, (17/255, 154/255, 17/255, 1)),
+    (imgui.COLOR_BUTTON_HOVERED, (17/255, 194/255, 17/255, 1)),
+    (imgui.COLOR_BUTTON_ACTIVE, (17/255, 244/255, 17/255, 1)),
+)
 
-If you cannot see something on that page that you identify as... apply to the nearest role and describe what you are looking for in your cover letter as we do read them all.
-"""
+FILTER_MODES = list(FilterMode)
 
 
 @contextmanager
@@ -42,9 +67,29 @@ def ctx_begin_child(label, width=0, height=0, border=False, flags=0):
         imgui.end_child()
 
 
+@contextmanager
+def ctx_style_colors(colors, rounding: Optional[float] = None):
+    for color, rgba in colors:
+        imgui.push_style_color(color, *rgba)
+    if rounding is not None:
+        imgui.push_style_var(imgui.STYLE_FRAME_ROUNDING, rounding)
+    try:
+        yield
+    finally:
+        if rounding is not None:
+            imgui.pop_style_var()
+        imgui.pop_style_color(len(colors))
+
+
+def iso_from_unix(unixtime: Optional[int]) -> str:
+    if unixtime is None:
+        return ""
+    else:
+        return pendulum.from_timestamp(unixtime).in_tz("America/Denver").isoformat()
+
+
 def impl_glwf_init() -> None:
-    width, height = 1024, 768
-    window_name = "imgui/glfw example"
+    window_name = "Who's Hiring?"
 
     if not glfw.init():
         print("glfw.init() failed", file=sys.stderr)
@@ -56,8 +101,9 @@ def impl_glwf_init() -> None:
     glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
 
     glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, gl.GL_TRUE)
+    glfw.window_hint(glfw.RESIZABLE, gl.GL_FALSE)
 
-    window = glfw.create_window(width, height, window_name, None, None)
+    window = glfw.create_window(WINDOW_WIDTH, WINDOW_HEIGHT, window_name, None, None)
     glfw.make_context_current(window)
 
     if not window:
@@ -65,12 +111,132 @@ def impl_glwf_init() -> None:
         print("could not initialize GLFW window", file=sys.stderr)
         sys.exit(2)
 
+    glfw.swap_interval(1)
+
     return window
 
 
-def draw_ui(default_font) -> None:
+# word-wraps text to a pixel width with the current font. imgui.text_wrapped() would redo this every
+# frame, the result here is cached per comment instead
+def wrap_text(text: str, width: float) -> str:
+    space_width = imgui.calc_text_size(" ").x
+    out_lines = []
+    for paragraph in text.split("\n"):
+        line: List[str] = []
+        line_width = 0.0
+        for word in paragraph.split(" "):
+            word_width = imgui.calc_text_size(word).x
+            if line and line_width + space_width + word_width > width:
+                out_lines.append(" ".join(line))
+                line, line_width = [], 0.0
+            line_width += (space_width if line else 0.0) + word_width
+            line.append(word)
+        out_lines.append(" ".join(line))
+    return "\n".join(out_lines)
+
+
+class ReviewState:
+    def __init__(self, cdb: SqliteCommentDB, wrap_cache_size: int = 64):
+        self.cdb = cdb
+        self.notes = cdb.notes or ""
+        self.filter_index = FILTER_MODES.index(cdb.filter_mode)
+        self.search_query = cdb.search_query
+
+        # comment_id -> body wrapped to COMMENT_WIDTH
+        self.wrap_cache = collections.OrderedDict()
+        self.wrap_cache_size = wrap_cache_size
+
+        # CPU time per rendered frame (seconds), for the overlay
+        self.frame_times = collections.deque(maxlen=120)
+        self.frames_rendered = 0
+        self.started = time.monotonic()
+
+    def wrapped_body(self) -> str:
+        comment_id = self.cdb.comment_id
+        wrapped = self.wrap_cache.get(comment_id)
+        if wrapped is None:
+            wrapped = wrap_text(self.cdb.comment_text, COMMENT_WIDTH)
+            self.wrap_cache[comment_id] = wrapped
+            if len(self.wrap_cache) > self.wrap_cache_size:
+                self.wrap_cache.popitem(last=False)
+        else:
+            self.wrap_cache.move_to_end(comment_id)
+        return wrapped
+
+    # after moving to another record
+    def moved(self, moved: bool) -> None:
+        if moved:
+            self.notes = self.cdb.notes or ""
+
+    def next(self) -> None:
+        self.moved(self.cdb.next())
+
+    def prev(self) -> None:
+        self.moved(self.cdb.prev())
+
+    def first(self) -> None:
+        self.moved(self.cdb.first())
+
+    def last(self) -> None:
+        self.moved(self.cdb.last())
+
+    def reject(self) -> None:
+        self.cdb.reject(self.notes)
+        self.next()
+
+    def maybe(self) -> None:
+        self.cdb.maybe(self.notes)
+        self.next()
+
+    # like review.py's search box: typing switches to the Search filter, clearing it goes back to All
+    def search(self, query: str) -> None:
+        self.search_query = query
+        self.cdb.search_query = query
+        self.cdb.filter_mode = FilterMode.SEARCH if query.strip() else FilterMode.ALL
+        self.filter_index = FILTER_MODES.index(self.cdb.filter_mode)
+        self.first()
+
+
+def handle_keys(state: ReviewState) -> None:
+    if imgui.is_any_item_active():
+        return
+
+    shift = imgui.get_io().key_shift
+    if imgui.is_key_pressed(glfw.KEY_J):
+        state.next()
+    elif imgui.is_key_pressed(glfw.KEY_K):
+        state.prev()
+    elif imgui.is_key_pressed(glfw.KEY_R):
+        state.reject()
+    elif imgui.is_key_pressed(glfw.KEY_M):
+        state.maybe()
+    elif imgui.is_key_pressed(glfw.KEY_G):
+        state.last() if shift else state.first()
+
+
+def draw_frame_time_overlay(state: ReviewState) -> None:
+    imgui.set_next_window_position(WINDOW_WIDTH - 230, 8)
+    imgui.set_next_window_bg_alpha(0.6)
+    overlay_flags = (imgui.WINDOW_NO_DECORATION | imgui.WINDOW_ALWAYS_AUTO_RESIZE | imgui.WINDOW_NO_SAVED_SETTINGS
+                     | imgui.WINDOW_NO_FOCUS_ON_APPEARING | imgui.WINDOW_NO_NAV | imgui.WINDOW_NO_MOVE)
+    imgui.begin("frame times", closable=False, flags=overlay_flags)
+
+    times_ms = [x * 1000 for x in state.frame_times]
+    last_ms = times_ms[-1] if times_ms else 0.0
+    max_ms = max(times_ms, default=0.0)
+    imgui.text(f"frame {last_ms:.2f}ms, max {max_ms:.2f}ms")
+    imgui.text(f"{state.frames_rendered} frames in {time.monotonic() - state.started:.0f}s")
+    if times_ms:
+        imgui.plot_lines("##frame_times", array.array("f", times_ms), scale_min=0, graph_size=(200, 40))
+
+    imgui.end()
+
+
+def draw_ui(state: ReviewState, default_font) -> None:
+    cdb = state.cdb
+
     imgui.set_next_window_position(x=0, y=0)
-    imgui.set_next_window_size(width=1024, height=768)
+    imgui.set_next_window_size(width=WINDOW_WIDTH, height=WINDOW_HEIGHT)
     main_window_flags = (imgui.WINDOW_NO_COLLAPSE | imgui.WINDOW_NO_RESIZE | imgui.WINDOW_NO_MOVE | imgui.WINDOW_NO_TITLE_BAR)
     imgui.begin(label="main window", closable=False, flags=main_window_flags)
 
@@ -79,39 +245,35 @@ def draw_ui(default_font) -> None:
     ## ID & LINK
     with ctx_begin_child(label="window__header", width=0, height=40, border=True):
         imgui.push_item_width(95)
-        imgui.input_text(label="", value="28719321", buffer_length=16, flags=imgui.INPUT_TEXT_READ_ONLY)
+        imgui.input_text(label="##comment_id", value=str(cdb.comment_id), buffer_length=16, flags=imgui.INPUT_TEXT_READ_ONLY)
         imgui.pop_item_width()
 
         imgui.same_line()
 
-        imgui.push_style_color(imgui.COLOR_BUTTON, r=0/255, g=0/255, b=0/255)
-        imgui.push_style_color(imgui.COLOR_BUTTON_HOVERED, r=29/255, g=151/255, b=236/255, a=25/255)
-        imgui.push_style_color(imgui.COLOR_BUTTON_ACTIVE, r=29/255, g=151/255, b=236/266, a=75/255)
-        imgui.push_style_color(imgui.COLOR_TEXT, r=29/255, g=151/255, b=236/255)
-        if imgui.button(label="https://news.ycombinator.com/item?id=28719321", width=600, height=0):
-            webbrowser.open("https://news.ycombinator.com/item?id=28719321")
-        imgui.pop_style_color(4)
+        with ctx_style_colors(HYPERLINK_COLORS):
+            if imgui.button(label=cdb.url, width=600, height=0):
+                webbrowser.open(cdb.url)
 
 
     ## COMMENT TEXT & ARROWS
     with ctx_begin_group():
         with ctx_begin_child(label="window__arrows", width=40, height=460, border=True):
             if imgui.button(label="F", width=22, height=22):
-                print("F clicked")
+                state.first()
             imgui.dummy(0, 20)
             if imgui.arrow_button(label="button__up", direction=imgui.DIRECTION_UP):
-                print("up clicked")
+                state.prev()
             imgui.dummy(0, 20)
             if imgui.arrow_button(label="button__down", direction=imgui.DIRECTION_DOWN):
-                print("down clicked")
+                state.next()
             imgui.dummy(0, 20)
             if imgui.button(label="L", width=22, height=22):
-                print("L clicked")
+                state.last()
 
         imgui.same_line()
 
         with ctx_begin_child(label="window__comment", width=0, height=460, border=True):
-            imgui.text_wrapped(SAMPLE_COMMENT)
+            imgui.text_unformatted(state.wrapped_body())
 
 
     ## BUTTONS
@@ -120,48 +282,56 @@ def draw_ui(default_font) -> None:
         with ctx_begin_group():
             imgui.dummy(64, 0)
             imgui.same_line()
-            imgui.push_style_color(imgui.COLOR_BUTTON, r=167/255, g=34/255, b=0/255)
-            imgui.push_style_color(imgui.COLOR_BUTTON_HOVERED, r=210/255, g=34/255, b=0/255)
-            imgui.push_style_color(imgui.COLOR_BUTTON_ACTIVE, r=255/255, g=34/255, b=0/255)
-            imgui.push_style_var(imgui.STYLE_FRAME_ROUNDING, 35)
-            if imgui.button(label="REJECTED", width=100, height=50):
-                print("REJECTED clicked")
-            imgui.pop_style_var()
-            imgui.pop_style_color(3)
+            with ctx_style_colors(REJECTED_COLORS, rounding=35):
+                if imgui.button(label="REJECTED", width=100, height=50):
+                    state.reject()
             imgui.same_line()
             imgui.dummy(64, 0)
             imgui.same_line()
-            imgui.push_style_color(imgui.COLOR_BUTTON, r=17/255, g=154/255, b=17/255)
-            imgui.push_style_color(imgui.COLOR_BUTTON_HOVERED, r=17/255, g=194/255, b=17/255)
-            imgui.push_style_color(imgui.COLOR_BUTTON_ACTIVE, r=17/255, g=244/255, b=17/255)
-            imgui.push_style_var(imgui.STYLE_FRAME_ROUNDING, 35)
-            if imgui.button(label="...maybe", width=100, height=50):
-                print("MAYBE clicked")
-            imgui.pop_style_var()
-            imgui.pop_style_color(3)
+            with ctx_style_colors(MAYBE_COLORS, rounding=35):
+                if imgui.button(label="...maybe", width=100, height=50):
+                    state.maybe()
 
         imgui.dummy(0, 20)
 
         ### notes & filter mode
         with ctx_begin_group():
-            changed, notes_input = imgui.input_text_multiline(label="notes", value="", buffer_length=64*1024, width=400, height=100)
+            _, state.notes = imgui.input_text_multiline(label="notes", value=state.notes, buffer_length=64*1024, width=400, height=100)
             imgui.same_line()
             imgui.dummy(30, 0)
             imgui.same_line()
             with ctx_begin_child(label="window__info", width=200, height=100, border=True):
-                imgui.text("status here")
-                imgui.text("modified here")
+                imgui.text(cdb.status or "")
+                imgui.text(iso_from_unix(cdb.modified_unixtime))
             imgui.same_line()
-            imgui.push_item_width(150)
-            changed, filter_selection = imgui.combo(label="filter", current=0, items=["all", "all un-statused", "rejected only", "maybe only"])
-            imgui.pop_item_width()
+            with ctx_begin_group():
+                imgui.push_item_width(150)
+                changed, state.filter_index = imgui.combo(label="filter", current=state.filter_index, items=[x.value for x in FILTER_MODES])
+                search_changed, search_query = imgui.input_text(label="search", value=state.search_query, buffer_length=256)
+                imgui.pop_item_width()
+            if changed:
+                cdb.filter_mode = FILTER_MODES[state.filter_index]
+                state.first()
+            if search_changed:
+                state.search(search_query)
 
     imgui.pop_font()
 
     imgui.end() # main window
 
 
-def main() -> int:
+def main(args) -> int:
+    cdb = SqliteCommentDB.from_db_file(args.db_file)
+    threads = cdb.threads()
+    if args.thread_id is not None:
+        cdb.thread_id = args.thread_id
+    elif threads:
+        cdb.thread_id = threads[0]["thread_id"]
+    cdb.first()
+    cdb.enable_write_behind(flush_interval_ms=args.flush_interval_ms)
+
+    state = ReviewState(cdb)
+
     imgui.create_context()
     window = impl_glwf_init()
     impl = GlfwRenderer(window)
@@ -170,30 +340,58 @@ def main() -> int:
     verdana_16 = io.fonts.add_font_from_file_ttf("verdana.ttf", 16)
     impl.refresh_font_texture()
 
-    while not glfw.window_should_close(window):
-        glfw.poll_events()
-        impl.process_inputs()
-
-        imgui.new_frame()
-        #######################################
-
-
-        draw_ui(default_font=verdana_16)
-
-
-        #######################################
-        gl.glClearColor(0.5, 0.5, 0.5, 1) # appears to set the main window background color...
-        gl.glClear(gl.GL_COLOR_BUFFER_BIT)
-
-        imgui.render()
-        impl.render(imgui.get_draw_data())
-        glfw.swap_buffers(window)
+    try:
+        settle = SETTLE_FRAMES
+        while not glfw.window_should_close(window):
+            # idle: sleep until there's input. otherwise keep drawing until imgui has settled
+            if settle > 0:
+                glfw.poll_events()
+            else:
+                glfw.wait_events()
+                settle = SETTLE_FRAMES
+            impl.process_inputs()
+
+            frame_started = time.perf_counter()
+            imgui.new_frame()
+            #######################################
+
+
+            handle_keys(state)
+            draw_ui(state, default_font=verdana_16)
+            if args.frame_times:
+                draw_frame_time_overlay(state)
+
+
+            #######################################
+            gl.glClearColor(0.5, 0.5, 0.5, 1) # appears to set the main window background color...
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+
+            imgui.render()
+            impl.render(imgui.get_draw_data())
+            state.frame_times.append(time.perf_counter() - frame_started)
+            state.frames_rendered += 1
+            glfw.swap_buffers(window)
+
+            # typing (blinking cursor) or dragging counts as still busy
+            if imgui.is_any_item_active():
+                settle = SETTLE_FRAMES
+            else:
+                settle -= 1
 
-    impl.shutdown()
-    glfw.terminate()
+    finally:
+        impl.shutdown()
+        glfw.terminate()
+        cdb.close()
 
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    parser = argparse.ArgumentParser(description="Hacker News \"Who's Hiring\" review tool (imgui version)")
+    parser.add_argument("--db-file", required=True, help="SQLite database file to work with")
+    parser.add_argument("--thread-id", required=False, type=int, help="HN item id of the thread to review, defaults to the newest in the db")
+    parser.add_argument("--flush-interval-ms", required=False, type=int, default=250, help="Longest a status change waits before being committed")
+    parser.add_argument("--frame-times", required=False, action="store_true", help="Show a frame-time overlay")
+    args = parser.parse_args()
+
+    sys.exit(main(args))
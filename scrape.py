@@ -1,66 +1,507 @@
 import sys
 import os
+import re
+import json
+import hashlib
 import argparse
 import pathlib
 import time
+import random
+import threading
+import email.utils
+import urllib.parse
+import concurrent.futures
+from typing import Callable, Iterator, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 
+from pagestore import PageStore
+
 BASE_URL = "https://news.ycombinator.com/"
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0" # FF 89.0.2
 
+# item URLs look like https://news.ycombinator.com/item?id=28719320, later pages add &p=N
+ITEM_ID_PATTERN = re.compile(r"[?&]id=(\d+)")
+PAGE_NUM_PATTERN = re.compile(r"&p=\d+")
+
+# comment rows look like <tr class='athing comtr' id='28719321'>, good enough to find the newest id on a page
+COMTR_ID_PATTERN = re.compile(r"""<tr class=['"]athing comtr['"] id=['"](\d+)['"]""")
+
+MANIFEST_FILE_NAME = "manifest.json"
+CRAWL_STATE_FILE_NAME = "crawl_state.json"
+
+# HN under load answers 503 (sometimes 429 with Retry-After), worth waiting out rather than giving up
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# token bucket shared by all workers: `rate` requests per second, up to `burst` back-to-back
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def make_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT})
 
-def get_next_page(body: str) -> str:
+    # one pool shared by every worker, so connections (and TLS handshakes) get reused
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def get_next_page(body: str, page_url: str = BASE_URL) -> str:
     soup = BeautifulSoup(body, "html.parser")
 
     # "More" link looks like <a href="item?id=28719320&amp;p=2" class="morelink" rel="next">More</a>
     # there's only ever 1 or 0 of these in the page
     for link in soup.find_all("a", class_="morelink"):
-        return f"{BASE_URL}{link['href']}"
+        return urllib.parse.urljoin(page_url, link["href"])
 
     return None
 
 
-def main(args) -> int:
-    # ensure output directory
-    os.makedirs(args.output_dir, exist_ok=True)
-
-    # go get pages and save them
-    req_headers = {"User-Agent": USER_AGENT}
-
-    pagenum = 1
-    url = args.url
-    while(url is not None and pagenum <= args.max_pages):
-        if pagenum > 1:
-            print("(waiting...)")
-            time.sleep(5)
+def thread_id_from_url(url: str) -> Optional[str]:
+    match = ITEM_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def predict_page_url(url: str, pagenum: int) -> Optional[str]:
+    # HN's "More" links are just the base item URL with &p=N tacked on, so later pages can be guessed
+    # before the earlier ones have come back
+    if thread_id_from_url(url) is None:
+        return None
+
+    base = PAGE_NUM_PATTERN.sub("", url)
+    if pagenum == 1:
+        return base
+    return f"{base}&p={pagenum}"
+
+
+def max_comment_id(body: str) -> Optional[int]:
+    return max((int(x) for x in COMTR_ID_PATTERN.findall(body)), default=None)
+
+
+# the manifest remembers, per page file: the URL, ETag/Last-Modified, a content hash, and the newest comment id seen
+def load_manifest(output_dir: pathlib.Path) -> dict:
+    manifest_path = output_dir / MANIFEST_FILE_NAME
+    if not manifest_path.exists():
+        return {"pages": {}}
+
+    with manifest_path.open(mode="rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir: pathlib.Path, manifest: dict) -> None:
+    manifest_path = output_dir / MANIFEST_FILE_NAME
+    temp_path = manifest_path.with_suffix(".tmp")
+    with temp_path.open(mode="wt", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+def conditional_headers(output_dir: pathlib.Path, page_entry: Optional[dict]) -> dict:
+    # only ask for a 304 if we still have the file to fall back on
+    if page_entry is None or not (output_dir / page_entry["file"]).exists():
+        return {}
+
+    headers = {}
+    if page_entry.get("etag"):
+        headers["If-None-Match"] = page_entry["etag"]
+    if page_entry.get("last_modified"):
+        headers["If-Modified-Since"] = page_entry["last_modified"]
+    return headers
+
+
+# exponential backoff with full jitter (a random wait up to backoff * 2^attempt, capped), but never less
+# than the server's Retry-After
+class RetryPolicy:
+    def __init__(self, retries: int = 5, backoff: float = 2.0, max_backoff: float = 120.0, timeout: float = 30.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+    def delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        wait = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        return max(wait, retry_after or 0.0)
+
+
+# Retry-After is either a number of seconds or an HTTP date
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch(session: requests.Session, limiter: RateLimiter, url: str, headers: Optional[dict] = None,
+          retry: Optional[RetryPolicy] = None) -> requests.Response:
+    retry = retry or RetryPolicy(retries=0)
+    for attempt in range(retry.retries + 1):
+        limiter.acquire()
         print(f"requesting page {url}")
-        response = requests.get(url, headers=req_headers)
-        
-        if response.status_code != 200:
-            print(f"ERROR: status code {response.status_code}", file=sys.stderr)
-            print(response.text, file=sys.stderr)
+        try:
+            response = session.get(url, headers=headers, timeout=retry.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retry.retries:
+                raise
+            response, reason = None, type(e).__name__
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt == retry.retries:
+                return response
+            reason = f"status code {response.status_code}"
+
+        wait = retry.delay(attempt, response)
+        print(f"{reason} for {url}, retry {attempt + 1} of {retry.retries} in {wait:.1f}s", file=sys.stderr)
+        time.sleep(wait)
+
+
+class ScrapeError(Exception):
+    def __init__(self, url: str, response: requests.Response):
+        super().__init__(f"status code {response.status_code} for {url}")
+        self.url = url
+        self.response = response
+
+
+# yields (pagenum, page_url, response, body) for each page of a thread, in order, following "More" links.
+# headers_for(pagenum) supplies extra request headers, cached_body(pagenum) supplies the body for a 304.
+# to pick up part way through, pass the url of page `first_pagenum` as url
+def iter_thread_pages(url: str, session: requests.Session, limiter: RateLimiter, pool: concurrent.futures.Executor,
+                      max_pages: int = 999, speculate: int = 0,
+                      headers_for: Optional[Callable[[int], dict]] = None,
+                      cached_body: Optional[Callable[[int], str]] = None,
+                      retry: Optional[RetryPolicy] = None,
+                      first_pagenum: int = 1) -> Iterator[Tuple[int, str, requests.Response, str]]:
+    retry = retry or RetryPolicy()
+
+    # pagenum -> (url, future) for every request in flight, including speculative ones
+    in_flight = {}
+
+    def submit(pagenum: int, page_url: str) -> None:
+        headers = headers_for(pagenum) if headers_for else None
+        in_flight[pagenum] = (page_url, pool.submit(fetch, session, limiter, page_url, headers, retry))
+
+    def cancel_speculative() -> None:
+        for _, future in in_flight.values():
+            future.cancel()
+        in_flight.clear()
+
+    # the last page of a thread is the short one, so once a page comes back with fewer comments than the
+    # fullest one so far there's nothing left worth guessing at
+    full_page = 0
+
+    pagenum = first_pagenum
+    submit(pagenum, url)
+    try:
+        while pagenum <= max_pages:
+            # keep up to `speculate` guessed pages queued behind the one we're waiting on
+            for ahead in range(pagenum + 1, min(pagenum + speculate, max_pages) + 1):
+                guessed_url = predict_page_url(url, ahead)
+                if ahead not in in_flight and guessed_url is not None:
+                    submit(ahead, guessed_url)
+
+            page_url, future = in_flight.pop(pagenum)
+            response = future.result()
+
+            if response.status_code == 304 and cached_body is not None:
+                body = cached_body(pagenum)
+            elif response.status_code == 200:
+                body = response.text
+            else:
+                raise ScrapeError(page_url, response)
+
+            yield pagenum, page_url, response, body
+
+            next_url = get_next_page(body, page_url)
+            if next_url is None:
+                break
+
+            comment_count = len(COMTR_ID_PATTERN.findall(body))
+            if comment_count < full_page:
+                speculate = 0
+            full_page = max(full_page, comment_count)
+
+            pagenum += 1
+            if pagenum in in_flight and in_flight[pagenum][0] != next_url:
+                # guessed wrong, throw away the speculation and follow the real link
+                cancel_speculative()
+            if pagenum not in in_flight and pagenum <= max_pages:
+                submit(pagenum, next_url)
+    finally:
+        cancel_speculative()
+
+
+# which pages of which threads are done, saved after every page so an interrupted crawl can carry on with
+# --resume. a resumed thread re-fetches its last good page (for its "More" link) and goes on from there
+class CrawlState:
+    def __init__(self, path: pathlib.Path, resume: bool):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {"threads": {}}
+        if resume and path.exists():
+            with path.open(mode="rt", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    # url -> {started_unixtime, done, last_page: {pagenum, url} or None, pages: {pagenum: whatever the scraper kept}}
+    def thread(self, url: str) -> dict:
+        with self.lock:
+            return self.state["threads"].setdefault(url, {"started_unixtime": int(time.time()), "done": False, "last_page": None, "pages": {}})
+
+    def page_done(self, url: str, pagenum: int, page_url: str, info: dict) -> None:
+        with self.lock:
+            thread = self.state["threads"][url]
+            thread["pages"][str(pagenum)] = info
+            thread["last_page"] = {"pagenum": pagenum, "url": page_url}
+            self._save()
+
+    def thread_done(self, url: str) -> None:
+        with self.lock:
+            self.state["threads"][url]["done"] = True
+            self._save()
+
+    def _save(self) -> None:
+        temp_path = self.path.with_suffix(".tmp")
+        with temp_path.open(mode="wt", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+# (url to start from, its page number, whether that's a page an earlier run already got)
+def resume_point(url: str, thread_state: dict) -> Tuple[str, int, bool]:
+    last_page = thread_state["last_page"]
+    if last_page is None:
+        return url, 1, False
+    print(f"resuming {url} from page {last_page['pagenum']}")
+    return last_page["url"], last_page["pagenum"], True
+
+
+def scrape_thread(url: str, output_dir: pathlib.Path, session: requests.Session, limiter: RateLimiter, pool: concurrent.futures.Executor,
+                  state: CrawlState, args) -> int:
+    os.makedirs(output_dir, exist_ok=True)
+
+    thread_state = state.thread(url)
+    if thread_state["done"]:
+        print(f"{url} already done")
+        return 0
+    start_url, first_pagenum, resumed = resume_point(url, thread_state)
+
+    manifest = load_manifest(output_dir) if args.incremental else {"pages": {}}
+    old_pages = manifest["pages"]
+    new_pages = {}
+    changed_pages = []
+
+    # whatever the interrupted run had worked out for the pages before the one it stopped at
+    for info in thread_state["pages"].values():
+        if info["pagenum"] < first_pagenum:
+            new_pages[info["file"]] = info["entry"]
+            if info["changed"]:
+                changed_pages.append(info["file"])
+
+    def page_file_name(pagenum: int) -> str:
+        return f"page{pagenum:0>2}.html"
+
+    def headers_for(pagenum: int) -> dict:
+        return conditional_headers(output_dir, old_pages.get(page_file_name(pagenum)))
+
+    def cached_body(pagenum: int) -> str:
+        with (output_dir / page_file_name(pagenum)).open(mode="rt", encoding="utf-8") as f:
+            return f.read()
+
+    pages = iter_thread_pages(start_url, session, limiter, pool, args.max_pages, args.speculate, headers_for, cached_body,
+                              retry=RetryPolicy(args.retries, args.backoff), first_pagenum=first_pagenum)
+    try:
+        for pagenum, page_url, response, body in pages:
+            file_name = page_file_name(pagenum)
+            outpath = output_dir / file_name
+            old_entry = old_pages.get(file_name)
+
+            if response.status_code == 304:
+                print(f"{file_name} not modified")
+                new_pages[file_name] = old_entry
+                state.page_done(url, pagenum, page_url, {"pagenum": pagenum, "file": file_name, "entry": old_entry, "changed": False})
+                continue
+
+            content_hash = hashlib.sha256(body.encode("utf-8")).hexdigest()
+            changed = old_entry is None or old_entry["sha256"] != content_hash
+
+            # in incremental mode a changed page always replaces the stale copy. the page a resume starts
+            # from is this crawl's own, from before it was interrupted
+            ours = resumed and pagenum == first_pagenum
+            written = (args.incremental and changed) or args.clobber or ours or not outpath.exists()
+            if written:
+                with outpath.open(mode="wt", encoding="utf-8") as f:
+                    f.write(body)
+            if changed and file_name not in changed_pages:
+                changed_pages.append(file_name)
+
+            # a page we left alone on disk isn't what we just hashed, so don't vouch for it
+            new_pages[file_name] = None if not written and changed else {
+                "file": file_name,
+                "url": page_url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "sha256": content_hash,
+                "max_comment_id": max_comment_id(body),
+            }
+            state.page_done(url, pagenum, page_url, {"pagenum": pagenum, "file": file_name, "entry": new_pages[file_name], "changed": changed})
+    except ScrapeError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        print(e.response.text, file=sys.stderr)
+        return 1
+    except requests.RequestException as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    # everything above the previous high-water mark is new; parse.py --changed-only uses this
+    # together with changed_pages to skip what's already been imported.
+    # only --incremental keeps the manifest, a plain run doesn't know what it left alone on disk and
+    # would overwrite a good manifest with just the pages it happened to write
+    new_pages = {name: entry for name, entry in new_pages.items() if entry is not None}
+    if args.incremental:
+        manifest = {
+            "url": url,
+            "synced_unixtime": int(time.time()),
+            "baseline_comment_id": max((p["max_comment_id"] or 0 for p in old_pages.values()), default=0),
+            "changed_pages": changed_pages,
+            "pages": new_pages,
+        }
+        save_manifest(output_dir, manifest)
+    state.thread_done(url)
+    print(f"{len(changed_pages)} of {len(new_pages)} page(s) changed in {output_dir}")
+
+    return 0
+
+
+# every page fetched goes into the store as one snapshot of the thread, see pagestore.py
+def scrape_thread_to_store(url: str, store: PageStore, session: requests.Session, limiter: RateLimiter, pool: concurrent.futures.Executor,
+                           state: CrawlState, args) -> int:
+    thread_id = thread_id_from_url(url)
+
+    thread_state = state.thread(url)
+    if thread_state["done"]:
+        print(f"{url} already done")
+        return 0
+    start_url, first_pagenum, _ = resume_point(url, thread_state)
+    # a resumed crawl is still the one snapshot
+    snapshot_unixtime = thread_state["started_unixtime"]
+
+    pages = iter_thread_pages(start_url, session, limiter, pool, args.max_pages, args.speculate,
+                              retry=RetryPolicy(args.retries, args.backoff), first_pagenum=first_pagenum)
+    try:
+        for pagenum, page_url, response, body in pages:
+            sha256 = store.put(int(thread_id), snapshot_unixtime, pagenum, body, url=page_url)
+            state.page_done(url, pagenum, page_url, {"pagenum": pagenum, "sha256": sha256})
+            print(f"page {pagenum} of thread {thread_id} stored")
+    except ScrapeError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        print(e.response.text, file=sys.stderr)
+        return 1
+    except requests.RequestException as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    state.thread_done(url)
+    print(f"{len(thread_state['pages'])} page(s) of thread {thread_id} stored in {store.root}")
+    return 0
+
+
+def main(args) -> int:
+    if args.store:
+        if args.incremental:
+            print("ERROR: --incremental works on --output-dir, the store already keeps unchanged pages once", file=sys.stderr)
+            return 1
+        missing = [url for url in args.url if thread_id_from_url(url) is None]
+        if missing:
+            print(f"ERROR: no thread id in {', '.join(missing)}", file=sys.stderr)
             return 1
+        store = PageStore(args.store)
+        state_dir = pathlib.Path(args.store)
+    elif args.output_dir:
+        # ensure output directory
+        os.makedirs(args.output_dir, exist_ok=True)
+        state_dir = pathlib.Path(args.output_dir)
+    else:
+        print("ERROR: one of --output-dir or --store is required", file=sys.stderr)
+        return 1
+
+    state = CrawlState(state_dir / CRAWL_STATE_FILE_NAME, resume=args.resume)
+    limiter = RateLimiter(rate=args.rate, burst=args.burst)
+    session = make_session(pool_size=args.workers)
 
-        outpath = pathlib.Path(".") / args.output_dir / f"page{pagenum:0>2}.html"
-        if args.clobber or not outpath.exists():
-            with outpath.open(mode="wt", encoding="utf-8") as f:
-                f.write(response.text)
+    # the store keeps threads apart itself. a single thread goes straight into --output-dir as before,
+    # several get a subdirectory each
+    if args.store:
+        targets = [(url, None) for url in args.url]
+    elif len(args.url) == 1:
+        targets = [(args.url[0], pathlib.Path(".") / args.output_dir)]
+    else:
+        base_dir = pathlib.Path(".") / args.output_dir
+        targets = [(url, base_dir / (thread_id_from_url(url) or f"thread{i:0>2}")) for i, url in enumerate(args.url)]
 
-        url = get_next_page(response.text)
-        pagenum += 1
+    # page fetches and per-thread drivers get separate pools, otherwise drivers blocked on
+    # results could starve the fetches they're waiting for
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as fetch_pool, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=len(targets)) as thread_pool:
+        if args.store:
+            futures = [thread_pool.submit(scrape_thread_to_store, url, store, session, limiter, fetch_pool, state, args) for url, _ in targets]
+        else:
+            futures = [thread_pool.submit(scrape_thread, url, outdir, session, limiter, fetch_pool, state, args) for url, outdir in targets]
+        results = [f.result() for f in futures]
 
+    if args.store:
+        store.close()
+
+    failed = sum(1 for x in results if x != 0)
+    if failed:
+        print(f"{failed} thread(s) didn't finish, run again with --resume to carry on where they stopped", file=sys.stderr)
     print("done.")
-    return 0
+    return max(results)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Hacker News scraper")
-    parser.add_argument("--url", required=True, help="Base HN URL to begin scrape from")
-    parser.add_argument("--output-dir", required=True, help="Directory to store output in, will be created if it does not exist")
+    parser.add_argument("--url", required=True, action="append", help="Base HN URL to begin scrape from, may be given more than once")
+    parser.add_argument("--output-dir", required=False, help="Directory to store output in, will be created if it does not exist")
+    parser.add_argument("--store", required=False, help="Page store directory (see pagestore.py) to keep pages in, compressed, instead of --output-dir")
     parser.add_argument("--clobber", required=False, action="store_true", help="If set, overwrite existing files")
-    parser.add_argument("--max-pages", required=False, type=int, default=999, help="Exit after retrieving this many pages")
+    parser.add_argument("--incremental", required=False, action="store_true", help="Re-sync using the manifest: conditional requests, only changed pages are rewritten")
+    parser.add_argument("--resume", required=False, action="store_true", help="Carry on an interrupted crawl from its crawl_state.json, skipping threads it finished")
+    parser.add_argument("--max-pages", required=False, type=int, default=999, help="Exit after retrieving this many pages (per thread)")
+    parser.add_argument("--workers", required=False, type=int, default=4, help="Number of concurrent fetch workers (and pooled connections)")
+    parser.add_argument("--rate", required=False, type=float, default=0.2, help="Requests per second allowed across all workers")
+    parser.add_argument("--burst", required=False, type=int, default=1, help="Requests allowed back-to-back before the rate limit kicks in")
+    parser.add_argument("--speculate", required=False, type=int, default=0, help="Pages to request ahead of the \"More\" link by guessing &p=N, stops after a short page (default 0, off)")
+    parser.add_argument("--retries", required=False, type=int, default=5, help="Times to retry a page on a 429/5xx or connection error before giving up on the thread")
+    parser.add_argument("--backoff", required=False, type=float, default=2.0, help="Seconds to back off before the first retry, doubling (with jitter) on each one after")
     args = parser.parse_args()
 
     sys.exit(main(args))
@@ -0,0 +1,95 @@
+import sqlite3
+
+from commentdb import SqliteCommentDB, FilterMode, REJECTED, restore_session
+
+
+def make_db(tmp_path, records=None) -> SqliteCommentDB:
+    if records is None:
+        records = [{"comment_id": comment_id, "thread_id": 1, "body": f"post {comment_id}"} for comment_id in range(1, 11)]
+    return SqliteCommentDB.import_records(records, str(tmp_path / "posts.db"))
+
+
+def journal_mode(cdb: SqliteCommentDB) -> str:
+    return cdb.dbconn.execute("pragma journal_mode").fetchone()["journal_mode"]
+
+
+def test_write_behind_restores_journal_mode(tmp_path):
+    cdb = make_db(tmp_path)
+    before = journal_mode(cdb)
+    assert before != "wal"
+
+    cdb.enable_write_behind()
+    assert journal_mode(cdb) == "wal"
+    cdb.reject("")
+    cdb.close()
+
+    assert journal_mode(cdb) == before
+    assert not (tmp_path / "posts.db-wal").exists()
+    dbconn = sqlite3.connect(tmp_path / "posts.db")
+    assert dbconn.execute("select status from comment where comment_id = 1").fetchone() == (REJECTED,)
+
+
+def test_search_ranked_with_snippets(tmp_path):
+    cdb = make_db(tmp_path, [
+        {"comment_id": 1, "thread_id": 1, "body": "Acme | Backend | Denver\nWe use Go and a little rust on the side, plus lots of other things besides"},
+        {"comment_id": 2, "thread_id": 1, "body": "Initech | SRE | Austin\nNothing to see here"},
+        {"comment_id": 3, "thread_id": 1, "body": "Globex | Rust Engineer\nRust, rust and more Rust"},
+        {"comment_id": 4, "thread_id": 2, "body": "Hooli | Rust | Remote\nRust everywhere"},
+    ])
+    cdb.thread_id = 1
+
+    results = cdb.search("rust")
+    assert [x["comment_id"] for x in results] == [3, 1]
+    assert results[0]["rank"] <= results[1]["rank"]
+    assert "[Rust]" in results[0]["snippet"]
+    assert "[rust]" in results[1]["snippet"]
+
+    cdb.thread_id = None
+    assert sorted(x["comment_id"] for x in cdb.search("rust", limit=None)) == [1, 3, 4]
+    assert len(cdb.search("rust", limit=1)) == 1
+    assert cdb.search("  ") == []
+
+
+def test_list_rows_in_order_asked(tmp_path):
+    cdb = make_db(tmp_path)
+    assert [x["comment_id"] for x in cdb.list_rows([7, 2, 99, 5])] == [7, 2, 5]
+
+
+def test_session_round_trip(tmp_path):
+    records = [{"comment_id": comment_id, "thread_id": 1 if comment_id <= 10 else 2,
+                "body": f"Acme {comment_id} | Engineer | Denver, CO | Remote\n{'rust' if comment_id % 2 else 'go'} shop"}
+               for comment_id in range(1, 21)]
+    cdb = make_db(tmp_path, records)
+    assert cdb.load_session() is None
+
+    cdb.thread_id = 2
+    cdb.search_query = "rust"
+    cdb.set_field_filter(remote_only=True, locations=["Denver"])
+    cdb.filter_mode = FilterMode.SEARCH
+    assert cdb.goto(15)
+    cdb.save_session({"tab": "tab__list"})
+    cdb.close()
+
+    cdb = SqliteCommentDB.from_db_file(str(tmp_path / "posts.db"))
+    session = cdb.load_session()
+    assert session["ui_state"] == {"tab": "tab__list"}
+    restore_session(cdb, session)
+
+    assert (cdb.thread_id, cdb.filter_mode, cdb.search_query, cdb.comment_id) == (2, FilterMode.SEARCH, "rust", 15)
+    assert (cdb.remote_only, cdb.locations) == (True, ["Denver"])
+    assert cdb.next() and cdb.comment_id == 17
+
+
+# the post it was left on has been deleted since: the first one passing the filter instead
+def test_session_post_gone(tmp_path):
+    cdb = make_db(tmp_path)
+    cdb.filter_mode = FilterMode.ALL_UNSTATUSED
+    assert cdb.goto(4)
+    cdb.save_session()
+    cdb.dbconn.execute("delete from comment where comment_id = 4")
+    cdb.dbconn.commit()
+    session = cdb.load_session()
+
+    cdb = SqliteCommentDB.from_db_file(str(tmp_path / "posts.db"))
+    restore_session(cdb, session)
+    assert (cdb.filter_mode, cdb.comment_id) == (FilterMode.ALL_UNSTATUSED, 1)
@@ -0,0 +1,38 @@
+import pytest
+
+from fields import extract_fields
+
+
+@pytest.mark.parametrize("header, locations, remote", [
+    ("Acme | Backend Engineer | Denver, CO | Remote | $120k-$150k", ["Denver, CO"], True),
+    ("Bar | London | Hybrid", ["London"], False),
+    ("Foo Inc. | NYC or Remote | $150k - $180k", ["NYC"], True),
+    ("Baz | Senior Engineer | New York City | ONSITE", ["New York City"], False),
+    ("Qux | SF / NYC | Full-time", ["SF", "NYC"], None),
+    ("Quux | Remote (US) | Full-Time", ["US"], True),
+    ("Corge | San Francisco, Seattle, NYC, Dublin | Full-time", ["San Francisco", "Seattle", "NYC", "Dublin"], None),
+    ("Grault | San Francisco, CA, Toronto, ON, Canada | Hybrid", ["San Francisco, CA", "Toronto, ON, Canada"], False),
+    ("Garply | Dublin, Ireland or London, UK", ["Dublin, Ireland", "London, UK"], None),
+])
+def test_locations(header, locations, remote):
+    fields = extract_fields(header + "\nmore text")
+    assert fields["locations"] == locations
+    assert fields["remote"] == remote
+
+
+# segments shaped like a bare place that aren't one
+@pytest.mark.parametrize("header", [
+    "Acme | Staff Engineer | Remote | https://acme.example/jobs",
+    "Acme | YC W21 | Python | Full-time",
+    "Acme | Visa Sponsorship | Remote",
+    "Acme | $120k - $150k | Remote",
+    "Acme | Go, Rust | Remote",
+])
+def test_not_locations(header):
+    assert extract_fields(header)["locations"] == []
+
+
+def test_no_header():
+    fields = extract_fields("We're hiring in London, come work with us")
+    assert fields["company"] is None
+    assert fields["locations"] == []
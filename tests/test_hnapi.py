@@ -0,0 +1,114 @@
+import random
+import asyncio
+import argparse
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import bench
+import parse
+import hnapi
+
+
+THREAD_ID = bench.THREAD_ID
+
+# HN-shaped comment text the generated posts don't cover: a link after a code block (outside any <p> on
+# the page, so written as its href) whose text is HN's truncated form of the URL
+EXTRA_TEXTS = [
+    'See<p><pre><code>  x = 1\n  y = 2</code></pre>See <a href="https://example.com/a/very/long/path" rel="nofollow">example.com/a/very/...</a> now',
+    'Intro <a href="https://example.com/x" rel="nofollow">example.com/x</a><p>more <a href="https://example.com/y" rel="nofollow">example.com/y</a><p><pre><code>code</code></pre>after',
+]
+
+
+# the same comments as a thread page (for parse.py) and as API items (for hnapi.py), replies included in
+# the page but only top-level comments among the thread's kids, as on HN
+def make_thread(rows: int = 60, seed: int = 1):
+    rng = random.Random(seed)
+    page_rows = []
+    items = {}
+    kids = []
+    for n in range(rows):
+        comment_id = THREAD_ID + 1 + n
+        posted = bench.POSTED_UNIXTIME + n * 30
+        if n % 4 == 3:
+            page_rows.append(bench.comtr_row(comment_id, 1, bench.reply_html(rng), f"user{n}", posted))
+            continue
+        text = EXTRA_TEXTS[n % len(EXTRA_TEXTS)] if n % 5 == 0 else bench.post_html(rng, n)
+        page_rows.append(bench.comtr_row(comment_id, 0, text, f"user{n}", posted))
+        items[comment_id] = {"id": comment_id, "by": f"user{n}", "time": posted, "text": text, "parent": THREAD_ID, "type": "comment"}
+        kids.append(comment_id)
+
+    # gone from the page, still listed in kids
+    items[THREAD_ID + rows + 1] = {"id": THREAD_ID + rows + 1, "deleted": True, "type": "comment"}
+    kids.append(THREAD_ID + rows + 1)
+
+    items[THREAD_ID] = {"id": THREAD_ID, "type": "story", "kids": kids}
+    return bench.thread_page(1, page_rows, last=True), items
+
+
+def fake_api(items: dict) -> web.Application:
+    failed_once = set()
+
+    async def item(request: web.Request) -> web.Response:
+        item_id = int(request.match_info["item_id"])
+        # every tenth item is busy the first time it's asked for
+        if item_id % 10 == 0 and item_id not in failed_once:
+            failed_once.add(item_id)
+            return web.Response(status=503)
+        return web.json_response(items.get(item_id))
+
+    app = web.Application()
+    app.router.add_get("/v0/item/{item_id}.json", item)
+    return app
+
+
+# the records handed over for each thread, and the ids of the threads that failed
+async def fetch_from_fake_api(items: dict, skip_ids=frozenset(), thread_ids=(THREAD_ID,)):
+    fetched = {}
+    async with TestServer(fake_api(items)) as server:
+        args = argparse.Namespace(api_url=str(server.make_url("/v0/")), concurrency=5, retries=3, backoff=0.01, timeout=10.0)
+        failed = await hnapi.fetch_threads(list(thread_ids), set(skip_ids), args, fetched.__setitem__)
+    return fetched, failed
+
+
+def test_records_match_parse():
+    page, items = make_thread()
+    expected = sorted(parse.iter_comments(page), key=lambda x: x["comment_id"])
+    fetched, _ = asyncio.run(fetch_from_fake_api(items))
+    records = sorted(fetched[THREAD_ID], key=lambda x: x["comment_id"])
+
+    assert len(expected) > 0
+    assert records == expected
+
+
+def test_skips_existing():
+    page, items = make_thread()
+    skip_ids = {x for x in items[THREAD_ID]["kids"][:10]}
+    fetched, _ = asyncio.run(fetch_from_fake_api(items, skip_ids))
+    records = fetched[THREAD_ID]
+
+    assert skip_ids.isdisjoint(x["comment_id"] for x in records)
+    assert len(records) == len([x for x in parse.iter_comments(page) if x["comment_id"] not in skip_ids])
+
+
+def test_format_item_text_link_after_code_block():
+    assert hnapi.format_item_text(EXTRA_TEXTS[0]).endswith("See https://example.com/a/very/long/path now")
+
+
+# a thread that can't be fetched is reported, the others are still handed over
+def test_failed_thread_doesnt_stop_the_others():
+    page, items = make_thread()
+    fetched, failed = asyncio.run(fetch_from_fake_api(items, thread_ids=(THREAD_ID, 1)))
+
+    assert failed == [1]
+    assert list(fetched) == [THREAD_ID]
+    assert len(fetched[THREAD_ID]) == len(list(parse.iter_comments(page)))
+
+
+def test_import_thread(tmp_path):
+    page, items = make_thread()
+    fetched, _ = asyncio.run(fetch_from_fake_api(items))
+    db_file_name = str(tmp_path / "posts.db")
+    hnapi.import_thread(db_file_name, THREAD_ID, fetched[THREAD_ID])
+
+    assert hnapi.existing_comment_ids(db_file_name, [THREAD_ID]) == {x["comment_id"] for x in fetched[THREAD_ID]}
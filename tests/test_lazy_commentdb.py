@@ -0,0 +1,61 @@
+import json
+
+from commentdb import LazyCommentDB, FilterMode, MAYBE
+
+
+def make_db(tmp_path) -> LazyCommentDB:
+    file_name = tmp_path / "posts.jsonl"
+    with open(file_name, mode="wt", encoding="utf-8") as f:
+        for comment_id in range(1, 21):
+            record = {"comment_id": comment_id, "thread_id": 1 if comment_id <= 10 else 2, "body": f"post {comment_id}"}
+            if comment_id == 3:
+                record["status"] = MAYBE
+            f.write(json.dumps(record) + "\n")
+    return LazyCommentDB(str(file_name))
+
+
+# a status set outside thread 1 mustn't end up in thread 1's cached positions
+def test_status_change_outside_scope(tmp_path):
+    cdb = make_db(tmp_path)
+    cdb.thread_id = 1
+    cdb.filter_mode = FilterMode.MAYBE_ONLY
+    assert cdb.first() and cdb.comment_id == 3
+
+    cdb.thread_id = None
+    assert cdb.goto(15)
+    cdb.maybe("")
+
+    cdb.thread_id = 1
+    assert cdb.first() and cdb.comment_id == 3
+    assert not cdb.next()
+    cdb.close()
+
+
+def test_status_change_inside_scope(tmp_path):
+    cdb = make_db(tmp_path)
+    cdb.thread_id = 1
+    cdb.filter_mode = FilterMode.MAYBE_ONLY
+    cdb.first()
+
+    assert cdb.goto(5)
+    cdb.maybe("")
+    assert cdb.first() and cdb.comment_id == 3
+    assert cdb.next() and cdb.comment_id == 5
+
+    cdb.reject("")
+    assert cdb.first() and cdb.comment_id == 3
+    assert not cdb.next()
+    cdb.close()
+
+
+# statuses are kept in the overlay file and come back on reopening
+def test_overlay_survives_reopen(tmp_path):
+    cdb = make_db(tmp_path)
+    assert cdb.goto(12)
+    cdb.maybe("later")
+    cdb.close()
+
+    cdb = LazyCommentDB(str(tmp_path / "posts.jsonl"))
+    assert cdb.goto(12)
+    assert cdb.status == MAYBE and cdb.notes == "later"
+    cdb.close()
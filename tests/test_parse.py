@@ -0,0 +1,54 @@
+import pathlib
+
+import pytest
+
+import parse
+
+
+# saved pages covering what the comment formatters handle: a/p/pre/i/b/u, the reply div, text after
+# inline tags, an HTML comment inside the text, a dead comment with no author and a deleted one with no text
+PAGES_DIR = pathlib.Path(__file__).parent / "pages"
+PAGES = sorted(PAGES_DIR.glob("*.html"))
+
+
+def read_page(path: pathlib.Path) -> str:
+    with path.open(mode="rt", encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("path", PAGES, ids=lambda x: x.name)
+def test_lxml_matches_html5lib(path):
+    pytest.importorskip("lxml")
+    contents = read_page(path)
+    expected = list(parse.iter_comments_html5lib(contents))
+
+    assert len(expected) > 0
+    assert list(parse.iter_comments_lxml(contents)) == expected
+
+
+@pytest.mark.parametrize("parser", ["html5lib", "lxml"])
+def test_comment_bodies(parser):
+    if parser == "lxml":
+        pytest.importorskip("lxml")
+    records = {}
+    for path in PAGES:
+        records.update((x["comment_id"], x) for x in parse.PARSERS[parser](read_page(path)))
+
+    # replies and the deleted comment are skipped
+    assert sorted(records) == [28719321, 28719323, 28719324, 28719325]
+
+    assert records[28719321]["body"].startswith("Acme | Backend Engineer | Denver, CO | Remote | $120k - $160k\n\n"
+                                                "We build fast things with Python and Postgres, see https://example.com/jobs & apply.")
+    assert "  pip install acme\n  acme --helpQuestions?" in records[28719321]["body"]
+    assert "reply" not in records[28719321]["body"]
+    assert records[28719323]["body"] == "Initech | SRE | Austin, TX | Onsite tail after the comment bold tail after bold italic\n\nlast word tail"
+
+    assert records[28719325]["author"] is None
+    assert records[28719325]["body"] == "Dead post text still shown with showdead"
+    assert records[28719324]["author"] == "dave"
+    assert records[28719324]["posted_unixtime"] == 1633100502
+
+
+# with only html5lib available this has nothing to compare, but still has to come out clean
+def test_compare_parsers():
+    assert parse.compare_parsers(PAGES_DIR) == 0
@@ -0,0 +1,138 @@
+import re
+import json
+import time
+import argparse
+import threading
+import http.server
+
+import pytest
+
+import bench
+import scrape
+
+
+THREAD_ID = bench.THREAD_ID
+PAGES = 3
+
+
+def make_pages(pages: int = PAGES, rows_per_page: int = 4) -> dict:
+    rows = [bench.comtr_row(THREAD_ID + 1 + n, 0, f"Acme {n} | Engineer | Remote", f"user{n}", bench.POSTED_UNIXTIME + n * 30)
+            for n in range(pages * rows_per_page)]
+    return {pagenum: bench.thread_page(pagenum, rows[(pagenum - 1) * rows_per_page:pagenum * rows_per_page], last=pagenum == pages)
+            for pagenum in range(1, pages + 1)}
+
+
+# serves make_pages() as HN would, except that errors[pagenum] (a list of (status, headers)) is answered
+# first, one per request, and pages in broken always get a 503. every request is logged as
+# (pagenum, time.monotonic(), status)
+class FakeHN(http.server.ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeHNHandler)
+        self.pages = make_pages()
+        self.errors = {}
+        self.broken = set()
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def thread_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/item?id={THREAD_ID}"
+
+    def requested_pages(self) -> list:
+        return [pagenum for pagenum, _, _ in self.requests]
+
+
+class FakeHNHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        match = re.search(r"[?&]p=(\d+)", self.path)
+        pagenum = int(match.group(1)) if match else 1
+
+        with self.server.lock:
+            if self.server.errors.get(pagenum):
+                status, headers = self.server.errors[pagenum].pop(0)
+            elif pagenum in self.server.broken:
+                status, headers = 503, {}
+            elif pagenum in self.server.pages:
+                status, headers = 200, {"Content-Type": "text/html; charset=utf-8"}
+            else:
+                status, headers = 404, {}
+            self.server.requests.append((pagenum, time.monotonic(), status))
+
+        body = self.server.pages[pagenum].encode("utf-8") if status == 200 else b"busy"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = FakeHN()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def scrape_args(server: FakeHN, output_dir, resume: bool = False, retries: int = 2) -> argparse.Namespace:
+    return argparse.Namespace(url=[server.thread_url], output_dir=str(output_dir), store=None, clobber=False, incremental=False,
+                              resume=resume, max_pages=999, workers=2, rate=1000.0, burst=10, speculate=0, retries=retries, backoff=0.01)
+
+
+def thread_state(output_dir, url: str) -> dict:
+    with (output_dir / scrape.CRAWL_STATE_FILE_NAME).open(mode="rt", encoding="utf-8") as f:
+        return json.load(f)["threads"][url]
+
+
+@pytest.mark.parametrize("status", [503, 429])
+def test_retry_after_is_honoured(server, status):
+    server.errors[1] = [(status, {"Retry-After": "1"})]
+    session = scrape.make_session(pool_size=1)
+    limiter = scrape.RateLimiter(rate=1000.0, burst=10)
+
+    response = scrape.fetch(session, limiter, server.thread_url, retry=scrape.RetryPolicy(retries=2, backoff=0.01))
+
+    assert response.status_code == 200
+    (_, first, first_status), (_, second, second_status) = server.requests
+    assert (first_status, second_status) == (status, 200)
+    assert second - first >= 1.0
+
+
+def test_client_error_is_not_retried(server, tmp_path):
+    server.errors[2] = [(403, {})]
+
+    assert scrape.main(scrape_args(server, tmp_path, retries=5)) == 1
+    assert server.requested_pages() == [1, 2]
+    assert thread_state(tmp_path, server.thread_url)["last_page"]["pagenum"] == 1
+    assert not thread_state(tmp_path, server.thread_url)["done"]
+
+
+def test_retries_run_out_then_resume(server, tmp_path):
+    server.broken.add(3)
+
+    assert scrape.main(scrape_args(server, tmp_path, retries=2)) == 1
+    assert server.requested_pages() == [1, 2, 3, 3, 3]
+    state = thread_state(tmp_path, server.thread_url)
+    assert not state["done"]
+    assert state["last_page"]["pagenum"] == 2
+    assert not (tmp_path / "page03.html").exists()
+
+    # carries on from the last good page (for its "More" link), nothing before it is asked for again
+    server.broken.clear()
+    server.requests.clear()
+    assert scrape.main(scrape_args(server, tmp_path, resume=True)) == 0
+    assert server.requested_pages() == [2, 3]
+    assert thread_state(tmp_path, server.thread_url)["done"]
+    for pagenum in range(1, PAGES + 1):
+        assert (tmp_path / f"page{pagenum:0>2}.html").read_text(encoding="utf-8") == server.pages[pagenum]
+
+    # and once it's done, a resume has nothing left to fetch
+    server.requests.clear()
+    assert scrape.main(scrape_args(server, tmp_path, resume=True)) == 0
+    assert server.requests == []
@@ -0,0 +1,67 @@
+import pytest
+
+import triage
+from commentdb import SqliteCommentDB, REJECTED, MAYBE
+
+
+def make_db(tmp_path) -> SqliteCommentDB:
+    records = [
+        # last month, already reviewed
+        {"comment_id": 1, "thread_id": 100, "author": "alice", "body": "Acme | Backend Engineer | Remote"},
+        {"comment_id": 2, "thread_id": 100, "author": "bob", "body": "Initech | SRE | Austin, TX"},
+        # this month
+        {"comment_id": 11, "thread_id": 200, "author": "alice", "body": "Acme Robotics | Backend Engineer | Remote"},
+        {"comment_id": 12, "thread_id": 200, "author": "carol", "body": "INITECH | Data Engineer | Austin, TX"},
+        {"comment_id": 13, "thread_id": 200, "author": "dave", "body": "Globex | Engineer | Denver, CO"},
+    ]
+    cdb = SqliteCommentDB.import_records(records, str(tmp_path / "posts.db"))
+    assert cdb.goto(1)
+    cdb.reject("not hiring in my area")
+    assert cdb.goto(2)
+    cdb.maybe("")
+    return cdb
+
+
+def statuses(cdb: SqliteCommentDB) -> dict:
+    return {row["comment_id"]: (row["status"], row["notes"]) for row in cdb.dbconn.execute("select comment_id, status, notes from comment")}
+
+
+def test_import_leaves_statuses_alone(tmp_path):
+    cdb = make_db(tmp_path)
+    assert all(statuses(cdb)[x][0] is None for x in (11, 12, 13))
+
+
+def test_carry_forward_by_author_and_company(tmp_path):
+    cdb = make_db(tmp_path)
+    rules = [triage.Rule({"name": "regulars", "carry_forward": ["author", "company"]})]
+
+    [(rule, count, sample)] = triage.apply_rules(cdb.dbconn, rules, dry_run=True)
+    assert count == 2
+    assert sample[0] == "1 by author, 1 by company"
+    assert statuses(cdb)[11] == (None, None)
+
+    triage.apply_rules(cdb.dbconn, rules)
+    after = statuses(cdb)
+    assert after[11] == (REJECTED, "auto: regulars (same author as 1): not hiring in my area")
+    assert after[12] == (MAYBE, "auto: regulars (same company as 2)")
+    assert after[13] == (None, None)
+
+
+def test_carry_forward_by_company_only(tmp_path):
+    cdb = make_db(tmp_path)
+    [(_, count, _)] = triage.apply_rules(cdb.dbconn, [triage.Rule({"name": "companies", "carry_forward": ["company"]})])
+
+    assert count == 1
+    assert statuses(cdb)[11] == (None, None)
+    assert statuses(cdb)[12][0] == MAYBE
+
+
+@pytest.mark.parametrize("spec", [
+    {"name": "x", "carry_forward": ["email"]},
+    {"name": "x", "carry_forward": []},
+    {"name": "x", "carry_forward": ["author"], "status": REJECTED},
+    {"name": "x", "carry_forward": ["author"], "keywords": ["rust"]},
+])
+def test_bad_carry_forward_rules(spec):
+    with pytest.raises(triage.RuleError):
+        triage.Rule(spec)
@@ -0,0 +1,275 @@
+import sys
+import re
+import json
+import time
+import argparse
+import functools
+import collections
+import sqlite3
+from typing import List, Optional, Tuple
+
+from commentdb import REJECTED, MAYBE, SqliteCommentDB, search_terms
+
+
+# Every month the same posts get rejected for the same reasons. A rules file captures those reasons and
+# applies them to the whole comment table in one go, so the review queue starts with only the posts
+# that need a human. The rules file is a JSON list like
+#
+#   [
+#     {"name": "crypto", "status": "REJECTED", "keywords": ["blockchain", "web3", "defi"]},
+#     {"name": "php shops", "status": "REJECTED", "regex": ["\\bphp\\b", "\\blaravel\\b"]},
+#     {"name": "bay area onsite", "status": "REJECTED", "locations": ["San Francisco", "SF"], "remote": false},
+#     {"name": "lowball", "status": "REJECTED", "salary_below": 100000, "note": "pays under 100k"},
+#     {"name": "friends", "status": "MAYBE", "company": ["Acme", "Initech"]},
+#     {"name": "reposts", "copy_similar": 0.8},
+#     {"name": "regulars", "carry_forward": ["author", "company"]}
+#   ]
+#
+# Within a rule every predicate given must hold, within a predicate any of the listed values will do:
+#   keywords      words or phrases, matched through the full-text index
+#   regex         Python regular expressions over the body, case-insensitive
+#   company       company names from the header line, any case
+#   locations     location prefixes from the header line, any case
+#   remote        true/false as read from the header line
+#   salary_below  the top of the posted salary range is under this
+# A copy_similar rule stands alone: posts at least that similar (0-1, see minhash.py) to an earlier post
+# from another thread take that post's status, whatever it was. So does a carry_forward rule: posts take
+# the status of the latest post from an earlier thread by the same author and/or from the same company.
+# Only posts without a status are touched and rules apply in file order, so the first matching rule
+# wins. Each post gets a note saying which rule got it.
+
+RULE_KEYS = ("name", "status", "note", "keywords", "regex", "company", "locations", "remote", "salary_below", "copy_similar", "carry_forward")
+CARRY_FORWARD_MATCHES = ("author", "company")
+
+
+class RuleError(Exception):
+    pass
+
+
+class Rule:
+    def __init__(self, spec: dict):
+        unknown = set(spec) - set(RULE_KEYS)
+        if unknown:
+            raise RuleError(f"unknown key(s) {', '.join(sorted(unknown))} in rule {spec.get('name')!r}")
+        if "name" not in spec:
+            raise RuleError(f"rule has no name: {spec}")
+
+        self.name = spec["name"]
+        self.status = spec.get("status", REJECTED)
+        if self.status not in (REJECTED, MAYBE):
+            raise RuleError(f"rule {self.name!r}: status must be {REJECTED} or {MAYBE}")
+        self.note = f"auto: {spec.get('note', self.name)}"
+
+        self.keywords = spec.get("keywords", [])
+        self.regex = spec.get("regex", [])
+        self.company = spec.get("company", [])
+        self.locations = spec.get("locations", [])
+        self.remote = spec.get("remote")
+        self.salary_below = spec.get("salary_below")
+        self.copy_similar = spec.get("copy_similar")
+        self.carry_forward = spec.get("carry_forward")
+
+        if self.keywords and not any(search_terms(x) for x in self.keywords):
+            raise RuleError(f"rule {self.name!r}: keywords have no words in them")
+
+        # all the patterns become one alternation, so the body is scanned once per rule
+        self.pattern = "|".join(f"(?:{x})" for x in self.regex)
+        if self.pattern:
+            try:
+                re.compile(self.pattern)
+            except re.error as e:
+                raise RuleError(f"rule {self.name!r}: bad regex: {e}")
+
+        if self.copy_similar is not None and self.carry_forward is not None:
+            raise RuleError(f"rule {self.name!r}: copy_similar and carry_forward go in separate rules")
+        if self.copy_similar is not None:
+            if not 0 < self.copy_similar <= 1:
+                raise RuleError(f"rule {self.name!r}: copy_similar must be between 0 and 1")
+            if self.where_clauses()[0] or "status" in spec:
+                raise RuleError(f"rule {self.name!r}: copy_similar can't be combined with a status or other predicates")
+        elif self.carry_forward is not None:
+            if not self.carry_forward or set(self.carry_forward) - set(CARRY_FORWARD_MATCHES):
+                raise RuleError(f"rule {self.name!r}: carry_forward must list any of {', '.join(CARRY_FORWARD_MATCHES)}")
+            if self.where_clauses()[0] or "status" in spec:
+                raise RuleError(f"rule {self.name!r}: carry_forward can't be combined with a status or other predicates")
+        elif not self.where_clauses()[0]:
+            raise RuleError(f"rule {self.name!r} has no predicates, it would match everything")
+
+
+    # (list of SQL conditions to AND together, their named parameters)
+    def where_clauses(self) -> Tuple[List[str], dict]:
+        clauses = []
+        params = {"status": self.status, "note": self.note}
+
+        if self.keywords:
+            # each keyword is a phrase, any of them will do
+            phrases = ['"' + " ".join(search_terms(x)) + '"' for x in self.keywords if search_terms(x)]
+            clauses.append("comment_id in (select rowid from comment_fts where comment_fts match :keywords)")
+            params["keywords"] = " OR ".join(phrases)
+        if self.pattern:
+            clauses.append("body regexp :pattern")
+            params["pattern"] = self.pattern
+        if self.company:
+            names = ", ".join(f":company{i}" for i in range(len(self.company)))
+            clauses.append(f"company collate nocase in ({names})")
+            params.update({f"company{i}": x for i, x in enumerate(self.company)})
+        if self.locations:
+            matches = " or ".join(f"location like :location{i}" for i in range(len(self.locations)))
+            clauses.append(f"comment_id in (select comment_id from comment_location where {matches})")
+            params.update({f"location{i}": re.sub(r"[%_]", "", x) + "%" for i, x in enumerate(self.locations)})
+        if self.remote is not None:
+            clauses.append("remote = :remote")
+            params["remote"] = int(self.remote)
+        if self.salary_below is not None:
+            clauses.append("salary_max < :salary_below")
+            params["salary_below"] = self.salary_below
+
+        return clauses, params
+
+
+def load_rules(rules_file_name: str) -> List[Rule]:
+    with open(rules_file_name, mode="rt", encoding="utf-8") as f:
+        specs = json.load(f)
+    return [Rule(spec) for spec in specs]
+
+
+@functools.lru_cache(maxsize=64)
+def _compile(pattern: str) -> re.Pattern:
+    return re.compile(pattern, re.IGNORECASE)
+
+
+# `x REGEXP y` in SQLite calls regexp(y, x)
+def _regexp(pattern: str, value: Optional[str]) -> bool:
+    return value is not None and _compile(pattern).search(value) is not None
+
+
+# applies every rule as one UPDATE over the whole table, all in one transaction. with dry_run the
+# transaction is rolled back, the counts are still right because later rules see earlier rules' changes.
+# returns [(rule, number of posts it caught, a few of their header lines)]
+def apply_rules(dbconn: sqlite3.Connection, rules: List[Rule], dry_run: bool = False, samples: int = 3) -> List[Tuple[Rule, int, List[str]]]:
+    dbconn.create_function("regexp", 2, _regexp, deterministic=True)
+    now = int(time.time())
+
+    results = []
+    try:
+        for rule in rules:
+            if rule.copy_similar is not None:
+                results.append(_copy_similar(dbconn, rule, now, samples))
+                continue
+            if rule.carry_forward is not None:
+                results.append(_carry_forward(dbconn, rule, now, samples))
+                continue
+
+            clauses, params = rule.where_clauses()
+            where = " and ".join(["status is null"] + clauses)
+
+            sample_rows = dbconn.execute(f"select body from comment where {where} order by comment_id limit {samples}", params).fetchall()
+            cursor = dbconn.execute(f"""
+                update comment
+                   set status = :status
+                     , notes = coalesce(notes || char(10), '') || :note
+                     , modified_unixtime = :modified_unixtime
+                 where {where}
+            """.strip(), dict(params, modified_unixtime=now))
+
+            results.append((rule, cursor.rowcount, [row["body"].split("\n", 1)[0][:100] for row in sample_rows]))
+    except BaseException:
+        dbconn.rollback()
+        raise
+
+    if dry_run:
+        dbconn.rollback()
+    else:
+        dbconn.commit()
+    return results
+
+
+def _copy_similar(dbconn: sqlite3.Connection, rule: Rule, now: int, samples: int) -> Tuple[Rule, int, List[str]]:
+    pairs = SqliteCommentDB.similar_reviewed_pairs(dbconn, rule.copy_similar)
+
+    update_query = """
+        update comment
+           set (status, notes, modified_unixtime) = (
+                 select prior.status
+                      , :note || ' (' || :similarity || ' like ' || prior.comment_id || ')' || coalesce(': ' || prior.notes, '')
+                      , :modified_unixtime
+                   from comment prior
+                  where prior.comment_id = :prior_id
+               )
+         where comment_id = :comment_id
+           and status is null
+    """.strip()
+    params = [dict(note=rule.note, similarity=f"{score:.0%}", modified_unixtime=now, prior_id=prior_id, comment_id=comment_id)
+              for comment_id, prior_id, score in pairs]
+    cursor = dbconn.executemany(update_query, params)
+
+    sample = [f"#{comment_id} is {score:.0%} like #{prior_id}" for comment_id, prior_id, score in pairs[:samples]]
+    return rule, cursor.rowcount, sample
+
+
+def _carry_forward(dbconn: sqlite3.Connection, rule: Rule, now: int, samples: int) -> Tuple[Rule, int, List[str]]:
+    pairs = SqliteCommentDB.carried_forward_pairs(dbconn, rule.carry_forward)
+
+    update_query = """
+        update comment
+           set (status, notes, modified_unixtime) = (
+                 select prior.status
+                      , :note || ' (same ' || :kind || ' as ' || prior.comment_id || ')' || coalesce(': ' || nullif(prior.notes, ''), '')
+                      , :modified_unixtime
+                   from comment prior
+                  where prior.comment_id = :prior_id
+               )
+         where comment_id = :comment_id
+           and status is null
+    """.strip()
+    params = [dict(note=rule.note, kind=kind, modified_unixtime=now, prior_id=prior_id, comment_id=comment_id)
+              for comment_id, prior_id, kind in pairs]
+    cursor = dbconn.executemany(update_query, params)
+
+    by_kind = collections.Counter(kind for _, _, kind in pairs)
+    sample = [", ".join(f"{by_kind[kind]} by {kind}" for kind in rule.carry_forward)]
+    sample += [f"#{comment_id} has the same {kind} as #{prior_id}" for comment_id, prior_id, kind in pairs[:samples]]
+    return rule, cursor.rowcount, sample
+
+
+def print_report(results: List[Tuple[Rule, int, List[str]]], remaining: int, dry_run: bool) -> None:
+    width = max((len(rule.name) for rule, _, _ in results), default=4)
+    for rule, count, sample in results:
+        status = "(copied)" if rule.copy_similar is not None or rule.carry_forward is not None else rule.status
+        print(f"{rule.name:<{width}}  {status:<8}  {count:>6}")
+        for header in sample:
+            print(f"{'':<{width}}    {header}")
+
+    total = sum(count for _, count, _ in results)
+    verb = "would be" if dry_run else "were"
+    print(f"{total} post(s) {verb} triaged, {remaining} left for review")
+
+
+def main(args) -> int:
+    try:
+        rules = load_rules(args.rules_file)
+    except (RuleError, json.JSONDecodeError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    cdb = SqliteCommentDB.from_db_file(args.db_file)
+    results = apply_rules(cdb.dbconn, rules, dry_run=args.dry_run)
+    remaining = cdb.dbconn.execute("select count(*) as n from comment where status is null").fetchone()["n"]
+    if args.dry_run:
+        remaining -= sum(count for _, count, _ in results)
+
+    print_report(results, remaining, args.dry_run)
+    if args.dry_run:
+        print("dry run, nothing was changed")
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a file of triage rules to every unreviewed post in one pass")
+    parser.add_argument("--db-file", required=True, help="SQLite database file to work with")
+    parser.add_argument("--rules-file", required=True, help="JSON file of rules, see the top of triage.py")
+    parser.add_argument("--dry-run", required=False, action="store_true", help="Report what would be triaged without changing anything")
+    args = parser.parse_args()
+
+    sys.exit(main(args))